@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""Benchmark the stages of the pipeline, from the raw downloads to the sources.
+
+Each stage is timed on the raw downloads and on synthetic trees made from them,
+scaled up in number of endpoints and in nesting depth: at a scale of N, each
+endpoint directory is copied N times, and the deepest object of each message gets
+a chain of log2(N) more nested objects. The top-level types of the copies are
+renamed, and their objects get a field of their own, so that they are distinct
+types for the generators rather than duplicates. The results are written as
+JSON, and can be compared against those of a previous run to catch regressions
+between commits.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import convert_ameritrade_schemas
+import generate_messages
+import generate_proto_schemas
+import schema_registry
+from convert_ameritrade_schemas import JSON
+
+
+# Raw downloads.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+
+# The name of the field of the nested objects added to deepen the messages.
+NESTED_FIELD = 'nested'
+
+# The prefix of the name of the field added to the objects of the copies.
+COPY_FIELD = 'copy'
+
+
+def Suffix(index: int) -> str:
+    """Return a suffix for the name of a copy, made of letters only."""
+    return str(index).translate(str.maketrans('0123456789', 'abcdefghij'))
+
+
+def ObjectDepth(dtype: JSON) -> int:
+    """Return the number of nested objects on the deepest path of a type."""
+    kind = dtype.get('type')
+    if kind == 'object':
+        if dtype.get('properties'):
+            return 1 + max(map(ObjectDepth, dtype['properties'].values()))
+        elif dtype.get('additionalProperties'):
+            return ObjectDepth(dtype['additionalProperties'])
+    elif kind == 'array' and dtype.get('items'):
+        return ObjectDepth(dtype['items'])
+    return 0
+
+
+def DeepenFields(fields: Dict[str, JSON], depth: int, marker: Optional[str]) -> Dict[str, JSON]:
+    """Deepen a map of field types by `depth` levels, along its deepest path.
+
+    A chain of `depth` nested objects is added to the deepest of its objects.
+    With a marker, a string field of that name is added to all of them.
+    """
+    depths = {name: ObjectDepth(dtype) for name, dtype in fields.items()}
+    deepest = max(depths, key=depths.get) if any(depths.values()) else None
+    fields = {name: Deepen(dtype, depth if name == deepest else 0, marker)
+              for name, dtype in fields.items()}
+    if depth and deepest is None:
+        nested = {'type': 'string'}
+        for _ in range(depth):
+            nested = {'type': 'object', 'properties': {NESTED_FIELD: nested}}
+        fields[NESTED_FIELD] = nested
+    if marker:
+        fields[marker] = {'type': 'string'}
+    return fields
+
+
+def Deepen(dtype: JSON, depth: int, marker: Optional[str]) -> JSON:
+    """Deepen the objects of a type, recursively. See DeepenFields."""
+    kind = dtype.get('type')
+    if kind == 'object':
+        if dtype.get('properties'):
+            dtype = dict(dtype, properties=DeepenFields(dtype['properties'], depth, marker))
+        elif dtype.get('additionalProperties'):
+            dtype = dict(dtype, additionalProperties=Deepen(
+                dtype['additionalProperties'], depth, marker))
+    elif kind == 'array' and dtype.get('items'):
+        dtype = dict(dtype, items=Deepen(dtype['items'], depth, marker))
+    return dtype
+
+
+def CopyPage(parsed: JSON, depth: int, index: int) -> JSON:
+    """Deepen all the messages of a parsed schema page, for a copy.
+
+    The top-level types of the copies after the first are renamed with the
+    suffix of the copy, and marked with a field of their own. The subtypes are
+    the same for all the copies, as their oneofs are shared.
+    """
+    suffix = Suffix(index) if index else ''
+    marker = COPY_FIELD + suffix if index else None
+    output = {'top': {name + suffix: None if fields is None else
+                      DeepenFields(fields, depth, marker)
+                      for name, fields in parsed['top'].items()}}
+    if 'sub' in parsed:
+        output['sub'] = {name: {alt: DeepenFields(fields, depth, None)
+                                for alt, fields in alternatives.items()}
+                         for name, alternatives in parsed['sub'].items()}
+    return output
+
+
+def MakeSyntheticTree(raw_dir: str, output_dir: str, scale: int, depth: int) -> List[str]:
+    """Write a tree of raw downloads scaled up from `raw_dir`.
+
+    The endpoints are copied `scale` times, with the messages of their requests
+    and responses deepened by `depth` levels. The first copy of an endpoint
+    keeps its name. Returns the names of the endpoints.
+    """
+    names = []
+    for root in convert_ameritrade_schemas.IterEndpointDirs(raw_dir):
+        name = path.basename(root)
+        pages = {}
+        for filename in 'request.json', 'response.json':
+            src = path.join(root, filename)
+            if path.exists(src):
+                pages[filename] = convert_ameritrade_schemas.ReadJsonWithComments(src)
+
+        for index in range(scale):
+            copy_name = name + Suffix(index) if index else name
+            copy_dir = path.join(output_dir, copy_name)
+            os.makedirs(copy_dir)
+            for filename in convert_ameritrade_schemas.INPUT_FILES:
+                src = path.join(root, filename)
+                if not path.exists(src):
+                    continue
+                dst = path.join(copy_dir, filename)
+                if pages.get(filename):
+                    with open(dst, 'w') as outfile:
+                        outfile.write(convert_ameritrade_schemas.FormatJsonWithComments(
+                            CopyPage(pages[filename], depth, index)))
+                else:
+                    os.link(src, dst)
+            names.append(copy_name)
+    return names
+
+
+def ScaledNameMap(scale: int) -> Dict[Tuple[str, str], str]:
+    """Return MSG_NAME_MAP, with the renamings of the copies of the endpoints."""
+    name_map = dict(generate_proto_schemas.MSG_NAME_MAP)
+    for (type_name, endpoint), new_name in generate_proto_schemas.MSG_NAME_MAP.items():
+        for index in range(1, scale):
+            suffix = Suffix(index)
+            name_map[(type_name + suffix, endpoint + suffix)] = new_name + suffix
+    return name_map
+
+
+def MaxDepth(value: JSON) -> int:
+    """Return the nesting depth of a JSON value."""
+    if isinstance(value, dict):
+        return 1 + max(map(MaxDepth, value.values()), default=0)
+    elif isinstance(value, list):
+        return 1 + max(map(MaxDepth, value), default=0)
+    return 0
+
+
+def Time(function: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Time a function, returning the fastest of `repeat` runs and the result."""
+    runs = []
+    for _ in range(repeat):
+        # Release the result of the previous run first, for the large trees.
+        result = None
+        start = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - start)
+    return {'seconds': min(runs), 'runs': runs}, result
+
+
+def BenchmarkTree(raw_dir: str, repeat: int,
+                  name_map: Dict[Tuple[str, str], str]) -> Dict[str, Any]:
+    """Time the stages of the pipeline on a tree of raw downloads.
+
+    The types are renamed by `name_map`, as MSG_NAME_MAP.
+    """
+    stages = {}
+    roots = list(convert_ameritrade_schemas.IterEndpointDirs(raw_dir))
+
+    def ReadPages():
+        for root in roots:
+            for filename in 'request.json', 'response.json':
+                filename = path.join(root, filename)
+                if path.exists(filename):
+                    convert_ameritrade_schemas.ReadJsonWithComments(filename)
+    stages['read_json_with_comments'], _ = Time(ReadPages, repeat)
+
+    stages['parse_schemas'], rrpairs = Time(
+        lambda: convert_ameritrade_schemas.ParseSchemas(raw_dir), repeat)
+
+    with tempfile.TemporaryDirectory() as schemas_dir:
+        def WriteSchemas():
+            hashes = {name: convert_ameritrade_schemas.WriteSchema(schemas_dir, endpoint)
+                      for name, endpoint in rrpairs}
+            version = convert_ameritrade_schemas.WriteVersion(schemas_dir, hashes)
+            schema_registry.WriteBundle(schemas_dir, version)
+        stages['write_and_hash'], _ = Time(WriteSchemas, repeat)
+        num_endpoints = len(rrpairs)
+        depth = max(MaxDepth(endpoint) for _, endpoint in rrpairs)
+        del rrpairs
+
+        stages['validate_schemas'], valid_types = Time(
+            lambda: generate_proto_schemas.ValidateSchemas(schemas_dir, name_map=name_map),
+            repeat)
+
+    stages['generate_proto'], _ = Time(
+        lambda: generate_proto_schemas.ProtoGenerator(valid_types, name_map).Source(), repeat)
+    stages['generate_messages'], _ = Time(
+        lambda: generate_messages.BuildGenerator(valid_types).Source(), repeat)
+
+    return {
+        'endpoints': num_endpoints,
+        'bytes': sum(path.getsize(path.join(root, filename))
+                     for root in roots for filename in os.listdir(root)),
+        'depth': depth,
+        'types': len(valid_types.types),
+        'stages': stages,
+    }
+
+
+def GitCommit() -> Optional[str]:
+    """Return the commit of the source tree, if available."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def Benchmark(raw_dir: str, scales: List[int], repeat: int) -> Dict[str, Any]:
+    """Benchmark the pipeline on the raw downloads and on scaled up trees."""
+    results = {
+        'commit': GitCommit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'machine': platform.machine(),
+        'trees': {},
+    }
+    for scale in [1] + scales:
+        depth = int(math.log2(scale))
+        logging.info("Benchmarking scale %dx, %d more nesting levels", scale, depth)
+        # Silence the warnings of the validation, repeated for each copy.
+        level = logging.getLogger().level
+        logging.getLogger().setLevel(logging.ERROR)
+        try:
+            with tempfile.TemporaryDirectory() as tree_dir:
+                if scale == 1:
+                    tree_dir = raw_dir
+                else:
+                    MakeSyntheticTree(raw_dir, tree_dir, scale, depth)
+                tree = BenchmarkTree(tree_dir, repeat, ScaledNameMap(scale))
+        finally:
+            logging.getLogger().setLevel(level)
+        tree['scale'] = scale
+        results['trees']['{}x'.format(scale)] = tree
+    return results
+
+
+def Compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Return descriptions of the stages slower than in the baseline."""
+    regressions = []
+    for tree_name, tree in results['trees'].items():
+        base_tree = baseline['trees'].get(tree_name)
+        if base_tree is None:
+            continue
+        for stage, timing in tree['stages'].items():
+            base_timing = base_tree['stages'].get(stage)
+            if base_timing is None:
+                continue
+            ratio = timing['seconds'] / base_timing['seconds']
+            if ratio > threshold:
+                regressions.append("{} {}: {:.4f}s vs {:.4f}s, {:.2f}x slower".format(
+                    tree_name, stage, timing['seconds'], base_timing['seconds'], ratio))
+    return regressions
+
+
+def PrintResults(results: Dict[str, Any]):
+    """Print a table of the stage timings, to stderr."""
+    trees = results['trees']
+    stages = list(next(iter(trees.values()))['stages'])
+    print("{:28}".format("Stage") + "".join("{:>12}".format(name) for name in trees),
+          file=sys.stderr)
+    for row, key in [("endpoints", 'endpoints'), ("depth", 'depth'), ("types", 'types'),
+                     ("MB", 'bytes')]:
+        print("{:28}".format(row) + "".join(
+            "{:>12.1f}".format(tree[key] / 2**20) if key == 'bytes' else
+            "{:>12}".format(tree[key]) for tree in trees.values()), file=sys.stderr)
+    for stage in stages:
+        print("{:28}".format(stage) + "".join(
+            "{:>12.4f}".format(tree['stages'][stage]['seconds'])
+            for tree in trees.values()), file=sys.stderr)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the raw downloaded data from.")
+    parser.add_argument('--scales', action='store', default='10,100,1000',
+                        help="Comma-separated scales of the synthetic trees.")
+    parser.add_argument('--repeat', action='store', type=int, default=3,
+                        help="Number of runs of each stage; the fastest is kept.")
+    parser.add_argument('--output', action='store',
+                        help="Filename to write the JSON results to, instead of stdout.")
+    parser.add_argument('--baseline', action='store',
+                        help="JSON results of a previous run to compare against.")
+    parser.add_argument('--threshold', action='store', type=float, default=1.25,
+                        help="Ratio to the baseline above which a stage has regressed.")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale]
+    if any(scale < 2 for scale in scales):
+        parser.error("Scales must be at least 2")
+
+    results = Benchmark(args.raw_downloaded_data, scales, args.repeat)
+
+    PrintResults(results)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+        regressions = Compare(results, baseline, args.threshold)
+        for regression in regressions:
+            logging.error("Regression: %s", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""Coalesce concurrent single-symbol quote requests into GetQuotes calls.
+
+The strategies request the quotes of single symbols with GetQuote, often
+hundreds within a few milliseconds. GetQuotes takes a comma-separated list of
+symbols and returns the same types (EquityQuote, OptionQuote, ETFQuote, etc. of
+MSG_NAME_MAP), so the coalescer collects the GetQuote requests arriving within
+a short window, or until a maximum number of symbols, and sends a single
+GetQuotes request for all of them. Its response is split back to the callers,
+each receiving the mapping GetQuote would have returned:
+
+    coalescer = coalesce_quotes.QuoteCoalescer(client)
+    quotes = await coalescer.GetQuote('AAPL')   # {'AAPL': EquityQuote(...)}
+
+The duplicate symbols of a batch are requested once. The errors of a GetQuotes
+request are raised to all its callers.
+
+See --benchmark for the number of requests and the latencies of bursts of quote
+requests under a rate limit, with and without coalescing, from the mock server.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import random
+import time
+
+import generate_client
+import generate_messages
+import generate_validators
+import mock_server
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples served by the mock server of the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+# The default time to wait for more symbols after the first one of a batch, in
+# seconds.
+DEFAULT_WINDOW = 0.002
+
+# The default maximum number of symbols of a GetQuotes request, which bounds
+# the length of its URL.
+DEFAULT_MAX_SYMBOLS = 200
+
+
+class QuoteCoalescer:
+    """Send the GetQuote requests of a client as batched GetQuotes requests.
+
+    A batch is sent `window` seconds after its first symbol, or as soon as it
+    has `max_symbols` distinct ones. The batches are sent concurrently.
+    """
+
+    def __init__(self, client: Any, window: float = DEFAULT_WINDOW,
+                 max_symbols: int = DEFAULT_MAX_SYMBOLS):
+        self.client = client
+        self.window = window
+        self.max_symbols = max_symbols
+        # The futures of the callers of the current batch, by symbol.
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks = set()
+        # The numbers of quotes requested, and of GetQuotes requests sent.
+        self.quotes = 0
+        self.requests = 0
+
+    async def GetQuote(self, symbol: str) -> Dict[str, JSON]:
+        """Return the quote of a symbol, as a mapping of the symbol to its quote.
+
+        Like GetQuote, the mapping is empty for unknown symbols.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.quotes += 1
+        waiters = self.waiters.get(symbol)
+        if waiters is None:
+            self.waiters[symbol] = [future]
+            if len(self.waiters) >= self.max_symbols:
+                self.Flush()
+            elif self.timer is None:
+                self.timer = loop.call_later(self.window, self.Flush)
+        else:
+            waiters.append(future)
+        return await future
+
+    def Flush(self):
+        """Send the current batch."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.waiters:
+            return
+        waiters, self.waiters = self.waiters, {}
+        self.requests += 1
+        task = asyncio.get_running_loop().create_task(self.Send(waiters))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def Send(self, waiters: Dict[str, List[asyncio.Future]]):
+        """Request the quotes of a batch and resolve the futures of its callers."""
+        try:
+            quotes = await self.client.GetQuotes(symbol=','.join(waiters))
+        except Exception as exc:
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(exc)
+            return
+        quotes = quotes or {}
+        for symbol, futures in waiters.items():
+            quote = quotes.get(symbol)
+            result = {} if quote is None else {symbol: quote}
+            for future in futures:
+                if not future.done():
+                    future.set_result(result)
+
+
+#-------------------------------------------------------------------------------
+# Benchmark, with bursts of quote requests from the mock server.
+
+
+class RateLimitedClient:
+    """Space the quote requests of a client to at most `rate` per second.
+
+    This stands in for the rate limit of the API, queueing the requests rather
+    than failing them.
+    """
+
+    def __init__(self, client: Any, rate: float):
+        self.client = client
+        self.interval = 1 / rate
+        self.next_time = 0
+
+    async def Wait(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, self.next_time)
+        self.next_time = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def GetQuote(self, symbol: str) -> Dict[str, JSON]:
+        await self.Wait()
+        return await self.client.GetQuote(symbol)
+
+    async def GetQuotes(self, **kwargs) -> Dict[str, JSON]:
+        await self.Wait()
+        return await self.client.GetQuotes(**kwargs)
+
+
+async def RunBursts(get_quote, bursts: int, burst_size: int, interval: float,
+                    symbols: List[str], seed: int) -> List[float]:
+    """Request bursts of quotes of random symbols. Return the latencies.
+
+    Each burst is spread over a millisecond, every `interval` seconds.
+    """
+    rng = random.Random(seed)
+    latencies = []
+
+    async def Request(symbol: str, delay: float):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        result = await get_quote(symbol)
+        latencies.append(time.perf_counter() - start)
+        assert list(result) == [symbol], (symbol, result)
+
+    tasks = []
+    for index in range(bursts):
+        for _ in range(burst_size):
+            tasks.append(Request(rng.choice(symbols), index * interval + rng.random() * 1e-3))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def Benchmark(schemas_dir: str, raw_dir: str, port: int, delay: float, rate: float,
+              bursts: int, burst_size: int, window: float):
+    """Compare the requests and latencies of quotes with and without coalescing."""
+    logging.getLogger().setLevel(logging.ERROR)
+    schemas = generate_validators.ReadSchemas(schemas_dir)
+    client_class = generate_client.CompileClient(schemas)['Client']
+    validators = generate_validators.CompileValidators(schemas)
+    classes = generate_messages.CompileMessages(schemas_dir)
+    symbols = ['S{}'.format(index) for index in range(500)]
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=mock_server._RunServer, args=(schemas_dir, raw_dir, port, 0, ready, delay))
+    server.start()
+    ready.wait()
+
+    async def Run(coalesce: bool):
+        async with client_class('http://127.0.0.1:{}'.format(port), max_connections=8,
+                                pipeline=8, validators=validators, classes=classes) as client:
+            limited = RateLimitedClient(client, rate)
+            if coalesce:
+                coalescer = QuoteCoalescer(limited, window)
+                get_quote = coalescer.GetQuote
+            else:
+                get_quote = limited.GetQuote
+            start = time.perf_counter()
+            latencies = await RunBursts(get_quote, bursts, burst_size, 0.1, symbols, 0)
+            elapsed = time.perf_counter() - start
+            return latencies, elapsed, coalescer.requests if coalesce else len(latencies)
+
+    print("{} bursts of {} quotes, every 100 ms; {:.0f} requests/s at most, "
+          "{:.1f} ms of latency".format(bursts, burst_size, rate, delay * 1e3))
+    print("{:12} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        "", "quotes", "requests", "elapsed s", "p50 ms", "p99 ms", "max ms"))
+    try:
+        for label, coalesce in [('GetQuote', False), ('coalesced', True)]:
+            latencies, elapsed, requests = asyncio.run(Run(coalesce))
+            latencies.sort()
+            count = len(latencies)
+            print("{:12} {:8} {:8} {:10.2f} {:10.1f} {:10.1f} {:10.1f}".format(
+                label, count, requests, elapsed, latencies[count // 2] * 1e3,
+                latencies[int(count * 0.99)] * 1e3, latencies[-1] * 1e3))
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples served by the mock server.")
+    parser.add_argument('--port', action='store', type=int, default=8080,
+                        help="Port of the mock server of the benchmark.")
+    parser.add_argument('--delay', action='store', type=float, default=0.005,
+                        help="Latency of the responses of the mock server, in seconds.")
+    parser.add_argument('--rate', action='store', type=float, default=100,
+                        help="Maximum number of requests per second.")
+    parser.add_argument('--window', action='store', type=float, default=DEFAULT_WINDOW,
+                        help="Time to collect the symbols of a batch, in seconds.")
+    parser.add_argument('--bursts', action='store', type=int, default=10,
+                        help="Number of bursts of quote requests.")
+    parser.add_argument('--burst_size', action='store', type=int, default=100,
+                        help="Number of quote requests of each burst.")
+    args = parser.parse_args()
+
+    Benchmark(args.clean_schemas, args.raw_downloaded_data, args.port, args.delay, args.rate,
+              args.bursts, args.burst_size, args.window)
+
+
+if __name__ == '__main__':
+    main()
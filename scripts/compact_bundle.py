@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""A compact bundle of all the schemas, with the shared subtrees defined once.
+
+Most of the schemas repeat the same types: GetAccount and GetAccounts are almost
+identical, CreateSavedOrder, PlaceOrder and ReplaceOrder share the whole Order
+tree, and the asset type enums appear in most messages. The compact bundle is a
+single JSON file where each object type, enum or other subtree occurring more
+than once, identically, is stored once under 'definitions' and replaced by a
+reference to its id wherever it occurs, in the style of JSON schema:
+
+    {"$ref": "#/definitions/Instrument"}
+
+The definitions may themselves contain references. The ids are the names of the
+fields or types where the subtrees first occur, numbered if needed, e.g.
+'assetType2'. Expanding the references reproduces the schemas exactly, and the
+per-endpoint files by rendering them with FormatSchema.
+
+The expanded schemas share the values of the definitions, like the schemas
+loaded by the registry are shared by their users: they must not be modified.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Dict, List, Tuple
+import argparse
+import gc
+import hashlib
+import json
+import logging
+import time
+
+import convert_ameritrade_schemas
+import generate_validators
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# The name of the compact bundle file, in the schemas directory.
+COMPACT_FILENAME = 'schemas.compact.json'
+
+# The key of the references to definitions, and the prefix of their values.
+REF_KEY = '$ref'
+REF_PREFIX = '#/definitions/'
+
+# The minimum size of the subtrees to define once, in bytes of compact JSON.
+# The smaller ones, e.g. {"type":"string"}, are cheaper to repeat than to refer
+# to.
+MIN_SIZE = 64
+
+
+class _Interner:
+    """Identify the identical subtrees of schemas, by digest."""
+
+    def __init__(self):
+        # A mapping of the id of a dict or list to its digest.
+        self.digests: Dict[int, str] = {}
+        # A mapping of digest to a (size, count, name) triple, the size of the
+        # compact JSON of the subtree, its number of occurrences, and the name
+        # of the field or type where it first occurs.
+        self.nodes: Dict[str, List[Any]] = {}
+
+    def Add(self, value: JSON, name: str) -> Tuple[str, int]:
+        """Count the subtrees of a value. Return its digest and size.
+
+        The digests are computed bottom-up from those of the children. Each
+        occurrence is counted, including those within repeated subtrees.
+        """
+        if value.__class__ is dict:
+            if REF_KEY in value:
+                raise ValueError("Schemas can't have a '{}' key: {}".format(REF_KEY, name))
+            parts = []
+            size = 1 + len(value)
+            for key, item in sorted(value.items()):
+                digest, item_size = self.Add(item, key)
+                parts.append('{}:{}'.format(json.dumps(key), digest))
+                size += len(json.dumps(key)) + 1 + item_size
+            string = '{{{}}}'.format(','.join(parts))
+        elif value.__class__ is list:
+            parts = []
+            size = 1 + max(len(value), 1)
+            for item in value:
+                digest, item_size = self.Add(item, name)
+                parts.append(digest)
+                size += item_size
+            string = '[{}]'.format(','.join(parts))
+        else:
+            string = json.dumps(value)
+            return string, len(string)
+        digest = hashlib.md5(string.encode('utf8')).hexdigest()
+        self.digests[id(value)] = digest
+        node = self.nodes.get(digest)
+        if node is None:
+            self.nodes[digest] = [size, 1, name]
+        else:
+            node[1] += 1
+        return digest, size
+
+
+def Compact(schemas: Dict[str, JSON]) -> Dict[str, JSON]:
+    """Compact the schemas of the endpoints. Return the bundle, without hash.
+
+    The subtrees occurring more than once are candidates for definitions. Those
+    occurring only within a single definition, e.g. the fields of a shared
+    message, are left inline in it: a subtree is defined iff it is referred to
+    from at least two places once its parents are defined.
+    """
+    interner = _Interner()
+    for name, schema in sorted(schemas.items()):
+        interner.Add(schema, name)
+    digests, nodes = interner.digests, interner.nodes
+
+    def Shared(value: JSON) -> bool:
+        node = nodes[digests[id(value)]]
+        return node[1] > 1 and node[0] >= MIN_SIZE
+
+    # Count the references to the candidates, descending once into each.
+    uses: Dict[str, int] = {}
+    def CountUses(value: JSON):
+        for item in (value.values() if value.__class__ is dict else value):
+            if item.__class__ is not dict and item.__class__ is not list:
+                continue
+            if Shared(item):
+                digest = digests[id(item)]
+                count = uses.get(digest, 0)
+                uses[digest] = count + 1
+                if count:
+                    continue
+            CountUses(item)
+    for name, schema in sorted(schemas.items()):
+        CountUses(schema)
+
+    # Assign the ids of the definitions, in order of first occurrence.
+    ids: Dict[str, str] = {}
+    taken = set()
+    for digest, count in uses.items():
+        if count < 2:
+            continue
+        base = nodes[digest][2]
+        ref_id, number = base, 1
+        while ref_id in taken:
+            number += 1
+            ref_id = '{}{}'.format(base, number)
+        taken.add(ref_id)
+        ids[digest] = ref_id
+
+    # Rewrite the schemas and the definitions with references.
+    definitions: Dict[str, JSON] = {}
+    def Rewrite(value: JSON) -> JSON:
+        if value.__class__ is dict:
+            return {key: Refer(item) for key, item in value.items()}
+        return [Refer(item) for item in value]
+    def Refer(value: JSON) -> JSON:
+        if value.__class__ is not dict and value.__class__ is not list:
+            return value
+        ref_id = ids.get(digests[id(value)])
+        if ref_id is None:
+            return Rewrite(value)
+        if ref_id not in definitions:
+            definitions[ref_id] = Rewrite(value)
+        return {REF_KEY: REF_PREFIX + ref_id}
+    endpoints = {name: Rewrite(schema) for name, schema in sorted(schemas.items())}
+    return {'definitions': definitions, 'endpoints': endpoints}
+
+
+def Expand(bundle: Dict[str, JSON]) -> Dict[str, JSON]:
+    """Expand the references of a compact bundle. Return the schemas by name.
+
+    Each definition is expanded once, and shared by all the references to it.
+    """
+    definitions = bundle['definitions']
+    expanded: Dict[str, JSON] = {}
+    def Resolve(value: JSON) -> JSON:
+        if value.__class__ is dict:
+            ref = value.get(REF_KEY)
+            if ref is not None:
+                ref_id = ref[len(REF_PREFIX):]
+                result = expanded.get(ref_id)
+                if result is None:
+                    result = expanded[ref_id] = Resolve(definitions[ref_id])
+                return result
+            return {key: Resolve(item) for key, item in value.items()}
+        if value.__class__ is list:
+            return [Resolve(item) for item in value]
+        return value
+    return {name: Resolve(schema) for name, schema in bundle['endpoints'].items()}
+
+
+def FormatBundle(bundle: Dict[str, JSON]) -> bytes:
+    """Render a compact bundle as written to its file."""
+    return json.dumps(bundle, sort_keys=True, separators=(',', ':')).encode('utf8')
+
+
+def BuildCompactBundle(dirname: str, version: dict) -> Dict[str, JSON]:
+    """Return the compact bundle of the schemas of a directory.
+
+    The schemas are those listed in its `version`, as written to 'version.json'.
+    """
+    schemas = {}
+    for name in sorted(version['messages']):
+        schemas[name] = convert_ameritrade_schemas.ReadJson(
+            path.join(dirname, "{}.json".format(name)))
+    bundle = Compact(schemas)
+    bundle['hash'] = version['hash']
+    return bundle
+
+
+def WriteCompactBundle(dirname: str, version: dict, filename: str = None) -> Dict[str, JSON]:
+    """Write the compact bundle of the schemas of a directory. Return it."""
+    bundle = BuildCompactBundle(dirname, version)
+    with open(filename or path.join(dirname, COMPACT_FILENAME), 'wb') as outfile:
+        outfile.write(FormatBundle(bundle))
+    return bundle
+
+
+def ReadCompactBundle(filename: str = path.join(DEFAULT_INPUT, COMPACT_FILENAME)
+                      ) -> Dict[str, JSON]:
+    """Read a compact bundle. Return the expanded schemas by name."""
+    return Expand(convert_ameritrade_schemas.ReadJson(filename))
+
+
+def ReadContents(dirname: str, filename: str) -> bytes:
+    """Return the contents of the compact bundle of a directory.
+
+    If the file is absent, e.g. in a fresh tree, the bundle is built in memory
+    from 'version.json'.
+    """
+    if path.exists(filename):
+        with open(filename, 'rb') as infile:
+            return infile.read()
+    logging.info("No compact bundle at %s; building it in memory", filename)
+    version = convert_ameritrade_schemas.ReadJson(path.join(dirname, 'version.json'))
+    return FormatBundle(BuildCompactBundle(dirname, version))
+
+
+def Check(dirname: str, filename: str) -> int:
+    """Check that the expanded bundle reproduces the files. Return the mismatches."""
+    schemas = Expand(json.loads(ReadContents(dirname, filename)))
+    mismatches = 0
+    for name, schema in sorted(schemas.items()):
+        with open(path.join(dirname, "{}.json".format(name)), 'rb') as infile:
+            contents = infile.read()
+        if convert_ameritrade_schemas.FormatSchema(schema) != contents:
+            logging.error("Expanded schema differs from its file: %s", name)
+            mismatches += 1
+    return mismatches
+
+
+def Benchmark(dirname: str, filename: str, count: int):
+    """Compare the sizes and parse times of the files and of the compact bundle.
+
+    Parsing the files is reading and decoding them all, as ReadSchemas does. The
+    garbage collector is disabled while timing. A bundle built in memory is
+    only decoded, not read.
+    """
+    schemas = generate_validators.ReadSchemas(dirname)
+    sizes = {}
+    sizes['files'] = sum(len(convert_ameritrade_schemas.FormatSchema(schema))
+                         for schema in schemas.values())
+    # The schemas without indentation, as in the bundle of the registry.
+    sizes['unindented'] = sum(len(json.dumps(schema, separators=(',', ':')))
+                              for schema in schemas.values())
+    contents = ReadContents(dirname, filename)
+    from_file = path.exists(filename)
+    sizes['compact'] = len(contents)
+
+    timings = {'files': [], 'compact decode': [], 'compact expand': []}
+    for _ in range(count):
+        gc.disable()
+        start = time.perf_counter()
+        generate_validators.ReadSchemas(dirname)
+        timings['files'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        if from_file:
+            with open(filename, 'rb') as infile:
+                bundle = json.load(infile)
+        else:
+            bundle = json.loads(contents)
+        timings['compact decode'].append(time.perf_counter() - start)
+        Expand(bundle)
+        timings['compact expand'].append(time.perf_counter() - start)
+        gc.enable()
+    elapsed = {name: min(values) for name, values in timings.items()}
+
+    bundle = json.loads(contents)
+    print("{} endpoints, {} definitions".format(
+        len(bundle['endpoints']), len(bundle['definitions'])))
+    for name, size in sizes.items():
+        print("{:16} {:8.1f} KB, {:.1f}x".format(
+            name, size / 1024, sizes['files'] / size))
+    for name, value in elapsed.items():
+        print("{:16} {:8.2f} ms, {:.1f}x".format(
+            name, value * 1e3, elapsed['files'] / value))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--output', action='store',
+                        help=("Filename of the compact bundle. Defaults to {} in the "
+                              "schemas directory.".format(COMPACT_FILENAME)))
+    parser.add_argument('--check', action='store_true',
+                        help="Check that the bundle expands to the schema files.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Compare the sizes and parse times with the schema files.")
+    parser.add_argument('--benchmark_count', action='store', type=int, default=20,
+                        help="Number of runs of the benchmark.")
+    args = parser.parse_args()
+
+    filename = args.output or path.join(args.clean_schemas, COMPACT_FILENAME)
+    if args.check:
+        if Check(args.clean_schemas, filename):
+            raise SystemExit(1)
+        logging.info("Expanded schemas identical to the files")
+    elif args.benchmark:
+        Benchmark(args.clean_schemas, filename, args.benchmark_count)
+    else:
+        version = convert_ameritrade_schemas.ReadJson(
+            path.join(args.clean_schemas, 'version.json'))
+        WriteCompactBundle(args.clean_schemas, version, filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,19 +9,22 @@ __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 from os import path
-from typing import Callable, Any, Iterable, Iterator, Union, Dict, List, Tuple
+from typing import Callable, Any, Iterable, Iterator, Union, Dict, List, Optional, Tuple
 import argparse
+import concurrent.futures
 import datetime
+import difflib
+import gc
 import hashlib
 import json
 import logging
 import os
-import pprint
 import re
-import subprocess
-import tempfile
+import time
 
 import parameters
+import schema_diff
+import schema_registry
 
 # Raw downloads scraped from the site.
 _ROOT = path.normpath(path.dirname(path.dirname(__file__)))
@@ -30,18 +33,18 @@ DEFAULT_INPUT = path.join(_ROOT, 'raw')
 # Sanitized and versions output that can be processed.
 DEFAULT_OUTPUT = path.join(_ROOT, 'schemas')
 
+# Manifest of the hashes of the inputs, for incremental conversions.
+MANIFEST_FILENAME = '.manifest.json'
+
 
 JSON = Union[str, int, float, Dict[str, 'JSON'], List['JSON']]
 
 
 def Diff(string1: str, string2: str):
-    with tempfile.NamedTemporaryFile('w') as tmpfile1:
-        tmpfile1.write(string1)
-        tmpfile1.flush()
-        with tempfile.NamedTemporaryFile('w') as tmpfile2:
-            tmpfile2.write(string2)
-            tmpfile2.flush()
-            subprocess.call(["diff", tmpfile1.name, tmpfile2.name])
+    """Print a line diff of two strings. See schema_diff for schemas."""
+    for line in difflib.unified_diff(string1.splitlines(), string2.splitlines(),
+                                     lineterm=''):
+        print(line)
 
 
 def ReadJson(filename: str) -> JSON:
@@ -79,141 +82,433 @@ def IterBy(iterable: Iterable[Any], by: int) -> Iterator[Tuple[Any, Any]]:
             break
 
 
-def SplitGroups(group_string: str) -> Dict[str, JSON]:
-    """Split the top groups and yield pairs of (name, contents)."""
-    top_groups = re.split(r"^\s*//(.*):", group_string,
-                          flags=re.MULTILINE)
-    assert not top_groups[0]
-    del top_groups[0]
-    assert len(top_groups) % 2 == 0
-    return dict(IterBy(top_groups, 2))
-
-
-def SplitSubTypes(remainder: str) -> Dict[str, Dict[str, JSON]]:
-    """Split the remaining subtypes and yield a dict of type to list of types."""
-    subtypes = re.split(r'^//The class <([A-Za-z]+)> has the following subclasses:'
-                        '.*?listed below:\s*$',
-                        remainder, flags=re.MULTILINE|re.DOTALL)
-    assert not subtypes[0]
-    del subtypes[0]
-    assert len(subtypes) % 2 == 0
+# Tokens of the JSON files with comment separators.
+OPEN = 'OPEN'      # The '[' opening the list of top-level messages.
+CLOSE = 'CLOSE'    # The ']' closing it.
+NAME = 'NAME'      # A '//<Name>:' declaration; the value is the name.
+CLASS = 'CLASS'    # A '//The class <X> has the following subclasses' header.
+OR = 'OR'          # An '//OR' separator between the subclasses.
+VALUE = 'VALUE'    # A JSON value, decoded.
+
+_WHITESPACE_RE = re.compile(r"\s*")
+_COMMENT_RE = re.compile(r"//([^\n]*)")
+_CLASS_RE = re.compile(r"The class <([A-Za-z]+)> has the")
+
+_DECODER = json.JSONDecoder()
+
+
+def TokenizeJsonWithComments(contents: str) -> Iterator[Tuple[str, JSON]]:
+    """Tokenize the contents of a JSON file with comment separators.
+
+    This is done in a single pass over the contents. The JSON values are decoded
+    in place, without copying out their text. The lines of the header of the
+    subclasses following a CLASS token, up to the one ending with 'listed
+    below:', are skipped. A value of 'undefined' is decoded as None.
+    """
+    in_header = False
+    pos = _WHITESPACE_RE.match(contents).end()
+    while pos < len(contents):
+        match = _COMMENT_RE.match(contents, pos)
+        if match:
+            comment = match.group(1).rstrip()
+            class_match = _CLASS_RE.match(comment)
+            if in_header:
+                in_header = not comment.endswith('listed below:')
+            elif class_match:
+                in_header = True
+                yield CLASS, class_match.group(1)
+            elif comment == 'OR':
+                yield OR, None
+            elif comment.endswith(':'):
+                yield NAME, comment[:-1].strip()
+            else:
+                raise ValueError("Invalid comment at {}: {!r}".format(pos, comment))
+            pos = match.end()
+        elif in_header:
+            raise ValueError("Unterminated subclasses header at {}".format(pos))
+        elif contents.startswith('undefined', pos):
+            yield VALUE, None
+            pos += len('undefined')
+        elif contents.startswith(']', pos):
+            yield CLOSE, None
+            pos += 1
+        elif (contents.startswith('[', pos) and
+              contents.startswith('//', _WHITESPACE_RE.match(contents, pos + 1).end())):
+            yield OPEN, None
+            pos += 1
+        else:
+            value, pos = _DECODER.raw_decode(contents, pos)
+            yield VALUE, value
+        pos = _WHITESPACE_RE.match(contents, pos).end()
 
-    subdict = {}
-    for stname, stcontents in IterBy(subtypes, 2):
-        # Split by OR to get and check the number of one-ofs in the subtype.
-        alternatives = re.split(r"^//OR", stcontents, flags=re.MULTILINE)
 
-        stcontents = re.sub(r"^//OR", "", stcontents, flags=re.MULTILINE)
-        altdict = SplitGroups(stcontents)
-        assert len(altdict) == len(alternatives)
+def ReadJsonWithComments(filename: str) -> JSON:
+    """Read and parse a JSON file with comment separators."""
+    with open(filename) as schfile:
+        return ParseJsonWithComments(schfile.read(),
+                                     path.basename(path.dirname(filename)))
+
+
+def ParseJsonWithComments(contents: str, default_name: str) -> JSON:
+    """Parse the contents of a JSON file with comment separators.
+
+    The file is a list of named message definitions, optionally surrounded by
+    [...], followed by the subclasses of some of their types, each of which
+    lists its alternatives separated by '//OR'. Returns a dict of 'top' to the
+    message definitions, and 'sub' to a dict of the alternatives of each type,
+    if there are any subclasses.
+
+    `default_name` is the declaration name to use if the file contains a single
+    unnamed message definition.
+    """
+    output = {'top': {}}
+    messages = output['top']
+    name = default_name
+    num_alternatives = None
+    for token, value in TokenizeJsonWithComments(contents):
+        if token is VALUE:
+            # Check for error file.
+            # TODO(blais): This should be fixed upstream.
+            if (isinstance(value, dict) and
+                'WebServiceError' in str(value.get('$ref', ''))):
+                return {}
+            if name is None:
+                raise ValueError("Unnamed message definition in {}".format(default_name))
+            messages[name] = value
+            name = None
+        elif token is NAME:
+            name = value
+        elif token is CLASS:
+            assert num_alternatives in (None, len(messages))
+            messages = output.setdefault('sub', {})[value] = {}
+            num_alternatives = 1
+            name = None
+        elif token is OR:
+            assert num_alternatives is not None
+            num_alternatives += 1
+        elif token is OPEN:
+            assert not messages and num_alternatives is None
+            name = None
+    assert num_alternatives in (None, len(messages))
+    return output
+
+
+def FormatJsonWithComments(parsed: JSON) -> str:
+    """Render parsed messages back to a JSON file with comment separators.
+
+    This is the inverse of ParseJsonWithComments.
+    """
+    def Render(name, value):
+        text = 'undefined' if value is None else json.dumps(value, indent=2)
+        return "//{}:\n{}\n".format(name, text)
+
+    chunks = [Render(name, value) for name, value in parsed.get('top', {}).items()]
+    for name, alternatives in parsed.get('sub', {}).items():
+        chunks.append("//The class <{}> has the following subclasses: \n{}"
+                      "//schemas for each are listed below: \n\n".format(
+                          name, ''.join('//-{}\n'.format(alt) for alt in alternatives)))
+        chunks.append('//OR\n'.join(Render(alt, value)
+                                     for alt, value in alternatives.items()))
+    return ''.join(chunks)
+
+
+def ReadExample(filename: str) -> Dict[str, JSON]:
+    """Read an example file and resolve its placeholders to concrete values.
+
+    The examples from the site are written like the schemas, with comment
+    separators, and their values are placeholders: enums are rendered as a
+    string like "'CASH' or 'MARGIN'" and polymorphic fields as a sentence
+    referring to the subclasses listed further down. Replace the enums with
+    their first value and the polymorphic fields with the example of their first
+    subclass. Return a mapping of top-level type name to example value.
+    """
+    with open(filename) as exfile:
+        contents = exfile.read()
+
+    parsed = ParseJsonWithComments(contents, path.basename(path.dirname(filename)))
+    subtypes = parsed.get('sub', {})
+
+    def Resolve(value: JSON) -> JSON:
+        if isinstance(value, dict):
+            return {key: Resolve(item) for key, item in value.items()}
+        elif isinstance(value, list):
+            return [Resolve(item) for item in value]
+        elif isinstance(value, str):
+            match = re.match(r"\"?The type <(.*?)> has the following subclasses \[(.*?)[,\]]",
+                             value)
+            if match and match.group(1) in subtypes:
+                return Resolve(subtypes[match.group(1)][match.group(2)])
+            match = re.match(r"'([^']*)'( or '[^']*')*$", value)
+            if match:
+                return match.group(1)
+        return value
+
+    return {name: Resolve(value)
+            for name, value in parsed.get('top', {}).items()
+            if value is not None}
+
+
+def IterEndpointDirs(raw_dir: str) -> Iterator[str]:
+    """Yield the endpoint directories of the raw downloads."""
+    # Walk two levels of schema dirs.
+    for root, dirs, files in os.walk(raw_dir):
+        if not dirs:
+            yield root
 
-        # Parse the values and associated to the subtype for output.
-        altdict = {name: ParseJSON(value)
-                   for name, value in altdict.items()}
-        subdict[stname] = altdict
 
-    return subdict
+def ParseEndpoint(root: str) -> JSON:
+    """Parse the raw downloads of an endpoint directory."""
+    endpoint_name = path.basename(root)
 
+    # Read a JSON describing the high-level endpoint URL, method and query
+    # parameters, and embed the possible error codes in it.
+    endpoint = ReadJson(path.join(root, 'endpoint.json'))
+    errcodes = ReadJson(path.join(root, 'errcodes.json'))
+    endpoint['errors'] = errcodes
 
-def ParseJSON(string: str) -> JSON:
-    """A JSON parser a little more tolerant."""
-    string = string.strip()
-    if re.match(r"undefined", string):
-        return None
-    else:
-        try:
-            return json.loads(string)
-        except json.JSONDecodeError:
-            pprint.pprint(string)
-            raise
+    # Infer and embed the data types for the URL parameters. Convert them to
+    # their JSON schema equivalents.
+    url_params = endpoint['url_params'] = {}
+    for match in re.finditer('{(.*?)}', endpoint['url']):
+        param_name = match.group(1)
+        url_params[param_name] = parameters.URL_PARAM_TYPES[param_name]
 
+    # Infer and embed the data types of the query parameters. Insert them
+    # into the descriptions and required fields from the already fetched
+    # query params description. The names with many types are resolved from
+    # their descriptions here, once.
+    for name, value in endpoint['query_params'].items():
+        value.update(parameters.QueryParamType(name, value['description']))
 
-def ReadJsonWithComments(filename: str) -> JSON:
-    """Read and parse a JSON file with comment separators."""
-    with open(filename) as schfile:
-        #print("-" * 40,filename)
-
-        # Check for error file.
-        # TODO(blais): This should be fixed upstream.
-        orig_contents = contents = schfile.read()
-        if re.search(r"\bWebServiceError\b", contents):
-            return {}
-
-        # Normalize the top-level list of message definitions to be surrounded
-        # by [...] and to include a declaration name.
-        if re.match(r"\{", orig_contents.lstrip()):
-            contents = "//{}:\n{}".format(
-                path.basename(path.dirname(filename)), contents)
-        if not re.match(r"\[", contents.lstrip()):
-            contents = "[\n{}".format(contents)
-            if re.search(r"//The class", contents):
-                contents = re.sub(r"^\s*(//The class.*)$", r"]\n\1", contents,
-                                  count=1, flags=re.MULTILINE)
-            else:
-                contents = "{}\n]\n".format(contents)
+    # Parse the request, if present.
+    filename = path.join(root, 'request.json')
+    if path.exists(filename):
+        endpoint['request'] = ReadJsonWithComments(path.join(root, 'request.json'))
 
-        # Parse the initial list of messages.
-        topmatch = re.match(r"^\[(.*)^\]", contents, flags=re.MULTILINE|re.DOTALL)
-        assert topmatch
-        top_messages = SplitGroups(topmatch.group(1).strip())
-        output = {'top': {name: ParseJSON(group)
-                          for name, group in top_messages.items()}}
+    # Parse the response, if present.
+    filename = path.join(root, 'response.json')
+    response = None
+    if path.exists(filename):
+        endpoint['response'] = ReadJsonWithComments(path.join(root, 'response.json'))
 
-        # Parse subtypes.
-        remainder = contents[topmatch.end():].lstrip()
-        if remainder:
-            subtypes = SplitSubTypes(remainder)
-            output['sub'] = subtypes
+    # Insert the name of the endpoint itself.
+    endpoint['name'] = endpoint_name
 
-        return output
+    return endpoint
 
 
 def ParseSchemas(raw_dir: str) -> List[Tuple[str, Any, Any]]:
     """Parse the schemas. Return a list of (request, response) dicts."""
-    # Walk two levels of schema dirs.
     rrpairs = []
-    for root, dirs, files in os.walk(raw_dir):
-        if dirs:
-            continue
-        endpoint_name = path.basename(root)
-
-        # Read a JSON describing the high-level endpoint URL, method and query
-        # parameters, and embed the possible error codes in it.
-        endpoint = ReadJson(path.join(root, 'endpoint.json'))
-        errcodes = ReadJson(path.join(root, 'errcodes.json'))
-        endpoint['errors'] = errcodes
-
-        # Infer and embed the data types for the URL parameters. Convert them to
-        # their JSON schema equivalents.
-        url_params = endpoint['url_params'] = {}
-        for match in re.finditer('{(.*?)}', endpoint['url']):
-            param_name = match.group(1)
-            url_params[param_name] = parameters.URL_PARAM_TYPES[param_name]
-
-        # Infer and embed the data types of the query parameters. Insert them
-        # into the descriptions and required fields from the already fetched
-        # query params description.
-        for name, value in endpoint['query_params'].items():
-            dtype = parameters.URL_PARAM_TYPES[param_name]
-            value.update(dtype)
-
-        # Parse the request, if present.
-        filename = path.join(root, 'request.json')
-        if path.exists(filename):
-            endpoint['request'] = ReadJsonWithComments(path.join(root, 'request.json'))
+    for root in IterEndpointDirs(raw_dir):
+        endpoint = ParseEndpoint(root)
+        rrpairs.append((endpoint['name'], endpoint))
+    return rrpairs
+
 
-        # Parse the response, if present.
-        filename = path.join(root, 'response.json')
-        response = None
+# The input files of an endpoint directory, which determine its schema.
+INPUT_FILES = ['endpoint.json', 'errcodes.json', 'request.json', 'response.json']
+
+# The modules whose code determines the output schemas, and the hash trees of
+# the manifest.
+CONVERTER_FILES = [__file__, parameters.__file__, schema_diff.__file__]
+
+
+def HashFiles(filenames: List[str]) -> str:
+    """Hash the names and contents of files, some of which may be absent."""
+    hsh = hashlib.sha256()
+    for filename in filenames:
+        hsh.update(path.basename(filename).encode('utf8'))
         if path.exists(filename):
-            endpoint['response'] = ReadJsonWithComments(path.join(root, 'response.json'))
+            with open(filename, 'rb') as infile:
+                contents = infile.read()
+            hsh.update(len(contents).to_bytes(8, 'little'))
+            hsh.update(contents)
+        else:
+            hsh.update(b'\0')
+    return hsh.hexdigest()
 
-        # Insert the name of the endpoint itself.
-        endpoint['name'] = endpoint_name
 
-        rrpairs.append((endpoint_name, endpoint))
+def FormatSchema(endpoint: JSON) -> bytes:
+    """Render an endpoint schema as written to its output file."""
+    return json.dumps(endpoint, sort_keys=True, indent=4).encode('utf8')
 
-    return rrpairs
+
+def WriteSchema(output_dir: str, endpoint: JSON) -> str:
+    """Write the schema of an endpoint to its output file. Return its hash."""
+    contents = FormatSchema(endpoint)
+    with open(path.join(output_dir, "{}.json".format(endpoint['name'])), 'wb') as outfile:
+        outfile.write(contents)
+    return hashlib.sha256(contents).hexdigest()
+
+
+def WriteVersion(output_dir: str, hashes: Dict[str, str],
+                 trees: Optional[Dict[str, JSON]] = None) -> JSON:
+    """Write the version file, with a hash of all the schemas. Return it.
+
+    You can use this hash as a version number. This is not an integer, but a
+    hash of the input; if the input is identical, the hash hasn't changed.
+    The trees of the hashes of the subtrees of the schemas, if provided, are
+    included for schema_diff.
+    """
+    hsh = hashlib.sha256()
+    for name, msghash in sorted(hashes.items()):
+        hsh.update(name.encode('ascii'))
+        hsh.update(bytes.fromhex(msghash))
+    version = {
+        'hash': hsh.hexdigest(),
+        'date': datetime.date.today().isoformat(),
+        'messages': dict(sorted(hashes.items()))
+    }
+    if trees is not None:
+        version['trees'] = dict(sorted(trees.items()))
+    with open(path.join(output_dir, "version.json"), 'w') as versfile:
+        json.dump(version, versfile, sort_keys=True, indent=4)
+    return version
+
+
+def TimedParseEndpoint(root: str) -> Tuple[JSON, float]:
+    """Parse an endpoint directory, returning the endpoint and the time taken."""
+    start = time.perf_counter()
+    endpoint = ParseEndpoint(root)
+    return endpoint, time.perf_counter() - start
+
+
+def ConvertSchemas(raw_dir: str, output_dir: str,
+                   manifest_filename: Optional[str] = None,
+                   jobs: int = 1) -> Tuple[Dict[str, str], Dict[str, JSON]]:
+    """Convert the raw downloads to schemas.
+
+    Return the hashes of the outputs, and the trees of the hashes of their
+    subtrees, by endpoint name.
+
+    If a manifest filename is provided, convert incrementally: the manifest
+    holds the hashes of the input files of each endpoint directory and of its
+    output, and the endpoints whose inputs haven't changed since the last
+    conversion are skipped. The outputs are hashed in memory as they are
+    written. The manifest is invalidated when the converter itself changes.
+
+    If `jobs` is more than one, the endpoint directories are parsed in parallel
+    by a pool of processes. The outputs are written in the order of the
+    directories, regardless of the order of completion.
+    """
+    converter_hash = HashFiles(CONVERTER_FILES)
+    entries = {}
+    if manifest_filename and path.exists(manifest_filename):
+        manifest = ReadJson(manifest_filename)
+        if manifest.get('converter') == converter_hash:
+            entries = manifest['endpoints']
+
+    # Find the endpoints to parse.
+    new_entries = {}
+    tasks = []
+    for root in IterEndpointDirs(raw_dir):
+        name = path.basename(root)
+        filename = path.join(output_dir, "{}.json".format(name))
+        inputs = {'files': HashFiles([path.join(root, input_filename)
+                                      for input_filename in INPUT_FILES])}
+        entry = entries.get(name)
+        if (entry is not None and entry['inputs'] == inputs and path.exists(filename)):
+            logging.info("Skipping %s", name)
+            new_entries[name] = entry
+        else:
+            tasks.append((name, root, inputs))
+
+    # Parse the endpoints.
+    start = time.perf_counter()
+    roots = [root for _, root, _ in tasks]
+    if jobs > 1 and len(tasks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(TimedParseEndpoint, roots))
+    else:
+        results = list(map(TimedParseEndpoint, roots))
+    elapsed = time.perf_counter() - start
+
+    os.makedirs(output_dir, exist_ok=True)
+    for (name, _, inputs), (endpoint, _) in zip(tasks, results):
+        logging.info("Processing %s", name)
+        new_entries[name] = {'inputs': inputs,
+                             'output': WriteSchema(output_dir, endpoint),
+                             'tree': schema_diff.HashTree(endpoint)}
+    if tasks:
+        # The speedup is relative to the sum of the parsing times of the
+        # endpoints, i.e., parsing them serially.
+        parse_time = sum(parse_time for _, parse_time in results)
+        logging.info("Parsed %d endpoints with %d jobs in %.2fs wall clock; "
+                     "%.2fs serial, %.2fx speedup", len(tasks), jobs, elapsed,
+                     parse_time, parse_time / elapsed)
+
+    if manifest_filename:
+        with open(manifest_filename, 'w') as outfile:
+            json.dump({'converter': converter_hash, 'endpoints': new_entries},
+                      outfile, sort_keys=True, indent=4)
+    return ({name: entry['output'] for name, entry in new_entries.items()},
+            {name: entry['tree'] for name, entry in new_entries.items()})
+
+
+def SyntheticPage(parsed: JSON, size: int) -> str:
+    """Render a schema page of about `size` bytes in the format of the site.
+
+    The messages and subclasses of a parsed page are repeated under new names,
+    suffixed with the letters of their copy number.
+    """
+    top_sizes = {name: len(json.dumps(value, indent=2))
+                 for name, value in parsed['top'].items()}
+    sub_sizes = {name: sum(len(json.dumps(value, indent=2))
+                           for value in alternatives.values())
+                 for name, alternatives in parsed.get('sub', {}).items()}
+    top, sub = {}, {}
+    total = 0
+    index = 0
+    while total < size:
+        suffix = str(index).translate(str.maketrans('0123456789', 'abcdefghij'))
+        if total < size // 2 or not sub_sizes:
+            for name, value in parsed['top'].items():
+                top[name + suffix] = value
+                total += top_sizes[name]
+        else:
+            for name, alternatives in parsed['sub'].items():
+                sub[name + suffix] = alternatives
+                total += sub_sizes[name]
+        index += 1
+    return FormatJsonWithComments({'top': top, 'sub': sub})
+
+
+def Benchmark(raw_dir: str, max_size: int):
+    """Time the parsing of synthetic schema pages of doubling sizes.
+
+    The time per byte should remain constant as the size grows. Decoding the
+    same values as a plain JSON list is timed as a baseline. The garbage
+    collector is disabled while timing, like timeit does, as its collections
+    over the growing number of decoded objects are not linear.
+    """
+    parsed = ReadJsonWithComments(path.join(raw_dir, 'GetAccount', 'response.json'))
+    size = max(max_size >> 4, 1)
+    print("{:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        "MB", "s", "MB/s", "ns/byte", "json ns/byte"))
+    rates = []
+    while size <= max_size:
+        page = SyntheticPage(parsed, size)
+        gc.disable()
+        start = time.perf_counter()
+        output = ParseJsonWithComments(page, 'Synthetic')
+        elapsed = time.perf_counter() - start
+
+        values = list(output['top'].values())
+        for alternatives in output.get('sub', {}).values():
+            values.extend(alternatives.values())
+        plain = json.dumps(values, indent=2)
+        start = time.perf_counter()
+        json.loads(plain)
+        baseline = time.perf_counter() - start
+        gc.enable()
+
+        rates.append(elapsed / len(page))
+        print("{:10.1f} {:10.3f} {:10.1f} {:10.1f} {:12.1f}".format(
+            len(page) / 2**20, elapsed, len(page) / 2**20 / elapsed,
+            elapsed / len(page) * 1e9, baseline / len(plain) * 1e9))
+        size *= 2
+    print("Time per byte, largest over smallest page: {:.2f}".format(rates[-1] / rates[0]))
 
 
 def main():
@@ -225,39 +520,53 @@ def main():
     parser.add_argument('--output', action='store',
                         default=DEFAULT_OUTPUT,
                         help="Directory path to write the clean, sanitized version to.")
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help=("Only convert the endpoints whose raw downloads have changed "
+                              "since the last incremental conversion."))
+    parser.add_argument('--manifest', action='store',
+                        help=("Filename of the manifest of the input hashes, for "
+                              "--incremental. Defaults to {} in the output "
+                              "directory.".format(MANIFEST_FILENAME)))
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                        help="Number of processes parsing the endpoint directories.")
+    parser.add_argument('--compact', action='store_true',
+                        help=("Also write the compact bundle of the schemas, with the "
+                              "shared types defined once."))
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark the parser on synthetic schema pages.")
+    parser.add_argument('--benchmark_size', action='store', type=int, default=2**24,
+                        help="Size of the largest synthetic page of the benchmark, in bytes.")
     args = parser.parse_args()
 
+    if args.benchmark:
+        Benchmark(args.raw_downloaded_data, args.benchmark_size)
+        return
+
     # Iterator over all the files downloaded by the scraping script, sanitize
     # and coalesce each of the raw files into a single JSON tuple out to a
     # single file describing the service endpoint.
-    os.makedirs(args.output, exist_ok=True)
-    hashes = {}
-    for name, endpoint in ParseSchemas(args.raw_downloaded_data):
-        logging.info("Processing %s", name)
-        filename = path.join(args.output, "{}.json".format(name))
-        with open(filename, 'w') as outfile:
-            json.dump(endpoint, outfile, sort_keys=True, indent=4)
-
-        hsh = hashlib.sha256()
-        with open(filename, 'rb') as infile:
-            hsh.update(infile.read())
-        hashes[name] = hsh
-
-    # Produce a unique hash of all the cleaned up input data. You can use this
-    # as a version number. This is not an integer, but a hash of the input; if
-    # the input is identical, the hash hasn't changed.
-    hsh = hashlib.sha256()
-    for name, msghash in sorted(hashes.items()):
-        hsh.update(name.encode('ascii'))
-        hsh.update(msghash.digest())
-    version = {
-        'hash': hsh.hexdigest(),
-        'date': datetime.date.today().isoformat(),
-        'messages': {name: msghash.hexdigest()
-                     for name, msghash in sorted(hashes.items())}
-    }
-    with open(path.join(args.output, "version.json"), 'w') as versfile:
-        json.dump(version, versfile, sort_keys=True, indent=4)
+    manifest_filename = None
+    if args.incremental:
+        manifest_filename = args.manifest or path.join(args.output, MANIFEST_FILENAME)
+    hashes, trees = ConvertSchemas(args.raw_downloaded_data, args.output,
+                                   manifest_filename, args.jobs)
+
+    # Produce a unique hash of all the cleaned up input data, as a version.
+    version = WriteVersion(args.output, hashes, trees)
+
+    # Bundle all the schemas for fast loading by the registry. The bundle of an
+    # unchanged version is kept, rather than rereading all the schemas.
+    bundle_filename = path.join(args.output, schema_registry.BUNDLE_FILENAME)
+    if schema_registry.BundleHash(bundle_filename) == version['hash']:
+        logging.info("Bundle up to date")
+    else:
+        schema_registry.WriteBundle(args.output, version)
+
+    if args.compact:
+        # Imported here, as it imports this module.
+        import compact_bundle
+        bundle = compact_bundle.WriteCompactBundle(args.output, version)
+        logging.info("Wrote compact bundle with %d definitions", len(bundle['definitions']))
 
 
 if __name__ == '__main__':
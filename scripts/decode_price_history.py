@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Decode GetPriceHistory responses into columnar NumPy arrays.
+
+The record layout is derived from the candle type of the GetPriceHistory
+schema, each field getting the dtype of its 'format'. Many responses can be
+decoded into a single growable buffer, and the candles are parsed straight from
+the text of the response without building a dict (or any other Python object)
+per candle.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import logging
+import re
+import time
+import tracemalloc
+
+import numpy
+
+import generate_validators
+import validate_stream
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples used in the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+
+# A mapping of schema (type, format) to NumPy dtype.
+FORMAT_DTYPES = {
+    ('integer', 'int32'): numpy.int32,
+    ('integer', 'int64'): numpy.int64,
+    ('integer', None): numpy.int64,
+    ('number', 'float'): numpy.float32,
+    ('number', 'double'): numpy.float64,
+    ('number', None): numpy.float64,
+    ('boolean', None): numpy.bool_,
+}
+
+
+# Initial number of candles of a buffer.
+INITIAL_CAPACITY = 4096
+
+
+# Bytes translations to strip the text of the candles, applied in C.
+_WHITESPACE = b' \t\r\n'
+_NUMBER_CHARS = b'0123456789.-+eE'
+_SEPARATORS = bytes.maketrans(bytes(range(1, 32)) + b'{},', b' ' * 34)
+
+_CANDLES_RE = re.compile(rb'"candles"\s*:\s*\[')
+_SYMBOL_RE = re.compile(rb'"symbol"\s*:\s*"([^"]*)"')
+
+
+def CandleDtype(schema: JSON) -> numpy.dtype:
+    """Build the record dtype of the candles from the GetPriceHistory schema."""
+    candles = schema['response']['top']['CandleList']['candles']
+    fields = []
+    for name, field in sorted(candles['items']['properties'].items()):
+        key = (field['type'], field.get('format'))
+        if key not in FORMAT_DTYPES:
+            raise ValueError("No dtype for candle field {!r} of {}".format(name, key))
+        fields.append((name, FORMAT_DTYPES[key]))
+    return numpy.dtype(fields)
+
+
+def FindCandles(body: bytes) -> Tuple[int, int]:
+    """Find the span of the contents of the candles array of a response."""
+    match = _CANDLES_RE.search(body)
+    if not match:
+        raise ValueError("No candles array in response")
+    # Candles contain no nested arrays, the first closing bracket ends it.
+    end = body.find(b']', match.end())
+    if end == -1:
+        raise ValueError("Unterminated candles array in response")
+    return match.end(), end
+
+
+class CandleBuffer:
+    """A growable buffer of candles, decoded from many responses.
+
+    The records of all the responses are stored contiguously; the span of each
+    symbol's candles is kept in 'spans'.
+    """
+
+    def __init__(self, dtype: numpy.dtype, capacity: int = INITIAL_CAPACITY):
+        self.dtype = dtype
+        self.data = numpy.empty(capacity, dtype=dtype)
+        self.size = 0
+        self.spans: List[Tuple[str, int, int]] = []
+
+    def Reserve(self, count: int):
+        """Ensure there is room for `count` more candles."""
+        needed = self.size + count
+        if needed <= len(self.data):
+            return
+        capacity = max(len(self.data), 1)
+        while capacity < needed:
+            capacity *= 2
+        data = numpy.empty(capacity, dtype=self.dtype)
+        data[:self.size] = self.data[:self.size]
+        self.data = data
+
+    def Decode(self, body: bytes, symbol: Optional[str] = None) -> slice:
+        """Decode the candles of a response body and append them.
+
+        Returns the slice of the appended candles.
+        """
+        if symbol is None:
+            match = _SYMBOL_RE.search(body)
+            symbol = match.group(1).decode('utf8') if match else ''
+        start, end = FindCandles(body)
+        contents = body[start:end].translate(None, _WHITESPACE)
+        try:
+            values, names = self._ParseUniform(contents)
+        except ValueError:
+            values, names = self._ParseGeneric(contents)
+
+        count = len(values)
+        missing = set(self.dtype.names) - set(names)
+        if count and missing:
+            raise ValueError("Missing candle fields: {}".format(sorted(missing)))
+        self.Reserve(count)
+        records = self.data[self.size:self.size + count]
+        for column, name in enumerate(names):
+            if name in records.dtype.names:
+                # Note: Integer fields go through doubles, exact for
+                # millisecond timestamps and any realistic volume.
+                records[name] = values[:, column]
+
+        span = slice(self.size, self.size + count)
+        self.spans.append((symbol, span.start, span.stop))
+        self.size += count
+        return span
+
+    def _ParseUniform(self, contents: bytes) -> Tuple[numpy.ndarray, List[str]]:
+        """Parse candles which all have the same layout as the first one.
+
+        All the numbers are parsed in a single pass in C. The keys are first
+        replaced by single control characters, and the layout is verified by
+        comparing the skeleton of the array, i.e. the text without the numbers,
+        to that of the first candle repeated.
+        """
+        if not contents:
+            return numpy.empty((0, 0)), []
+        first_end = contents.find(b'}') + 1
+        names = list(json.loads(contents[:first_end]))
+        if not 0 < len(names) < 32:
+            raise ValueError("Unexpected number of candle fields")
+        for index, name in enumerate(names, 1):
+            contents = contents.replace(json.dumps(name).encode('utf8') + b':',
+                                        bytes([index]))
+        count = contents.count(b'{')
+        skeleton = contents[:contents.find(b'}') + 1].translate(None, _NUMBER_CHARS)
+        if contents.translate(None, _NUMBER_CHARS) != b','.join([skeleton] * count):
+            raise ValueError("Candles with heterogeneous layouts")
+        text = contents.translate(_SEPARATORS)
+        values = numpy.fromstring(text, dtype=numpy.float64, sep=' ')
+        if len(values) != count * len(names):
+            raise ValueError("Unexpected number of values in candles")
+        return values.reshape(count, len(names)), names
+
+    def _ParseGeneric(self, contents: bytes) -> Tuple[numpy.ndarray, List[str]]:
+        """Parse candles with arbitrary field orders, through decoded JSON."""
+        candles = json.loads(b'[' + contents + b']')
+        names = list(self.dtype.names)
+        values = numpy.empty((len(candles), len(names)))
+        try:
+            for column, name in enumerate(names):
+                column_values = [candle[name] for candle in candles]
+                for value in column_values:
+                    if type(value) not in (int, float):
+                        raise ValueError("Invalid candle field {}: {!r}".format(name, value))
+                values[:, column] = column_values
+        except KeyError as exc:
+            raise ValueError("Missing candle field: {}".format(exc))
+        return values, names
+
+    @property
+    def array(self) -> numpy.ndarray:
+        """The structured array of all the candles decoded so far."""
+        return self.data[:self.size]
+
+    def Columns(self) -> Dict[str, numpy.ndarray]:
+        """Return a column array per field, as views over the buffer."""
+        array = self.array
+        return {name: array[name] for name in self.dtype.names}
+
+    def Symbol(self, symbol: str) -> numpy.ndarray:
+        """Return the candles of a symbol."""
+        for name, start, stop in self.spans:
+            if name == symbol:
+                return self.data[start:stop]
+        raise KeyError(symbol)
+
+
+def Benchmark(schemas: Dict[str, JSON], raw_dir: str, size: int, count: int):
+    """Compare decoding to dicts and converting, to decoding into a buffer."""
+    schema = schemas['GetPriceHistory']
+    dtype = CandleDtype(schema)
+    body = validate_stream.SyntheticBody(schema, raw_dir, size)
+    body = json.loads(body)
+    for index, candle in enumerate(body['candles']):
+        candle.update(open=100 + index * 0.25, high=101.5, low=99.25, close=100.5,
+                      volume=1000 + index)
+    bodies = [json.dumps(dict(body, symbol='SYM{}'.format(index))).encode('utf8')
+              for index in range(count)]
+    num_candles = len(body['candles']) * count
+
+    def RunDicts():
+        columns = {name: [] for name in dtype.names}
+        for data in bodies:
+            for candle in json.loads(data)['candles']:
+                for name, column in columns.items():
+                    column.append(candle[name])
+        return {name: numpy.array(column, dtype=dtype[name])
+                for name, column in columns.items()}
+
+    def RunBuffer():
+        buf = CandleBuffer(dtype)
+        for data in bodies:
+            buf.Decode(data)
+        return buf.Columns()
+
+    results = {}
+    for function in RunDicts, RunBuffer:
+        start = time.perf_counter()
+        columns = function()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[function.__name__[3:].lower()] = (columns, elapsed, peak / 2**20)
+    expected, actual = results['dicts'][0], results['buffer'][0]
+    for name in dtype.names:
+        assert numpy.array_equal(expected[name], actual[name]), name
+
+    print("dtype: {}".format(dtype))
+    print("{} responses, {} candles".format(count, num_candles))
+    print("{:20} {:>10} {:>14} {:>10}".format("Method", "s", "candles/s", "peak MB"))
+    for name, (_, elapsed, peak) in results.items():
+        print("{:20} {:10.3f} {:14.0f} {:10.1f}".format(
+            name, elapsed, num_candles / elapsed, peak))
+    print("Speedup: {:.1f}x".format(results['dicts'][1] / results['buffer'][1]))
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('filenames', nargs='*',
+                        help="GetPriceHistory response bodies to decode.")
+    parser.add_argument('--output', action='store',
+                        help="Output .npz file for the columns and symbol spans.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark against decoding candles to dicts.")
+    parser.add_argument('--benchmark_size', action='store', type=int, default=2**20,
+                        help="Size of each synthetic response for the benchmark, in bytes.")
+    parser.add_argument('--benchmark_count', action='store', type=int, default=20,
+                        help="Number of synthetic responses for the benchmark.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples from, for the benchmark.")
+    args = parser.parse_args()
+
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    if args.benchmark:
+        Benchmark(schemas, args.raw_downloaded_data,
+                  args.benchmark_size, args.benchmark_count)
+        return
+
+    buf = CandleBuffer(CandleDtype(schemas['GetPriceHistory']))
+    for filename in args.filenames:
+        with open(filename, 'rb') as infile:
+            buf.Decode(infile.read())
+    for symbol, start, stop in buf.spans:
+        logging.info("%s: %d candles", symbol, stop - start)
+    if args.output:
+        spans = numpy.array(buf.spans, dtype=[('symbol', 'U32'),
+                                              ('start', numpy.int64),
+                                              ('stop', numpy.int64)])
+        numpy.savez(args.output, spans=spans, **buf.Columns())
+
+
+if __name__ == '__main__':
+    main()
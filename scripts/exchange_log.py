@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""An append-only binary log of API exchanges, with an offset index.
+
+The data file contains length-prefixed records, each tagged with the name of its
+endpoint (the 'name' of its schema) and a timestamp in nanoseconds since the
+epoch. A sidecar index file (the data filename with '.idx' appended) holds
+fixed-size (timestamp, offset, endpoint hash) entries in the order of the
+records. The timestamps must be non-decreasing, so readers can mmap the index,
+binary-search it for a time range and slice the records out of the mmapped data
+file without copying them.
+
+The payloads are opaque to the container; the command-line tool stores Exchange
+messages converted from JSONL exchange logs by transcode_proto.py.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Iterator, NamedTuple, Optional
+import argparse
+import bisect
+import datetime
+import decimal
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+import zlib
+
+import generate_validators
+import transcode_proto
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples used in the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+
+# Magic headers of the data and index files.
+DATA_MAGIC = b'AMTLOG01'
+INDEX_MAGIC = b'AMTIDX01'
+
+# Header of a record of the data file: payload size, timestamp and size of the
+# endpoint name, which follows, then the payload.
+RECORD_HEADER = struct.Struct('<IqH')
+
+# An entry of the index: timestamp, offset of the record in the data file and
+# CRC32 of the endpoint name, for filtering without reading the data.
+INDEX_ENTRY = struct.Struct('<qQI4x')
+
+
+class Record(NamedTuple):
+    """A record of the log. The payload is a view on the mmapped data file."""
+    timestamp: int
+    endpoint: str
+    payload: memoryview
+
+
+def EndpointHash(endpoint: str) -> int:
+    return zlib.crc32(endpoint.encode('utf8'))
+
+
+def IndexFilename(filename: str) -> str:
+    return filename + '.idx'
+
+
+def CheckMagic(infile, magic: bytes, filename: str):
+    """Check the header of a file, writing it if the file is empty."""
+    infile.seek(0)
+    header = infile.read(len(magic))
+    if not header:
+        infile.write(magic)
+    elif header != magic:
+        raise ValueError("Invalid header for {}".format(filename))
+
+
+class LogWriter:
+    """Append records to a log and its index.
+
+    Opening a log recovers it from an interrupted write: a truncated record is
+    removed from the data file, and the index is truncated or completed to
+    match the records.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        mode = 'r+b' if path.exists(filename) else 'w+b'
+        self.data = open(filename, mode)
+        index_filename = IndexFilename(filename)
+        self.index = open(index_filename, 'r+b' if path.exists(index_filename) else 'w+b')
+        CheckMagic(self.data, DATA_MAGIC, filename)
+        CheckMagic(self.index, INDEX_MAGIC, index_filename)
+        self.last_timestamp = None
+        self.Recover()
+
+    def Recover(self):
+        """Reconcile the index with the data file, after an interrupted write."""
+        data_size = self.data.seek(0, os.SEEK_END)
+        index_size = self.index.seek(0, os.SEEK_END)
+        num_entries = (index_size - len(INDEX_MAGIC)) // INDEX_ENTRY.size
+
+        # Drop the entries of the records beyond the end of the data.
+        offset = len(DATA_MAGIC)
+        while num_entries > 0:
+            self.index.seek(len(INDEX_MAGIC) + (num_entries - 1) * INDEX_ENTRY.size)
+            timestamp, last_offset, _ = INDEX_ENTRY.unpack(self.index.read(INDEX_ENTRY.size))
+            end = self.RecordEnd(last_offset, data_size)
+            if end is not None:
+                offset = end
+                self.last_timestamp = timestamp
+                break
+            num_entries -= 1
+        self.index.truncate(len(INDEX_MAGIC) + num_entries * INDEX_ENTRY.size)
+
+        # Index the complete records beyond the last indexed one.
+        while True:
+            end = self.RecordEnd(offset, data_size)
+            if end is None:
+                break
+            self.data.seek(offset)
+            _, timestamp, name_size = RECORD_HEADER.unpack(self.data.read(RECORD_HEADER.size))
+            endpoint = self.data.read(name_size).decode('utf8')
+            self.WriteEntry(timestamp, offset, endpoint)
+            offset = end
+        if offset < data_size:
+            logging.warning("Truncating incomplete record at offset %d of %s",
+                            offset, self.filename)
+        self.data.truncate(offset)
+        self.data.seek(offset)
+        self.index.seek(0, os.SEEK_END)
+
+    def RecordEnd(self, offset: int, data_size: int) -> Optional[int]:
+        """Return the end offset of a complete record, or None."""
+        if offset + RECORD_HEADER.size > data_size:
+            return None
+        self.data.seek(offset)
+        size, _, name_size = RECORD_HEADER.unpack(self.data.read(RECORD_HEADER.size))
+        end = offset + RECORD_HEADER.size + name_size + size
+        return end if end <= data_size else None
+
+    def WriteEntry(self, timestamp: int, offset: int, endpoint: str):
+        self.index.write(INDEX_ENTRY.pack(timestamp, offset, EndpointHash(endpoint)))
+        self.last_timestamp = timestamp
+
+    def Append(self, endpoint: str, payload: bytes, timestamp: Optional[int] = None) -> int:
+        """Append a record and return its offset.
+
+        The timestamp defaults to the current time, in nanoseconds.
+        """
+        if timestamp is None:
+            timestamp = time.time_ns()
+            if self.last_timestamp is not None:
+                timestamp = max(timestamp, self.last_timestamp)
+        elif self.last_timestamp is not None and timestamp < self.last_timestamp:
+            raise ValueError("Timestamps must be non-decreasing: {} < {}".format(
+                timestamp, self.last_timestamp))
+        name = endpoint.encode('utf8')
+        offset = self.data.tell()
+        # The data is written before the index entry referencing it.
+        self.data.write(RECORD_HEADER.pack(len(payload), timestamp, len(name)))
+        self.data.write(name)
+        self.data.write(payload)
+        self.WriteEntry(timestamp, offset, endpoint)
+        return offset
+
+    def Flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def Close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.Close()
+
+
+class _Timestamps:
+    """A sequence view of the timestamps of an index, for bisect."""
+
+    def __init__(self, reader: 'LogReader'):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, index: int) -> int:
+        return self.reader.Entry(index)[0]
+
+
+class LogReader:
+    """Read the records of a log, through mmaps of its data and index files.
+
+    The records are views on the mmapped data, valid until the reader is closed.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, 'rb') as infile:
+            self.data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(IndexFilename(filename), 'rb') as infile:
+            self.index = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(DATA_MAGIC)] != DATA_MAGIC:
+            raise ValueError("Invalid header for {}".format(filename))
+        if self.index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError("Invalid header for {}".format(IndexFilename(filename)))
+        self.view = memoryview(self.data)
+        # Ignore a partially written entry.
+        self.num_entries = (len(self.index) - len(INDEX_MAGIC)) // INDEX_ENTRY.size
+
+    def __len__(self) -> int:
+        return self.num_entries
+
+    def Entry(self, index: int):
+        """Return the (timestamp, offset, endpoint hash) of an index entry."""
+        return INDEX_ENTRY.unpack_from(self.index, len(INDEX_MAGIC) + index * INDEX_ENTRY.size)
+
+    def Record(self, index: int) -> Record:
+        """Return a record by its position."""
+        _, offset, _ = self.Entry(index)
+        return self.ReadRecord(offset)
+
+    def ReadRecord(self, offset: int) -> Record:
+        size, timestamp, name_size = RECORD_HEADER.unpack_from(self.data, offset)
+        start = offset + RECORD_HEADER.size
+        endpoint = bytes(self.view[start:start + name_size]).decode('utf8')
+        start += name_size
+        if start + size > len(self.data):
+            raise ValueError("Truncated record at offset {}".format(offset))
+        return Record(timestamp, endpoint, self.view[start:start + size])
+
+    def Bisect(self, timestamp: int) -> int:
+        """Return the position of the first record at or after a timestamp."""
+        return bisect.bisect_left(_Timestamps(self), timestamp)
+
+    def Range(self, start: Optional[int] = None, end: Optional[int] = None,
+              endpoint: Optional[str] = None) -> Iterator[Record]:
+        """Yield the records within [start, end), optionally for one endpoint."""
+        first = 0 if start is None else self.Bisect(start)
+        last = len(self) if end is None else self.Bisect(end)
+        endpoint_hash = None if endpoint is None else EndpointHash(endpoint)
+        for index in range(first, last):
+            _, offset, entry_hash = self.Entry(index)
+            if endpoint_hash is not None and entry_hash != endpoint_hash:
+                continue
+            record = self.ReadRecord(offset)
+            if endpoint is None or record.endpoint == endpoint:
+                yield record
+
+    def __iter__(self) -> Iterator[Record]:
+        return self.Range()
+
+    def Close(self):
+        """Close the mmaps. Those with records still referenced are left to be
+        closed when the records are released."""
+        self.view.release()
+        for mapping in self.data, self.index:
+            try:
+                mapping.close()
+            except BufferError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.Close()
+
+
+def ParseTime(string: str) -> int:
+    """Parse an ISO date/time, or seconds since the epoch, to nanoseconds.
+
+    The seconds are converted as decimals: as floats, the current times lose
+    the precision of their nanoseconds.
+    """
+    try:
+        seconds = decimal.Decimal(string)
+    except decimal.InvalidOperation:
+        dtime = datetime.datetime.fromisoformat(string)
+        whole = int(dtime.replace(microsecond=0).timestamp())
+        return whole * 10**9 + dtime.microsecond * 1000
+    if not seconds.is_finite():
+        raise ValueError("Invalid time: {}".format(string))
+    return int(seconds * 10**9)
+
+
+def FormatTime(timestamp: int) -> str:
+    """Format nanoseconds since the epoch as exact decimal seconds."""
+    return '{:f}'.format(decimal.Decimal(timestamp).scaleb(-9))
+
+
+def AppendRecords(codec: transcode_proto.ExchangeCodec, filename: str, input_filename: str) -> int:
+    """Append the records of a JSONL exchange log. Returns their count.
+
+    The time of the records is taken from their optional 'timestamp' field, in
+    seconds since the epoch as a number or a decimal string, e.g. as output by
+    the queries, and defaults to the current time.
+    """
+    count = 0
+    with LogWriter(filename) as writer, open(input_filename, 'rb') as infile:
+        for line in infile:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            timestamp = record.pop('timestamp', None)
+            if isinstance(timestamp, str):
+                timestamp = ParseTime(timestamp)
+            elif timestamp is not None:
+                # From the shortest representation of the decoded float.
+                timestamp = ParseTime(repr(timestamp))
+            endpoint = codec.router.Endpoint(record)
+            if endpoint is None:
+                raise ValueError("Unknown endpoint for record at line {}".format(count + 1))
+            writer.Append(endpoint, codec.Encode(record), timestamp)
+            count += 1
+    return count
+
+
+def Benchmark(num_records: int, payload_size: int, num_queries: int):
+    """Compare indexed time range queries with scanning the data file."""
+    endpoints = ['GetAccount', 'GetQuotes', 'GetOrder', 'PlaceOrder', 'GetPriceHistory']
+    rng = random.Random(0)
+    payload = bytes(rng.getrandbits(8) for _ in range(payload_size))
+    start_time = 1_600_000_000 * 10**9
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = path.join(tmpdir, 'exchanges.log')
+        begin = time.perf_counter()
+        with LogWriter(filename) as writer:
+            for index in range(num_records):
+                writer.Append(endpoints[index % len(endpoints)], payload,
+                              start_time + index * 10**6)
+        write_elapsed = time.perf_counter() - begin
+        print("{} records, {:.1f} MB, written at {:.0f} records/s".format(
+            num_records, path.getsize(filename) / 2**20, num_records / write_elapsed))
+
+        # Query windows of 1% of the records for one endpoint.
+        window = num_records // 100 * 10**6
+        queries = [start_time + rng.randrange(num_records) * 10**6 for _ in range(num_queries)]
+        with LogReader(filename) as reader:
+            begin = time.perf_counter()
+            indexed = [sum(len(record.payload)
+                           for record in reader.Range(qstart, qstart + window, 'GetAccount'))
+                       for qstart in queries]
+            indexed_elapsed = time.perf_counter() - begin
+
+        # Scan the data file without the index.
+        begin = time.perf_counter()
+        scanned = []
+        for qstart in queries:
+            total = 0
+            with open(filename, 'rb') as infile:
+                infile.read(len(DATA_MAGIC))
+                while True:
+                    header = infile.read(RECORD_HEADER.size)
+                    if not header:
+                        break
+                    size, timestamp, name_size = RECORD_HEADER.unpack(header)
+                    endpoint = infile.read(name_size).decode('utf8')
+                    data = infile.read(size)
+                    if qstart <= timestamp < qstart + window and endpoint == 'GetAccount':
+                        total += len(data)
+            scanned.append(total)
+        scan_elapsed = time.perf_counter() - begin
+        assert indexed == scanned
+
+    print("{:10} {:>12} {:>12}".format("Method", "ms/query", "speedup"))
+    print("{:10} {:12.3f} {:12}".format("scan", scan_elapsed / num_queries * 1e3, ""))
+    print("{:10} {:12.3f} {:11.0f}x".format("index", indexed_elapsed / num_queries * 1e3,
+                                            scan_elapsed / indexed_elapsed))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('command', nargs='?', choices=['append', 'query'],
+                        help=("Append the records of a JSONL exchange log, or query the "
+                              "records as JSONL."))
+    parser.add_argument('log', nargs='?',
+                        help="Filename of the binary log.")
+    parser.add_argument('input', nargs='?',
+                        help="Input JSONL exchange log, to append.")
+    parser.add_argument('--start', action='store', type=ParseTime,
+                        help="Start of the time range of the query, inclusive.")
+    parser.add_argument('--end', action='store', type=ParseTime,
+                        help="End of the time range of the query, exclusive.")
+    parser.add_argument('--endpoint', action='store',
+                        help="Name of the endpoint of the records to query.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark indexed queries against scanning the log.")
+    parser.add_argument('--benchmark_records', action='store', type=int, default=200000,
+                        help="Number of records of the log for the benchmark.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.benchmark_records, 1024, 20)
+        return
+    if not (args.command and args.log):
+        parser.error("A command and a log filename are required.")
+
+    logging.getLogger().setLevel(logging.ERROR)
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    codec = transcode_proto.ExchangeCodec(
+        schemas, transcode_proto.LoadTranscoder(args.clean_schemas))
+    logging.getLogger().setLevel(logging.INFO)
+
+    if args.command == 'append':
+        if not args.input:
+            parser.error("An input JSONL log is required.")
+        count = AppendRecords(codec, args.log, args.input)
+        logging.info("Appended %d records", count)
+    else:
+        with LogReader(args.log) as reader:
+            for record in reader.Range(args.start, args.end, args.endpoint):
+                exchange = codec.Decode(record.payload)
+                exchange['timestamp'] = FormatTime(record.timestamp)
+                print(json.dumps(exchange))
+
+
+if __name__ == '__main__':
+    main()
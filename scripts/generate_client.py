@@ -0,0 +1,686 @@
+#!/usr/bin/env python3
+"""Generate an asynchronous client of the Ameritrade API endpoints.
+
+The client has a coroutine method per endpoint, taking its URL parameters as
+positional arguments and its query parameters as keyword arguments, validated
+and encoded by code generated from their types, like the query encoders. All the
+requests share a pool of keep-alive connections to the API, with several
+requests pipelined on each, so that many can be in flight at once:
+
+    async with ameritrade_client.Client(access_token=token) as client:
+        accounts, quotes = await asyncio.gather(
+            client.GetAccounts(fields=['positions']),
+            client.GetQuotes(symbol='AAPL,MSFT'))
+
+The responses are returned as decoded JSON, or if given the generated
+validators and message classes, validated and decoded into the classes:
+
+    client = ameritrade_client.Client(
+        validators=ameritrade_validators.VALIDATORS,
+        classes=vars(ameritrade_messages))
+
+See --benchmark for polling many accounts serially and concurrently, from a
+mock server with the latency of a network.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Dict, List, Tuple
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import logging
+import multiprocessing
+import time
+
+import generate_messages
+import generate_payloads
+import generate_proto_schemas
+import generate_query_encoders
+import generate_validators
+import mock_server
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples served by the mock server of the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+# The base URL of the API, prefixing the URLs of the endpoints in the schemas.
+BASE_URL = 'https://api.tdameritrade.com'
+
+# The endpoints whose request bodies are form-encoded rather than JSON.
+FORM_BODIES = {'PostAccessToken'}
+
+# The methods of the requests retried once when their connection is lost
+# before their response, e.g. a keep-alive connection closed by the server.
+IDEMPOTENT_METHODS = {'GET', 'PUT', 'DELETE'}
+
+
+_PRELUDE = '''\
+# -*- mode: python -*-
+# THIS FILE IS AUTO-GENERATED by generate_client.py.
+"""Asynchronous client of the Ameritrade API.
+
+The Client class has a coroutine method per endpoint. The URL parameters are
+positional, and the query parameters keywords, omitted if None; invalid values
+raise a QueryError before sending anything. The requests share a pool of
+keep-alive HTTP/1.1 connections, with up to `pipeline` requests in flight on
+each of `max_connections`. Error statuses raise an ApiError.
+
+The responses are returned as decoded JSON. If the client is given the mapping
+of the generated validators, the response bodies are validated and a SchemaError
+raised for the invalid ones, and the request bodies before sending them. If it
+is given a mapping of the generated message classes, the objects of the
+responses are decoded into them, and those of the requests can be messages.
+"""
+
+import asyncio
+import collections
+import json
+import ssl as _ssl
+import urllib.parse
+
+'''
+
+_RUNTIME = '''
+
+BASE_URL = %(base_url)r
+
+_IDEMPOTENT = frozenset(%(idempotent)r)
+
+
+class ApiError(Exception):
+    """An error status of the API."""
+
+    def __init__(self, endpoint, status, headers, body):
+        super().__init__('{}: {} {}'.format(endpoint, status, body[:200].decode('utf8', 'replace')))
+        self.endpoint = endpoint
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class SchemaError(ValueError):
+    """A request or response body invalid for the schema of its endpoint."""
+
+    def __init__(self, endpoint, errors):
+        super().__init__('{}: {}'.format(endpoint, '; '.join(
+            '{}: {}'.format(loc or '.', message) for loc, message in errors[:3])))
+        self.endpoint = endpoint
+        self.errors = errors
+
+
+def _Unchunk(buffer, index):
+    """Decode a chunked body starting at an index. Return it and its end, or None."""
+    chunks = []
+    while True:
+        line_end = buffer.find(b'\\r\\n', index)
+        if line_end < 0:
+            return None
+        size = int(buffer[index:line_end].split(b';')[0], 16)
+        index = line_end + 2
+        if size == 0:
+            # Skip the trailers, up to an empty line.
+            while True:
+                line_end = buffer.find(b'\\r\\n', index)
+                if line_end < 0:
+                    return None
+                if line_end == index:
+                    return b''.join(chunks), index + 2
+                index = line_end + 2
+        if index + size + 2 > len(buffer):
+            return None
+        chunks.append(buffer[index:index + size])
+        index += size + 2
+
+
+class _Connection(asyncio.Protocol):
+    """A keep-alive HTTP/1.1 connection, with pipelined requests.
+
+    The responses are matched to the futures of the requests in order. Those of
+    the cancelled requests are read and dropped.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.transport = None
+        self.futures = collections.deque()
+        self.buffer = b''
+        self.closing = False
+        # The head of a response delimited by the end of the connection, as a
+        # (status, headers, offset of the body) triple.
+        self.until_eof = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def Send(self, request):
+        future = asyncio.get_running_loop().create_future()
+        self.futures.append(future)
+        self.transport.write(request)
+        return future
+
+    def data_received(self, data):
+        buffer = self.buffer + data if self.buffer else data
+        index = 0
+        while self.futures and self.until_eof is None:
+            end = buffer.find(b'\\r\\n\\r\\n', index)
+            if end < 0:
+                break
+            lines = buffer[index:end].decode('latin-1').split('\\r\\n')
+            status = int(lines[0][9:12])
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            start = end + 4
+            length = headers.get('content-length')
+            if length is not None:
+                body_end = start + int(length)
+                if body_end > len(buffer):
+                    break
+                body = buffer[start:body_end]
+            elif headers.get('transfer-encoding', '').lower() == 'chunked':
+                chunked = _Unchunk(buffer, start)
+                if chunked is None:
+                    break
+                body, body_end = chunked
+            elif status in (204, 304) or status < 200:
+                body, body_end = b'', start
+            else:
+                self.until_eof = (status, headers, start - index)
+                break
+            index = body_end
+            self.Resolve(status, headers, body)
+            if headers.get('connection', '').lower() == 'close':
+                self.Close()
+                break
+        self.buffer = buffer[index:]
+
+    def Resolve(self, status, headers, body):
+        future = self.futures.popleft()
+        if not future.done():
+            future.set_result((status, headers, body))
+
+    def eof_received(self):
+        if self.until_eof is not None:
+            status, headers, offset = self.until_eof
+            self.until_eof = None
+            self.Resolve(status, headers, self.buffer[offset:])
+            self.buffer = b''
+
+    def connection_lost(self, exc):
+        self.closing = True
+        self.pool.Discard(self)
+        while self.futures:
+            future = self.futures.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError(
+                    'Connection lost before the response: {}'.format(exc or 'closed')))
+
+    def Close(self):
+        self.closing = True
+        self.pool.Discard(self)
+        self.transport.close()
+
+
+class _Pool:
+    """The keep-alive connections to a host, shared by the requests.
+
+    A request is sent on an idle connection, or on a new one up to
+    `max_connections`, or else pipelined on the least loaded one. At most
+    `pipeline` requests are in flight per connection; the others wait for a
+    slot.
+    """
+
+    def __init__(self, host, port, ssl, max_connections, pipeline):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.max_connections = max_connections
+        self.connections = []
+        self.opening = 0
+        self.slots = asyncio.Semaphore(max_connections * pipeline)
+
+    async def Send(self, request):
+        """Send an encoded request. Return the (status, headers, body) of its response."""
+        async with self.slots:
+            connection = self.Choose()
+            if connection is None:
+                connection = await self.Open()
+            return await connection.Send(request)
+
+    def Choose(self):
+        best = None
+        for connection in self.connections:
+            if not connection.futures:
+                return connection
+            if best is None or len(connection.futures) < len(best.futures):
+                best = connection
+        if len(self.connections) + self.opening < self.max_connections:
+            return None
+        return best
+
+    async def Open(self):
+        self.opening += 1
+        try:
+            _, connection = await asyncio.get_running_loop().create_connection(
+                lambda: _Connection(self), self.host, self.port, ssl=self.ssl)
+        finally:
+            self.opening -= 1
+        self.connections.append(connection)
+        return connection
+
+    def Discard(self, connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+
+    def Close(self):
+        for connection in list(self.connections):
+            connection.Close()
+
+
+class _ClientBase:
+    """The pool, encoding and decoding of the requests of the client."""
+
+    def __init__(self, base_url=BASE_URL, *, apikey=None, access_token=None,
+                 max_connections=8, pipeline=4, validators=None, classes=None):
+        parts = urllib.parse.urlsplit(base_url)
+        secure = parts.scheme == 'https'
+        self.prefix = parts.path.rstrip('/')
+        self.apikey = apikey
+        self.validators = validators
+        self.classes = classes
+        self.pool = _Pool(parts.hostname, parts.port or (443 if secure else 80),
+                          _ssl.create_default_context() if secure else None,
+                          max_connections, pipeline)
+        headers = 'Host: {}\\r\\nAccept: application/json\\r\\n'.format(parts.netloc)
+        if access_token:
+            headers += 'Authorization: Bearer {}\\r\\n'.format(access_token)
+        self.headers = headers.encode('latin-1')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.Close()
+
+    def Close(self):
+        """Close the connections."""
+        self.pool.Close()
+
+    async def Request(self, endpoint, method, target, body=None, content_type=None):
+        """Send a request and return the body of its successful response.
+
+        The idempotent requests are retried once if their connection is lost
+        before their response.
+        """
+        request = '{} {}{} HTTP/1.1\\r\\n'.format(method, self.prefix, target).encode('latin-1')
+        request += self.headers
+        if body is not None:
+            request += 'Content-Type: {}\\r\\nContent-Length: {}\\r\\n\\r\\n'.format(
+                content_type, len(body)).encode('latin-1') + body
+        else:
+            request += b'\\r\\n'
+        try:
+            status, headers, data = await self.pool.Send(request)
+        except ConnectionError:
+            if method not in _IDEMPOTENT:
+                raise
+            status, headers, data = await self.pool.Send(request)
+        if not 200 <= status < 300:
+            raise ApiError(endpoint, status, headers, data)
+        return data
+
+    async def Call(self, endpoint, method, target, body=None):
+        """Call an endpoint. Return its decoded response, or None if empty."""
+        content_type = None
+        if body is not None:
+            body, content_type = self.EncodeBody(endpoint, body)
+        data = await self.Request(endpoint, method, target, body, content_type)
+        if not data:
+            return None
+        value = json.loads(data)
+        if endpoint in _RESPONSES and (self.validators is not None or self.classes is not None):
+            value = self.Decode(endpoint, _RESPONSES[endpoint], value)
+        return value
+
+    def EncodeBody(self, endpoint, body):
+        """Validate and encode the body of a request."""
+        if hasattr(body, 'ToDict'):
+            body = body.ToDict()
+        if self.validators is not None and endpoint in _REQUESTS:
+            _, types = _REQUESTS[endpoint]
+            errors = self.validators[endpoint][types[0][0]](body)
+            if errors:
+                raise SchemaError(endpoint, errors)
+        if endpoint in _FORM_BODIES:
+            return (urllib.parse.urlencode(body).encode('ascii'),
+                    'application/x-www-form-urlencoded')
+        return json.dumps(body, separators=(',', ':')).encode('utf8'), 'application/json'
+
+    def Decode(self, endpoint, payload, value):
+        """Validate and decode a response, an object, an array or a mapping by symbol."""
+        shape, types = payload
+        if shape == 'array' and value.__class__ is list:
+            return [self.DecodeObject(endpoint, types, item) for item in value]
+        if shape == 'symbols' and value.__class__ is dict:
+            return {symbol: self.DecodeObject(endpoint, types, item)
+                    for symbol, item in value.items()}
+        return self.DecodeObject(endpoint, types, value)
+
+    def DecodeObject(self, endpoint, types, value):
+        """Validate and decode an object of one of the top-level types of an endpoint.
+
+        With several types, e.g. the quotes, the first valid one is used, or
+        without validators, the first with all the fields of the object.
+        """
+        if self.validators is not None:
+            validators = self.validators[endpoint]
+            errors = None
+            for type_name, class_name, _ in types:
+                errors = validators[type_name](value)
+                if not errors:
+                    break
+            else:
+                raise SchemaError(endpoint, errors)
+        elif len(types) == 1:
+            _, class_name, _ = types[0]
+        else:
+            keys = value.keys()
+            class_name = next((class_name for _, class_name, fields in types
+                               if fields.issuperset(keys)), types[0][1])
+        if self.classes is None:
+            return value
+        return self.classes[class_name].FromDict(value)
+'''
+
+
+class ClientGenerator:
+    """Generate the source of a module of the client of the endpoints.
+
+    The query parameters are encoded by the functions of an EncoderGenerator,
+    embedded in the module.
+    """
+
+    def __init__(self):
+        self.encoders = generate_query_encoders.EncoderGenerator()
+        # The generated methods of the client.
+        self.methods = []
+        # The payloads of the responses and the requests, by endpoint name.
+        self.responses = {}
+        self.requests = {}
+
+    def Payload(self, schema: JSON) -> Tuple[str, List[Tuple[str, str, Any]]]:
+        """Return the shape and top-level types of the payload of an endpoint.
+
+        The types are (type name, class name, field names) triples, with the
+        field names for the choice of the type of the objects, if several.
+        """
+        name = schema['name']
+        top, _ = generate_validators.GetMessages(schema)
+        # The most common type first, e.g. the equities among the quotes.
+        type_names = sorted(generate_payloads.PayloadTypes(schema),
+                            key=lambda type_name: type_name != mock_server.PAYLOAD_TYPES.get(name))
+        types = []
+        for type_name in type_names:
+            class_name = generate_messages.ClassName(
+                generate_proto_schemas.MSG_NAME_MAP.get((type_name, name), type_name))
+            fields = sorted(top[type_name]) if len(type_names) > 1 else None
+            types.append((type_name, class_name, fields))
+        if name in mock_server.ARRAY_RESPONSES:
+            shape = 'array'
+        elif name in mock_server.SYMBOL_RESPONSES:
+            shape = 'symbols'
+        else:
+            shape = 'object'
+        return shape, types
+
+    def AddEndpoint(self, schema: JSON):
+        """Generate the method of an endpoint."""
+        name = schema['name']
+        method = schema['method']
+        target = schema['url'][len(BASE_URL):]
+        url_params = schema.get('url_params') or {}
+        query_params = schema['query_params']
+        has_body = 'request' in schema and method in ('POST', 'PUT', 'PATCH')
+        if generate_validators.GetMessages(schema)[0]:
+            payloads = self.responses if 'response' in schema else self.requests
+            payloads[name] = self.Payload(schema)
+
+        args = ['self'] + list(url_params)
+        if has_body:
+            args.append('body')
+        if query_params:
+            args.append('*')
+            args.extend('{}=None'.format(param_name) for param_name in sorted(query_params))
+        lines = ["    async def {}({}):".format(name, ', '.join(args))]
+        if query_params:
+            lines.extend(['        """{} {}'.format(method, target),
+                          '',
+                          '        Query parameters: {}.'.format(', '.join(sorted(query_params))),
+                          '        """'])
+        else:
+            lines.append('        """{} {}"""'.format(method, target))
+
+        # Validate and encode the URL parameters.
+        path_format = target
+        for index, (param_name, dtype) in enumerate(url_params.items()):
+            self.encoders.EmitScalar(lines, 2, param_name, dtype, param_name,
+                                     lambda expr: "p{} = {}".format(index, expr))
+            path_format = path_format.replace('{%s}' % param_name, '{%d}' % index)
+        if url_params:
+            lines.append("        target = {!r}.format({})".format(
+                path_format, ', '.join('p{}'.format(index) for index in range(len(url_params)))))
+        else:
+            lines.append("        target = {!r}".format(path_format))
+
+        if query_params:
+            encoder = self.encoders.EncoderFunction(query_params)
+            values = []
+            for param_name in sorted(query_params):
+                if param_name == 'apikey':
+                    values.append("'apikey': self.apikey if apikey is None else apikey")
+                else:
+                    values.append("{!r}: {}".format(param_name, param_name))
+            lines.append("        query = {}({{{}}})".format(encoder, ', '.join(values)))
+            lines.extend(["        if query:",
+                          "            target += '?' + query"])
+        lines.append("        return await self.Call({!r}, {!r}, target{})".format(
+            name, method, ', body' if has_body else ''))
+        self.methods.append('\n'.join(lines))
+
+    def Source(self) -> str:
+        """Return the source code of the generated module."""
+        oss = io.StringIO()
+        pr = lambda *args: print(*args, file=oss)
+        oss.write(_PRELUDE + generate_query_encoders._HELPERS)
+        pr(_RUNTIME % {'base_url': BASE_URL, 'idempotent': sorted(IDEMPOTENT_METHODS)})
+        pr()
+        pr("_FORM_BODIES = frozenset({!r})".format(sorted(FORM_BODIES)))
+        for table_name, payloads in [('_RESPONSES', self.responses),
+                                     ('_REQUESTS', self.requests)]:
+            pr()
+            pr("# The (shape, types) of the payloads, by endpoint name.")
+            pr("{} = {{".format(table_name))
+            for name, (shape, types) in sorted(payloads.items()):
+                pr("    {!r}: ({!r}, (".format(name, shape))
+                for type_name, class_name, fields in types:
+                    pr("        ({!r}, {!r}, {}),".format(
+                        type_name, class_name,
+                        'None' if fields is None else 'frozenset({!r})'.format(fields)))
+                pr("    )),")
+            pr("}")
+        pr()
+        pr(self.encoders.Definitions())
+        pr()
+        pr("class Client(_ClientBase):")
+        pr('    """The client of the API, with a coroutine method per endpoint."""')
+        for method in self.methods:
+            pr()
+            pr(method)
+        return oss.getvalue()
+
+
+def GenerateClient(schemas: Dict[str, JSON]) -> str:
+    """Generate the source of a module of the client of the given schemas."""
+    generator = ClientGenerator()
+    for _, schema in sorted(schemas.items()):
+        generator.AddEndpoint(schema)
+    return generator.Source()
+
+
+def CompileClient(schemas: Dict[str, JSON]) -> Dict[str, Any]:
+    """Generate and compile the client, without writing it out.
+
+    Returns the namespace of the module.
+    """
+    namespace = {'__name__': 'ameritrade_client'}
+    exec(compile(GenerateClient(schemas), '<generated client>', 'exec'), namespace)
+    return namespace
+
+
+#-------------------------------------------------------------------------------
+# Benchmark, polling accounts from a mock server.
+
+
+# The number of symbols of the quotes polled per account.
+BENCHMARK_SYMBOLS = 10
+
+
+def PollSerial(port: int, account_ids: List[int]) -> int:
+    """Poll the accounts with blocking requests, one at a time, on one connection.
+
+    This is the baseline of the benchmark. Return the number of requests.
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    count = 0
+    for account_id in account_ids:
+        symbols = ','.join('S{}'.format(account_id * BENCHMARK_SYMBOLS + index)
+                           for index in range(BENCHMARK_SYMBOLS))
+        for target in ['/v1/accounts/{}?fields=positions'.format(account_id),
+                       '/v1/orders?accountId={}&status=WORKING'.format(account_id),
+                       '/v1/marketdata/quotes?symbol={}'.format(symbols)]:
+            connection.request('GET', target)
+            response = connection.getresponse()
+            json.loads(response.read())
+            count += 1
+    connection.close()
+    return count
+
+
+async def PollAccount(client: Any, account_id: int) -> Tuple[Any, Any, Any]:
+    """Poll an account, its working orders and the quotes of its positions."""
+    symbols = ','.join('S{}'.format(account_id * BENCHMARK_SYMBOLS + index)
+                       for index in range(BENCHMARK_SYMBOLS))
+    return await asyncio.gather(
+        client.GetAccount(account_id, fields=['positions']),
+        client.GetOrdersByQuery(accountId=account_id, status='WORKING'),
+        client.GetQuotes(symbol=symbols))
+
+
+async def PollAsync(client_class: type, port: int, account_ids: List[int],
+                    concurrent: bool, **kwargs) -> int:
+    """Poll the accounts with a client, one at a time or all at once."""
+    async with client_class('http://127.0.0.1:{}'.format(port), **kwargs) as client:
+        if concurrent:
+            results = await asyncio.gather(*[PollAccount(client, account_id)
+                                             for account_id in account_ids])
+        else:
+            results = [await PollAccount(client, account_id) for account_id in account_ids]
+    return sum(len(result) for result in results)
+
+
+def Benchmark(schemas_dir: str, raw_dir: str, port: int, num_accounts: int, delay: float,
+              cycles: int):
+    """Compare polling accounts serially and concurrently, from a mock server.
+
+    The mock server runs in another process, replying after `delay` seconds.
+    """
+    logging.getLogger().setLevel(logging.ERROR)
+    schemas = generate_validators.ReadSchemas(schemas_dir)
+    client_class = CompileClient(schemas)['Client']
+    validators = generate_validators.CompileValidators(schemas)
+    classes = generate_messages.CompileMessages(schemas_dir)
+    account_ids = [100000 + index for index in range(num_accounts)]
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=mock_server._RunServer, args=(schemas_dir, raw_dir, port, 0, ready, delay))
+    server.start()
+    ready.wait()
+    print("{} accounts, 3 requests each, {:.1f} ms of latency".format(num_accounts, delay * 1e3))
+    print("{:36} {:>10} {:>10}".format("client", "cycle ms", "req/s"))
+    try:
+        runs = [
+            ('http.client, serial', lambda: PollSerial(port, account_ids)),
+        ]
+        for label, concurrent, kwargs in [
+                ('async, serial', False, dict(max_connections=1, pipeline=1)),
+                ('async, 8 connections', True, dict(max_connections=8, pipeline=1)),
+                ('async, 8 connections x 8 pipelined', True, dict(max_connections=8, pipeline=8)),
+                ('  + validated', True, dict(max_connections=8, pipeline=8,
+                                            validators=validators)),
+                ('  + validated and decoded', True, dict(max_connections=8, pipeline=8,
+                                                        validators=validators, classes=classes))]:
+            runs.append((label, lambda concurrent=concurrent, kwargs=kwargs: asyncio.run(
+                PollAsync(client_class, port, account_ids, concurrent, **kwargs))))
+        for label, run in runs:
+            elapsed = []
+            for _ in range(cycles):
+                start = time.perf_counter()
+                count = run()
+                elapsed.append(time.perf_counter() - start)
+            best = min(elapsed)
+            print("{:36} {:10.1f} {:10.0f}".format(label, best * 1e3, count / best))
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--output', action='store',
+                        help="Python module to write the client to (default: stdout).")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark polling accounts from a mock server instead.")
+    parser.add_argument('--benchmark_accounts', action='store', type=int, default=200,
+                        help="Number of accounts polled by the benchmark.")
+    parser.add_argument('--benchmark_delay', action='store', type=float, default=0.005,
+                        help="Latency of the responses of the mock server, in seconds.")
+    parser.add_argument('--benchmark_cycles', action='store', type=int, default=3,
+                        help="Number of polling cycles of each client; the best is reported.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples from, for the benchmark.")
+    parser.add_argument('--port', action='store', type=int, default=8080,
+                        help="Port of the mock server of the benchmark.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.raw_downloaded_data, args.port,
+                  args.benchmark_accounts, args.benchmark_delay, args.benchmark_cycles)
+        return
+
+    source = GenerateClient(generate_validators.ReadSchemas(args.clean_schemas))
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(source)
+    else:
+        print(source, end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""Generate compact Python message classes from the Ameritrade JSON schemas.
+
+This produces a module with one class per deduplicated type found by
+ValidateSchemas (including the types renamed by MSG_NAME_MAP) and per nested
+anonymous object type, e.g. positions and order legs. The classes use
+__slots__ to avoid the overhead of a per-instance dict, and each has a
+specialized decoder (FromDict) and encoder (ToDict) for the decoded JSON.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, Optional, Tuple
+import argparse
+import gc
+import io
+import json
+import keyword
+import logging
+import re
+import time
+import tracemalloc
+
+import convert_ameritrade_schemas
+import generate_proto_schemas
+import generate_validators
+import type_graph
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples used in the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+
+_PRELUDE = '''\
+# -*- mode: python -*-
+# THIS FILE IS AUTO-GENERATED by generate_messages.py.
+"""Message classes for the Ameritrade API.
+
+Each class has a FromDict() class method decoding a JSON object and a ToDict()
+method encoding it back. Absent fields are set to None and omitted on encoding;
+fields unknown to the schemas are dropped.
+"""
+
+
+class _Message:
+    __slots__ = ()
+
+    # A mapping of attribute name to JSON field name.
+    _FIELDS = {}
+
+    def __init__(self, **kwargs):
+        for attr in self.__slots__:
+            setattr(self, attr, kwargs.pop(attr, None))
+        if kwargs:
+            raise TypeError('Unknown fields for {}: {}'.format(
+                type(self).__name__, ', '.join(sorted(kwargs))))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, attr) == getattr(other, attr) for attr in self.__slots__)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(attr, getattr(self, attr))
+            for attr in self.__slots__
+            if getattr(self, attr) is not None))
+
+
+_new = object.__new__
+'''
+
+
+def AttributeName(field_name: str) -> str:
+    """Convert a JSON field name to a valid attribute name, e.g. '52WkHigh'."""
+    name = re.sub(r"\W", "_", field_name)
+    if name[0].isdigit() or keyword.iskeyword(name):
+        name = "_" + name
+    return name
+
+
+def ClassName(hint: str) -> str:
+    """Convert a field or type name to a class name."""
+    name = re.sub(r"\W", "", hint)
+    return name[0].upper() + name[1:]
+
+
+def Singular(name: str) -> str:
+    """Return the singular of a (plural) array field name."""
+    if name.endswith('ies'):
+        return name[:-3] + 'y'
+    elif name.endswith('s') and not name.endswith('ss'):
+        return name[:-1]
+    return name
+
+
+class MessageGenerator:
+    """Generate the source of a module of message classes.
+
+    Classes are deduplicated by the structural digests of their fields, from
+    the type graph of ValidateSchemas. The named types are registered first so
+    that nested anonymous objects identical to a named type reuse its class.
+    """
+
+    def __init__(self, oneofs: Dict[str, JSON],
+                 graph: Optional['type_graph.TypeGraph'] = None):
+        self.oneofs = oneofs
+        self.graph = graph or type_graph.TypeGraph()
+        # A mapping of the signature of a type's fields to its class name.
+        self.classes = {}
+        # A mapping of class name to a (fields, dispatch) pair, where dispatch
+        # is an optional (discriminator field name, {value: class name}) pair.
+        self.definitions = {}
+        # Names of the classes sharing the definition of another.
+        self.aliases = {}
+
+    def Signature(self, fields: Dict[str, JSON]) -> str:
+        return self.graph.FieldsDigest(fields)
+
+    def AddNamedType(self, name: str, fields: Dict[str, JSON]):
+        """Register a named type."""
+        name = ClassName(name)
+        if name in self.definitions:
+            raise ValueError("Conflicting definitions for type {}".format(name))
+        signature = self.Signature(fields)
+        existing = self.classes.get(signature)
+        if existing is not None:
+            self.aliases[name] = existing
+            return
+        self.classes[signature] = name
+        self.definitions[name] = None
+
+    def Define(self, name: str, fields: Dict[str, JSON], dispatch=None):
+        """Process the fields of a class, registering their nested types."""
+        self.definitions[name] = (fields, dispatch)
+        for field_name, ftype in sorted(fields.items()):
+            self.FieldType(field_name, ftype)
+
+    def ObjectClass(self, hint: str, fields: Dict[str, JSON], dispatch=None) -> str:
+        """Return the name of the class for an object's fields, creating it."""
+        signature = self.Signature(fields)
+        if dispatch:
+            signature += json.dumps(dispatch, sort_keys=True)
+        name = self.classes.get(signature)
+        if name is not None:
+            if self.definitions[name] is None:
+                self.Define(name, fields, dispatch)
+            return name
+
+        # Assign a unique name to the anonymous type.
+        base = name = ClassName(hint)
+        index = 1
+        while name in self.definitions or name in self.aliases:
+            index += 1
+            name = "{}{}".format(base, index)
+        self.classes[signature] = name
+        self.Define(name, fields, dispatch)
+        return name
+
+    def FieldType(self, field_name: str, ftype: JSON, hint: str = None) -> Optional[Tuple]:
+        """Return a description of how to convert a field, registering classes.
+
+        The description is None for values copied as-is, ('class', name) for an
+        object, and ('list', item) or ('map', item) for containers of objects.
+        """
+        hint = hint or field_name
+        kind = ftype.get('type')
+        if kind == 'object':
+            if ftype.get('properties'):
+                dispatch = None
+                if 'discriminator' in ftype:
+                    subclasses = {
+                        value: self.ObjectClass(value, fields)
+                        for value, fields in generate_validators.DiscriminatorSubtypes(
+                            ftype, self.oneofs).items()}
+                    if subclasses:
+                        dispatch = (ftype['discriminator'], subclasses)
+                return ('class', self.ObjectClass(hint, ftype['properties'], dispatch))
+            elif ftype.get('additionalProperties'):
+                item = self.FieldType(field_name, ftype['additionalProperties'], hint)
+                return None if item is None else ('map', item)
+        elif kind == 'array' and ftype.get('items'):
+            xml_name = ftype.get('xml', {}).get('name', '__UNKNOWN')
+            item_hint = Singular(field_name) if xml_name == '__UNKNOWN' else xml_name
+            item = self.FieldType(field_name, ftype['items'], item_hint)
+            return None if item is None else ('list', item)
+        return None
+
+    def DecodeExpr(self, conv: Tuple, var: str, depth: int = 0) -> str:
+        """Return an expression decoding the non-null value in `var`."""
+        if conv[0] == 'class':
+            name = conv[1]
+            if self.definitions[name][1]:
+                return "_Decode{}({})".format(name, var)
+            return "{}.FromDict({})".format(name, var)
+        item = 'x{}'.format(depth)
+        expr = self.DecodeExpr(conv[1], item, depth + 1)
+        if conv[0] == 'list':
+            return "[{} for {} in {}]".format(expr, item, var)
+        return "{{k{}: {} for k{}, {} in {}.items()}}".format(
+            depth, expr, depth, item, var)
+
+    def EncodeExpr(self, conv: Tuple, var: str, depth: int = 0) -> str:
+        """Return an expression encoding the non-null value in `var`."""
+        if conv[0] == 'class':
+            return "{}.ToDict()".format(var)
+        item = 'x{}'.format(depth)
+        expr = self.EncodeExpr(conv[1], item, depth + 1)
+        if conv[0] == 'list':
+            return "[{} for {} in {}]".format(expr, item, var)
+        return "{{k{}: {} for k{}, {} in {}.items()}}".format(
+            depth, expr, depth, item, var)
+
+    def ClassSource(self, name: str) -> str:
+        """Return the source of a class definition."""
+        fields, dispatch = self.definitions[name]
+        fields = sorted(fields.items())
+        attrs = [AttributeName(field_name) for field_name, _ in fields]
+        lines = ["class {}(_Message):".format(name),
+                 "    __slots__ = ({})".format(
+                     ''.join("{!r}, ".format(attr) for attr in attrs).rstrip()),
+                 "    _FIELDS = {{{}}}".format(', '.join(
+                     "{!r}: {!r}".format(attr, field_name)
+                     for attr, (field_name, _) in zip(attrs, fields))),
+                 "",
+                 "    @classmethod",
+                 "    def FromDict(cls, value):",
+                 "        self = _new(cls)",
+                 "        get = value.get"]
+        for attr, (field_name, ftype) in zip(attrs, fields):
+            conv = self.FieldType(field_name, ftype)
+            if conv is None:
+                lines.append("        self.{} = get({!r})".format(attr, field_name))
+            else:
+                lines.extend([
+                    "        v = get({!r})".format(field_name),
+                    "        self.{} = None if v is None else {}".format(
+                        attr, self.DecodeExpr(conv, 'v'))])
+        lines.extend(["        return self",
+                      "",
+                      "    def ToDict(self):",
+                      "        value = {}"])
+        for attr, (field_name, ftype) in zip(attrs, fields):
+            conv = self.FieldType(field_name, ftype)
+            lines.extend([
+                "        v = self.{}".format(attr),
+                "        if v is not None:",
+                "            value[{!r}] = {}".format(
+                    field_name, 'v' if conv is None else self.EncodeExpr(conv, 'v'))])
+        lines.append("        return value")
+
+        if dispatch:
+            disc_field_name, _ = dispatch
+            lines.extend([
+                "",
+                "",
+                "def _Decode{}(value):".format(name),
+                "    decode = _{}_DISPATCH.get(value.get({!r}))".format(
+                    name, disc_field_name),
+                "    return {}.FromDict(value) if decode is None else decode(value)".format(name)])
+        return '\n'.join(lines)
+
+    def Source(self) -> str:
+        """Return the source code of the generated module."""
+        oss = io.StringIO()
+        pr = lambda *args: print(*args, file=oss)
+        pr(_PRELUDE)
+        for name in sorted(self.definitions):
+            pr()
+            pr(self.ClassSource(name))
+            pr()
+        pr()
+        # The dispatch tables refer to the classes, so they come last.
+        for name, (_, dispatch) in sorted(self.definitions.items()):
+            if dispatch:
+                pr("_{}_DISPATCH = {{{}}}".format(name, ', '.join(
+                    "{!r}: {}.FromDict".format(value, subclass)
+                    for value, subclass in sorted(dispatch[1].items()))))
+        pr()
+        for alias, name in sorted(self.aliases.items()):
+            pr("{} = {}".format(alias, name))
+        return oss.getvalue()
+
+
+def BuildGenerator(valid_types: 'generate_proto_schemas.ValidatedTypes') -> MessageGenerator:
+    """Register all the validated types of the schemas."""
+    generator = MessageGenerator(valid_types.oneofs, valid_types.graph)
+    for name, fields in sorted(valid_types.types.items()):
+        generator.AddNamedType(name, fields)
+    for name, fields in sorted(valid_types.types.items()):
+        name = generator.aliases.get(ClassName(name), ClassName(name))
+        generator.ObjectClass(name, fields)
+    return generator
+
+
+def GenerateMessages(dirname: str) -> str:
+    """Generate the source of a module of message classes for the schemas."""
+    valid_types = generate_proto_schemas.ValidateSchemas(dirname)
+    return BuildGenerator(valid_types).Source()
+
+
+def CompileMessages(dirname: str) -> Dict[str, type]:
+    """Generate and compile the message classes, without writing them out.
+
+    Returns a mapping of class name to class.
+    """
+    namespace = {}
+    exec(compile(GenerateMessages(dirname), '<generated messages>', 'exec'), namespace)
+    return {name: value
+            for name, value in namespace.items()
+            if isinstance(value, type) and not name.startswith('_')}
+
+
+# The examples and classes used in the benchmark, as (endpoint, type name,
+# class name, path to a list of objects, or None for the top-level object).
+BENCHMARK_CASES = [
+    ('GetAccount', 'Account', 'Position', ['securitiesAccount', 'positions']),
+    ('GetOrder', 'OrderGet', 'OrderGet', None),
+    ('GetQuotes', 'Equity', 'EquityQuote', None),
+    ('GetOptionChain', 'Option', 'OptionChainQuote', None),
+]
+
+
+def Benchmark(dirname: str, raw_dir: str, count: int):
+    """Compare the memory and decoding speed of the classes to plain dicts."""
+    logging.getLogger().setLevel(logging.ERROR)
+    classes = CompileMessages(dirname)
+    print("{:18} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "Class", "dict B", "class B", "loads us", "+decode us", "encode us"))
+    for endpoint, type_name, class_name, subpath in BENCHMARK_CASES:
+        examples = convert_ameritrade_schemas.ReadExample(
+            path.join(raw_dir, endpoint, 'example.json'))
+        value = examples[type_name]
+        for key in subpath or []:
+            value = value[key]
+        value = value[0] if subpath else value
+        encoded = json.dumps(value)
+        cls = classes[class_name]
+        assert cls.FromDict(json.loads(encoded)).ToDict() == value, class_name
+
+        # Measure the memory held by `count` instances of each.
+        sizes = []
+        for decode in (json.loads, lambda string: cls.FromDict(json.loads(string))):
+            gc.collect()
+            tracemalloc.start()
+            objects = [decode(encoded) for _ in range(count)]
+            size, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            sizes.append(size / count)
+            del objects
+
+        # Measure the decoding time.
+        times = []
+        objects = [json.loads(encoded) for _ in range(count)]
+        for func in (lambda: [json.loads(encoded) for _ in range(count)],
+                     lambda: [cls.FromDict(obj) for obj in objects]):
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) / count)
+        decoded = [cls.FromDict(obj) for obj in objects]
+        start = time.perf_counter()
+        for obj in decoded:
+            obj.ToDict()
+        times.append((time.perf_counter() - start) / count)
+
+        print("{:18} {:10.0f} {:10.0f} {:10.2f} {:10.2f} {:10.2f}".format(
+            class_name, sizes[0], sizes[1], *[t * 1e6 for t in times]))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--output', action='store',
+                        help="Python module to write the classes to (default: stdout).")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark memory and speed against plain dicts instead.")
+    parser.add_argument('--benchmark_count', action='store', type=int, default=20000,
+                        help="Number of objects to create for the benchmark.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples from, for the benchmark.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.raw_downloaded_data, args.benchmark_count)
+        return
+
+    source = GenerateMessages(args.clean_schemas)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(source)
+    else:
+        print(source, end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""Generate synthetic payloads of the endpoints, in bulk.
+
+The type of a payload is compiled once into a tree of factories, each drawing a
+whole batch of values of its subtree at a time, column by column, from the NumPy
+generator: the integers, doubles, booleans, enum values and date-times of a
+field over the batch are drawn with a single call, and the objects are then
+assembled by rows. The values respect the schemas: enum values, integer formats
+and minimums, date-time formats, the subtype fields selected by the
+discriminators (e.g. assetType, activityType and type), arrays and maps. The
+option chains have their maps of expiration dates to strike prices to options.
+
+The payloads are written as JSON lines, encoded by the factories without
+decoding, optionally at a limited rate, e.g.:
+
+    ./scripts/generate_payloads.py GetQuotes --count 1000000 --output quotes.jsonl
+    ./scripts/generate_payloads.py GetTransactions --rate 5000 | ...
+
+The payloads of GetQuote and GetQuotes are quotes of all their asset types; the
+others are of the type served by the mock server, or that of --type.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import contextlib
+import functools
+import gc
+import json
+import logging
+import re
+import sys
+import time
+
+import numpy as np
+
+import generate_validators
+import mock_server
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# The endpoints whose payloads are of any of their top-level types, e.g. the
+# quotes of all the asset types.
+MIXED_PAYLOADS = {'GetQuote', 'GetQuotes'}
+
+# The endpoints of the benchmark.
+BENCHMARK_ENDPOINTS = ['GetQuotes', 'GetOptionChain', 'GetTransactions']
+
+# The approximate maximum size of the batches, in bytes of JSON, e.g. for the
+# option chains of tens of kilobytes each.
+BATCH_BYTES = 2**24
+
+# The maximum length of the arrays and maps. It is halved at each level of
+# nesting, which bounds the size of the recursive types, e.g. the child orders
+# of orders.
+MAX_LENGTH = 4
+
+# The range of the date-times, in seconds since the epoch.
+DATE_RANGE = (np.datetime64('2019-01-01', 's').astype(np.int64),
+              np.datetime64('2022-01-01', 's').astype(np.int64))
+
+# The ranges of the integers drawn, by format, within INTEGER_RANGES.
+DRAW_RANGES = {
+    'int32': (0, 10**6),
+    'int64': (0, 10**12),
+    None: (0, 10**6),
+}
+
+# The log-normal parameters of the doubles, rounded to cents, and their
+# maximum, in cents.
+DOUBLE_MEAN, DOUBLE_SIGMA = 3.0, 1.0
+MAX_CENTS = 10**5
+
+# The number of distinct values of each pool of strings.
+POOL_SIZE = 4096
+
+# The keys of the maps, by field name, in order. The first ones of a map of a
+# given length are used.
+MAP_KEYS = {
+    'fees': ['rFee', 'additionalFee', 'cdscFee', 'regFee', 'otherCharges',
+             'commission', 'optRegFee', 'secFee'],
+    'callExpDateMap': ['2021-01-15:3', '2021-01-22:10', '2021-02-19:38', '2021-03-19:66'],
+    'putExpDateMap': ['2021-01-15:3', '2021-01-22:10', '2021-02-19:38', '2021-03-19:66'],
+    'strikePriceMap': ['{:.1f}'.format(strike) for strike in range(100, 140, 5)],
+}
+
+# The maps of the option chains, typed 'object' in the schemas, and their
+# nested maps of strike prices to the options.
+OPTION_MAPS = {'callExpDateMap', 'putExpDateMap'}
+
+
+def _Objects(values: Sequence) -> np.ndarray:
+    """Return an array of Python objects, for indexing in bulk."""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class Factory:
+    """A generator of batches of values of a type."""
+
+    # The conversion of the values returned by Values() to JSON, in the
+    # templates of the objects.
+    spec = '%s'
+
+    def Draw(self, rng: np.random.Generator, count: int) -> List[JSON]:
+        """Draw a batch of values."""
+        raise NotImplementedError
+
+    def Encode(self, rng: np.random.Generator, count: int) -> List[str]:
+        """Draw a batch of values, as JSON text."""
+        return [json.dumps(value) for value in self.Draw(rng, count)]
+
+    def Values(self, rng: np.random.Generator, count: int) -> List[JSON]:
+        """Draw a batch of values, to be converted to JSON text by the spec."""
+        return self.Encode(rng, count)
+
+
+class IntegerFactory(Factory):
+    """Integers of a format, uniformly in a range."""
+
+    spec = '%d'
+
+    def __init__(self, low: int, high: int):
+        self.low, self.high = low, high
+
+    def Draw(self, rng, count):
+        return rng.integers(self.low, self.high, count).tolist()
+
+    def Encode(self, rng, count):
+        return list(map(str, self.Draw(rng, count)))
+
+    def Values(self, rng, count):
+        return self.Draw(rng, count)
+
+
+class DoubleFactory(Factory):
+    """Positive doubles, log-normally distributed and rounded to cents.
+
+    The doubles are looked up in bulk in a table of all the amounts of cents
+    up to MAX_CENTS, and of their JSON text, which is several times faster than
+    converting them.
+    """
+
+    def Cents(self, rng, count):
+        cents = np.rint(rng.lognormal(DOUBLE_MEAN, DOUBLE_SIGMA, count) * 100)
+        return np.minimum(cents, MAX_CENTS).astype(np.int64)
+
+    def Draw(self, rng, count):
+        return CentTables()[0][self.Cents(rng, count)].tolist()
+
+    def Encode(self, rng, count):
+        return CentTables()[1][self.Cents(rng, count)].tolist()
+
+
+@functools.lru_cache()
+def CentTables() -> Tuple[np.ndarray, np.ndarray]:
+    """Return the arrays of the doubles of all the amounts of cents, and their JSON."""
+    values = (np.arange(MAX_CENTS + 1) / 100).tolist()
+    return _Objects(values), _Objects(list(map(repr, values)))
+
+
+class ChoiceFactory(Factory):
+    """Values drawn uniformly from a list, e.g. an enum or a pool of strings."""
+
+    def __init__(self, values: List[JSON]):
+        self.values = _Objects(values)
+        self.encoded = _Objects([json.dumps(value) for value in values])
+
+    def Draw(self, rng, count):
+        if len(self.values) == 1:
+            return [self.values[0]] * count
+        return self.values[rng.integers(0, len(self.values), count)].tolist()
+
+    def Encode(self, rng, count):
+        if len(self.values) == 1:
+            return [self.encoded[0]] * count
+        return self.encoded[rng.integers(0, len(self.values), count)].tolist()
+
+
+class DateTimeFactory(Factory):
+    """Date-times in the format of the API, e.g. '2020-06-01T13:30:00+0000'."""
+
+    def Draw(self, rng, count):
+        seconds = rng.integers(DATE_RANGE[0], DATE_RANGE[1], count).astype('datetime64[s]')
+        return [string + '+0000' for string in np.datetime_as_string(seconds).tolist()]
+
+    def Encode(self, rng, count):
+        seconds = rng.integers(DATE_RANGE[0], DATE_RANGE[1], count).astype('datetime64[s]')
+        return ['"' + string + '+0000"' for string in np.datetime_as_string(seconds).tolist()]
+
+
+class ArrayFactory(Factory):
+    """Arrays of items, of uniformly distributed lengths.
+
+    The items of all the arrays of a batch are drawn together, and split.
+    """
+
+    def __init__(self, item: Factory, min_length: int, max_length: int):
+        self.item = item
+        self.min_length, self.max_length = min_length, max_length
+
+    def Offsets(self, rng, count):
+        lengths = rng.integers(self.min_length, self.max_length + 1, count)
+        ends = np.cumsum(lengths)
+        return int(ends[-1]) if count else 0, (ends - lengths).tolist(), ends.tolist()
+
+    def Draw(self, rng, count):
+        total, starts, ends = self.Offsets(rng, count)
+        items = self.item.Draw(rng, total)
+        return [items[start:end] for start, end in zip(starts, ends)]
+
+    def Encode(self, rng, count):
+        total, starts, ends = self.Offsets(rng, count)
+        items = self.item.Encode(rng, total)
+        return ['[' + ','.join(items[start:end]) + ']' for start, end in zip(starts, ends)]
+
+
+class MapFactory(ArrayFactory):
+    """Objects mapping the first keys of a list to items."""
+
+    def __init__(self, item: Factory, keys: List[str], min_length: int, max_length: int):
+        super().__init__(item, min_length, min(max_length, len(keys)))
+        self.keys = keys
+        self.prefixes = ['{}:'.format(json.dumps(key)) for key in keys]
+
+    def Draw(self, rng, count):
+        total, starts, ends = self.Offsets(rng, count)
+        items = self.item.Draw(rng, total)
+        keys = self.keys
+        return [dict(zip(keys, items[start:end])) for start, end in zip(starts, ends)]
+
+    def Encode(self, rng, count):
+        total, starts, ends = self.Offsets(rng, count)
+        items = self.item.Encode(rng, total)
+        prefixes = self.prefixes
+        return ['{' + ','.join(map(str.__add__, prefixes, items[start:end])) + '}'
+                for start, end in zip(starts, ends)]
+
+
+class ObjectFactory(Factory):
+    """Objects with all their fields, drawn by column and assembled by row.
+
+    The objects are encoded by formatting the columns into a template, where
+    the numbers are converted directly.
+    """
+
+    def __init__(self, fields: Dict[str, Factory]):
+        self.names = sorted(fields)
+        self.fields = [fields[name] for name in self.names]
+        self.template = '{' + ','.join('{}:{}'.format(json.dumps(name).replace('%', '%%'),
+                                                      field.spec)
+                                       for name, field in zip(self.names, self.fields)) + '}'
+
+    def Draw(self, rng, count):
+        if not self.names:
+            return [{} for _ in range(count)]
+        names = self.names
+        columns = [field.Draw(rng, count) for field in self.fields]
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+    def Encode(self, rng, count):
+        if not self.names:
+            return ['{}'] * count
+        template = self.template
+        columns = [field.Values(rng, count) for field in self.fields]
+        return [template % row for row in zip(*columns)]
+
+
+class DispatchFactory(Factory):
+    """Values of alternative factories, e.g. the subtypes of a discriminator.
+
+    The alternative of each value is drawn first, then the values of each
+    alternative are drawn together, and scattered back in place.
+    """
+
+    def __init__(self, alternatives: List[Factory]):
+        self.alternatives = alternatives
+
+    def Scatter(self, rng, count, encode: bool):
+        choices = rng.integers(0, len(self.alternatives), count)
+        values = [None] * count
+        for index, alternative in enumerate(self.alternatives):
+            positions = np.flatnonzero(choices == index).tolist()
+            if not positions:
+                continue
+            draw = alternative.Encode if encode else alternative.Draw
+            for position, value in zip(positions, draw(rng, len(positions))):
+                values[position] = value
+        return values
+
+    def Draw(self, rng, count):
+        return self.Scatter(rng, count, False)
+
+    def Encode(self, rng, count):
+        return self.Scatter(rng, count, True)
+
+
+def StringPool(kind: str) -> List[str]:
+    """Return a pool of strings of a kind: 'symbol', 'id' or 'text'."""
+    rng = np.random.default_rng(len(kind))
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    if kind == 'symbol':
+        lengths = rng.integers(1, 5, POOL_SIZE)
+        return sorted({''.join(rng.choice(letters, length)) for length in lengths})
+    elif kind == 'id':
+        return [str(value) for value in rng.integers(10**8, 10**9, POOL_SIZE)]
+    words = [''.join(rng.choice(letters, length)).lower()
+             for length in rng.integers(2, 9, 256)]
+    return [' '.join(rng.choice(words, length)) for length in rng.integers(1, 4, POOL_SIZE)]
+
+
+class Compiler:
+    """Compile the types of a schema into factories."""
+
+    def __init__(self, schema: JSON):
+        self.top, self.subtypes = generate_validators.GetMessages(schema)
+        self.pools: Dict[str, ChoiceFactory] = {}
+
+    def Pool(self, kind: str) -> ChoiceFactory:
+        factory = self.pools.get(kind)
+        if factory is None:
+            factory = self.pools[kind] = ChoiceFactory(StringPool(kind))
+        return factory
+
+    def Compile(self, dtype: JSON, name: str, nesting: int = 0) -> Factory:
+        """Compile a type. `name` is that of its field, for the pools of strings.
+
+        `nesting` is the number of arrays and maps containing it.
+        """
+        kind = dtype.get('type')
+        max_length = MAX_LENGTH >> nesting
+        if kind == 'object':
+            if 'discriminator' in dtype:
+                return self.CompileDispatch(dtype, nesting)
+            if dtype.get('properties'):
+                return self.CompileFields(dtype['properties'], nesting)
+            if name in OPTION_MAPS and 'Option' in self.top:
+                options = ArrayFactory(self.CompileFields(self.top['Option'], nesting + 2), 1, 1)
+                strikes = MapFactory(options, MAP_KEYS['strikePriceMap'], 1, 2 * MAX_LENGTH)
+                return MapFactory(strikes, MAP_KEYS[name], 1, MAX_LENGTH)
+            if dtype.get('additionalProperties') and max_length:
+                keys = MAP_KEYS.get(name) or ['key{}'.format(index)
+                                              for index in range(max_length)]
+                return MapFactory(self.Compile(dtype['additionalProperties'], name, nesting + 1),
+                                  keys, 0, max_length)
+            return ObjectFactory({})
+        elif kind == 'array':
+            if not dtype.get('items') or not max_length:
+                return ChoiceFactory([[]])
+            return ArrayFactory(self.Compile(dtype['items'], name, nesting + 1), 0, max_length)
+        elif kind == 'string':
+            if dtype.get('enum'):
+                return ChoiceFactory(dtype['enum'])
+            if dtype.get('format') == 'date-time' or name.endswith('Date'):
+                return DateTimeFactory()
+            if re.search('(?i)symbol$', name):
+                return self.Pool('symbol')
+            if re.search('(Id|Number|Key|cusip)$', name):
+                return self.Pool('id')
+            return self.Pool('text')
+        elif kind == 'integer':
+            low, high = DRAW_RANGES[dtype.get('format')]
+            if dtype.get('format') == 'int64' and re.search('(Time|Date)$', name):
+                low, high = DATE_RANGE[0] * 1000, DATE_RANGE[1] * 1000
+            return IntegerFactory(max(low, dtype.get('minimum', low)), high)
+        elif kind == 'number':
+            return DoubleFactory()
+        elif kind == 'boolean':
+            return ChoiceFactory([False, True])
+        raise NotImplementedError(str(dtype))
+
+    def CompileFields(self, fields: Dict[str, JSON], nesting: int) -> ObjectFactory:
+        return ObjectFactory({field_name: self.Compile(ftype, field_name, nesting)
+                              for field_name, ftype in fields.items()})
+
+    def CompileDispatch(self, dtype: JSON, nesting: int) -> DispatchFactory:
+        """Compile an object with a discriminator, into one alternative per value.
+
+        The values without a subtype have the fields of the object itself.
+        """
+        disc_field_name = dtype['discriminator']
+        dispatch = generate_validators.DiscriminatorSubtypes(dtype, self.subtypes)
+        alternatives = []
+        for value in dtype['properties'][disc_field_name]['enum']:
+            factory = self.CompileFields(dispatch.get(value, dtype['properties']), nesting)
+            factory.fields[factory.names.index(disc_field_name)] = ChoiceFactory([value])
+            alternatives.append(factory)
+        return DispatchFactory(alternatives)
+
+
+def PayloadTypes(schema: JSON, type_name: Optional[str] = None) -> List[str]:
+    """Return the top-level types of the payloads of an endpoint."""
+    top, _ = generate_validators.GetMessages(schema)
+    if type_name is not None:
+        if type_name not in top:
+            raise KeyError("Invalid type for {}: {}".format(schema['name'], type_name))
+        return [type_name]
+    if schema['name'] in MIXED_PAYLOADS:
+        return list(top)
+    return [mock_server.PAYLOAD_TYPES.get(schema['name'], next(iter(top)))]
+
+
+def PayloadFactory(schema: JSON, type_name: Optional[str] = None) -> Factory:
+    """Compile the factory of the payloads of an endpoint.
+
+    The payloads are of the given top-level type, or by default, of those
+    returned by PayloadTypes.
+    """
+    compiler = Compiler(schema)
+    factories = [compiler.CompileFields(compiler.top[name], 0)
+                 for name in PayloadTypes(schema, type_name)]
+    return factories[0] if len(factories) == 1 else DispatchFactory(factories)
+
+
+@contextlib.contextmanager
+def Uncollected():
+    """Disable the garbage collector while generating batches.
+
+    The payloads have no reference cycles, but the collections triggered by
+    their many containers take up to half of the time of the large ones.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def BatchSize(factory: Factory, rng: np.random.Generator, max_size: int) -> int:
+    """Return the size of the batches of about BATCH_BYTES, at most `max_size`."""
+    sample = factory.Encode(rng, 10)
+    size = sum(map(len, sample)) / len(sample)
+    return max(1, min(max_size, int(BATCH_BYTES / size)))
+
+
+def WritePayloads(factory: Factory, rng: np.random.Generator, outfile, count: int,
+                  batch_size: int, rate: Optional[float] = None) -> int:
+    """Write payloads as JSON lines, in batches. Return the number of bytes.
+
+    If `rate` is set, the batches are written no faster than that many payloads
+    per second, and of at most a tenth of a second of them.
+    """
+    if rate:
+        batch_size = min(batch_size, max(1, int(rate / 10)))
+    start = time.perf_counter()
+    written = size = 0
+    while written < count:
+        if rate:
+            delay = start + written / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        with Uncollected():
+            lines = factory.Encode(rng, min(batch_size, count - written))
+        lines.append('')
+        text = '\n'.join(lines)
+        outfile.write(text)
+        written += len(lines) - 1
+        size += len(text)
+    outfile.flush()
+    return size
+
+
+def Invalid(schema: JSON, type_names: List[str], value: JSON) -> bool:
+    """Return true if a value isn't valid for any of the given top-level types."""
+    return all(generate_validators.ValidateGeneric(schema, type_name, value)
+               for type_name in type_names)
+
+
+def Check(schemas: Dict[str, JSON], seed: int, count: int) -> int:
+    """Validate payloads of all the top-level types of all the endpoints.
+
+    Both those drawn and those encoded are validated. Return the number of
+    invalid payloads.
+    """
+    num_invalid = 0
+    for name, schema in sorted(schemas.items()):
+        top, _ = generate_validators.GetMessages(schema)
+        for type_name in top:
+            factory = PayloadFactory(schema, type_name)
+            rng = np.random.default_rng(seed)
+            values = factory.Draw(rng, count)
+            values.extend(json.loads(line) for line in factory.Encode(rng, count))
+            for value in values:
+                errors = generate_validators.ValidateGeneric(schema, type_name, value)
+                if errors:
+                    logging.error("Invalid payload of %s.%s: %s", name, type_name, errors[:3])
+                    num_invalid += 1
+                    break
+    return num_invalid
+
+
+def Benchmark(schemas: Dict[str, JSON], seed: int, batch_size: int, duration: float):
+    """Measure the rates of drawing and encoding payloads, in batches."""
+    print("{:16} {:>8} {:>8} {:>12} {:>12} {:>8} {:>8}".format(
+        "endpoint", "bytes", "batch", "draw/s", "encode/s", "MB/s", "invalid"))
+    for name in BENCHMARK_ENDPOINTS:
+        schema = schemas[name]
+        factory = PayloadFactory(schema)
+        type_names = PayloadTypes(schema)
+        rng = np.random.default_rng(seed)
+        size = BatchSize(factory, rng, batch_size)
+
+        rates = {}
+        for method in factory.Draw, factory.Encode:
+            count = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                with Uncollected():
+                    results = method(rng, size)
+                count += size
+            rates[method.__name__] = count / (time.perf_counter() - start)
+        mean_size = sum(map(len, results)) / len(results)
+
+        sample = factory.Draw(rng, 100) + [json.loads(line) for line in results[:100]]
+        num_invalid = sum(Invalid(schema, type_names, value) for value in sample)
+        print("{:16} {:8.0f} {:8} {:12,.0f} {:12,.0f} {:8.1f} {:8}".format(
+            name, mean_size, size, rates['Draw'], rates['Encode'],
+            rates['Encode'] * mean_size / 1e6, num_invalid))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('endpoint', action='store', nargs='?',
+                        help="Name of the endpoint of the payloads.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--type', action='store',
+                        help="Top-level type of the payloads.")
+    parser.add_argument('-n', '--count', action='store', type=int, default=1000,
+                        help="Number of payloads.")
+    parser.add_argument('--batch_size', action='store', type=int, default=10000,
+                        help=("Maximum number of payloads generated at a time, within "
+                              "about {} MB.".format(BATCH_BYTES >> 20)))
+    parser.add_argument('--rate', action='store', type=float,
+                        help="Maximum number of payloads written per second.")
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help="Seed of the random generator.")
+    parser.add_argument('--output', action='store',
+                        help="Filename of the JSON lines. Defaults to stdout.")
+    parser.add_argument('--check', action='store_true',
+                        help="Validate payloads of all the endpoints and types.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Measure the rates of generation of payloads.")
+    parser.add_argument('--benchmark_duration', action='store', type=float, default=2.0,
+                        help="Duration of each measurement of the benchmark, in seconds.")
+    args = parser.parse_args()
+
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    if args.check:
+        num_invalid = Check(schemas, args.seed, min(args.count, 100))
+        if num_invalid:
+            raise SystemExit(1)
+        logging.info("Payloads of all the types valid")
+        return
+    if args.benchmark:
+        Benchmark(schemas, args.seed, args.batch_size, args.benchmark_duration)
+        return
+    if args.endpoint not in schemas:
+        parser.error("Invalid endpoint: {}".format(args.endpoint))
+
+    factory = PayloadFactory(schemas[args.endpoint], args.type)
+    rng = np.random.default_rng(args.seed)
+    batch_size = BatchSize(factory, rng, args.batch_size)
+    start = time.perf_counter()
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            size = WritePayloads(factory, rng, outfile, args.count, batch_size, args.rate)
+    else:
+        size = WritePayloads(factory, rng, sys.stdout, args.count, batch_size, args.rate)
+    elapsed = time.perf_counter() - start
+    logging.info("Wrote %d payloads, %.1f MB, in %.2f s", args.count, size / 1e6, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,12 @@
 #!/usr/bin/env python3
 """Generate protocol buffer messages from the Ameritrade JSON schemas.
 """
-# TODO(blais): DO NOT RUN. THIS ISN'T COMPLETE YET.
 
 from os import path
 from typing import Callable, Any, Iterable, Iterator, Union, Dict, List, Tuple, Optional
 import argparse
 import json
 import logging
-import copy
 import collections
 import hashlib
 import textwrap
@@ -19,8 +17,12 @@ import tempfile
 import subprocess
 import io
 import re
+import shutil
 from pprint import pprint
 
+import generate_messages
+import type_graph
+
 
 # Sanitized and cleaned up schemas.
 _ROOT = path.normpath(path.dirname(path.dirname(__file__)))
@@ -64,7 +66,7 @@ class TypeCallback:
 
 # An accumulator for the validation used to store accumulations of various tidbits.
 ValidAccum = collections.namedtuple("ValidAccumuator", [
-    # A dict of unique hash of a genericized type.
+    # A dict of unique hash of a genericized type, or None if not needed.
     # This is used to figure out all the possible types we need to handle.
     'type_signatures',
 
@@ -88,11 +90,11 @@ def ValidateTypeMap(typemap, name: str, accum: ValidAccum):
 def ValidateType(dtype, parent_name: str, name: str, accum: ValidAccum):
     """Process an object containing a type."""
 
-    # Remove optional attributes.
+    # Remove optional attributes, in a shallow copy. The nested types are
+    # replaced by placeholders below, and validated recursively.
     # Note: We may use 'required' in the future.
-    ctype = copy.deepcopy(dtype)
-    ctype.pop('description', None)
-    ctype.pop('required', None)
+    ctype = {key: value for key, value in dtype.items()
+             if key != 'description' and key != 'required'}
 
     subtype_map = None
     if ctype['type'] == 'boolean':
@@ -111,7 +113,7 @@ def ValidateType(dtype, parent_name: str, name: str, accum: ValidAccum):
             assert ctype['type'] == 'string'
             key = (parent_name, name)
             accum.enums.setdefault(key, []).append(dtype['enum'])
-            ctype['enum'][:] = ['ENUMS...']
+            ctype['enum'] = ['ENUMS...']
 
     elif ctype['type'] == 'object':
         # This is another anomaly in the schema, that field is typed 'object'
@@ -149,7 +151,7 @@ def ValidateType(dtype, parent_name: str, name: str, accum: ValidAccum):
             # 'replacingOrder' subtypes. Resolve those manually here.
             # TODO(blais): Remedy this manually here.
             logging.warning("MISSING SUBTYPE: {}".format(ctype))
-            dtype['items'] = {}
+            ctype['items'] = {}
         else:
             subtype_map = {'ARRAY_ITEMS': ctype['items']}
         ctype['items'] = "ITEM_TYPE..."
@@ -158,17 +160,18 @@ def ValidateType(dtype, parent_name: str, name: str, accum: ValidAccum):
             # That's another abnormality which occcurs only for watchlists.
             # TODO(blais): Remedy this manually here.
             logging.warning("MISSING XML: {}".format(ctype))
-            dtype['xml'] = {'name': '__UNKNOWN'}
+            ctype['xml'] = {'name': '__UNKNOWN'}
         else:
-            ctype['xml']['name'] = "ITEM_TYPENAME"
+            ctype['xml'] = dict(ctype['xml'], name="ITEM_TYPENAME")
 
     else:
         raise NotImplementedError(str(dtype))
 
     # Insert the type signature in the output mapping.
-    hsh = hashlib.md5()
-    hsh.update(json.dumps(ctype, sort_keys=True).encode('utf8'))
-    accum.type_signatures[hsh.digest()] = ctype
+    if accum.type_signatures is not None:
+        hsh = hashlib.md5()
+        hsh.update(json.dumps(ctype, sort_keys=True).encode('utf8'))
+        accum.type_signatures[hsh.digest()] = ctype
 
     if subtype_map:
         ValidateTypeMap(subtype_map, name, accum)
@@ -188,13 +191,35 @@ def CheckAllEqual(value_list, field_name):
 # We have to remap a few: GetOptionChain and GetQuote both return a top-level
 # type named 'Option' but they have slightly different definitions. This is how
 # we assign globally unique types names where collisions occur. See
-# {083508b4c37b}.
+# {083508b4c37b}. The other quote types are renamed for consistency, and so
+# that, e.g., 'Mutual Fund' does not collide with the 'MutualFund' instrument.
 MSG_NAME_MAP = {
     ("Option", "GetOptionChain"): "OptionChainQuote",
     ("Option", "GetQuote"): "OptionQuote",
     ("Option", "GetQuotes"): "OptionQuote",
     ("Equity", "GetQuote"): "EquityQuote",
     ("Equity", "GetQuotes"): "EquityQuote",
+    ("Mutual Fund", "GetQuote"): "MutualFundQuote",
+    ("Mutual Fund", "GetQuotes"): "MutualFundQuote",
+    ("ETF", "GetQuote"): "ETFQuote",
+    ("ETF", "GetQuotes"): "ETFQuote",
+    ("Forex", "GetQuote"): "ForexQuote",
+    ("Forex", "GetQuotes"): "ForexQuote",
+    ("Future", "GetQuote"): "FutureQuote",
+    ("Future", "GetQuotes"): "FutureQuote",
+    ("Future Options", "GetQuote"): "FutureOptionQuote",
+    ("Future Options", "GetQuotes"): "FutureOptionQuote",
+    ("Index", "GetQuote"): "IndexQuote",
+    ("Index", "GetQuotes"): "IndexQuote",
+}
+
+
+# A discriminator maps to a one of a few OneOf maps. This is used to reconcile
+# the oneofs with their enums, matching them one-to-one.
+DISCRIMINATOR_MAPS = {
+    'activityType': 'OrderActivity',
+    'assetType': 'Instrument',
+    'type': 'securitiesAccount',
 }
 
 
@@ -207,19 +232,28 @@ ValidatedTypes = collections.namedtuple("ValidatedTypes", [
 
     # A dict of unique named enums.
     'enums',
+
+    # A type_graph.TypeGraph of the unique types, with the digests of the named
+    # ones. The generators deduplicate the types by these digests.
+    'graph',
 ])
 
 
-def ValidateSchemas(dirname: str) -> ValidatedTypes:
+def ValidateSchemas(dirname: str, verbose: bool = False,
+                    name_map: Optional[Dict[Tuple[str, str], str]] = None) -> ValidatedTypes:
     """Validate that all the schema.
 
     Run each of the types through a validation routine which detects
     irregularities and accumulates unique type signatures we will need to
-    convert to protos later.
+    convert to protos later. If `verbose` is set, print the type signatures and
+    output the named types to files for debugging. The types are renamed by
+    `name_map`, by default MSG_NAME_MAP.
     """
+    if name_map is None:
+        name_map = MSG_NAME_MAP
 
     # An accumulator for the validation.
-    accum = ValidAccum({}, {}, {})
+    accum = ValidAccum({} if verbose else None, {}, {})
 
     # Accumulate a mapping of all the types see with the same name.
     named_oneof = collections.defaultdict(list)
@@ -234,9 +268,12 @@ def ValidateSchemas(dirname: str) -> ValidatedTypes:
         endpoint_name = schema['name']
 
         # Validate the top-level url params and query params.
-        print("-------------- {:90} {}".format(schema['url'], filename))
+        if verbose:
+            print("-------------- {:90} {}".format(schema['url'], filename))
         ValidateTypeMap(schema['url_params'], "Url", accum)
-        ValidateTypeMap(schema['query_params'], "Query", accum)
+        # The query params aren't part of the messages, so their enums (e.g.
+        # 'direction' or 'type') are kept apart from those named in the protos.
+        ValidateTypeMap(schema['query_params'], "Query", ValidAccum(None, {}, {}))
 
         # Extract the mappings of top and sub types.
         if 'response' in schema:
@@ -262,7 +299,7 @@ def ValidateSchemas(dirname: str) -> ValidatedTypes:
 
             # Validate all the subtype objects within.
             for sub_name, sub_type_map in oneof_types.items():
-                sub_name = MSG_NAME_MAP.get((sub_name, endpoint_name), sub_name)
+                sub_name = name_map.get((sub_name, endpoint_name), sub_name)
                 named_types[sub_name].append((endpoint_name, "sub", sub_type_map))
                 ValidateTypeMap(sub_type_map, sub_name, accum)
 
@@ -275,15 +312,16 @@ def ValidateSchemas(dirname: str) -> ValidatedTypes:
             # developers.
             if top_type is None:
                 continue
-            top_name = MSG_NAME_MAP.get((top_name, endpoint_name), top_name)
+            top_name = name_map.get((top_name, endpoint_name), top_name)
             named_types[top_name].append((endpoint_name, "top", top_type))
             ValidateTypeMap(top_type, top_name, accum)
 
     # Print all the unique type signatures to handle.
-    print("-" * 120)
-    print("Type signatures")
-    for sig in sorted(accum.type_signatures.values(), key=lambda x: x['type']):
-        print(sig['type'],sig)
+    if verbose:
+        print("-" * 120)
+        print("Type signatures")
+        for sig in sorted(accum.type_signatures.values(), key=lambda x: x['type']):
+            print(sig['type'],sig)
 
 
     # Check that all the types with the same name have precisely the same
@@ -291,15 +329,20 @@ def ValidateSchemas(dirname: str) -> ValidatedTypes:
     # can substantially simplify the entire final schema by factoring out these
     # types (which was expected, I'd have been surprised if the source had
     # slightly differing versions of these types). {083508b4c37b}
+    #
+    # The definitions are compared by their structural digests, which hash
+    # each subtree once, ignoring the descriptions.
+    graph = type_graph.TypeGraph()
 
     # First check that all the one-of's are consistently defined.
     for name, value_list in named_oneof.items():
-        CheckAllEqual(value_list, "oneof.{}".format(name))
+        CheckAllEqual([graph.MapDigest(value) for value in value_list],
+                      "oneof.{}".format(name))
     unique_named_oneof = {key: value[0] for key, value in named_oneof.items()}
 
     # Then check that all the message types are consistently defined.
     for name, value_list in named_types.items():
-        if 1:
+        if verbose:
             # Output to files in order to debug the duplicates and craft a
             # rename map.
             os.makedirs("/tmp/schemas", exist_ok=True)
@@ -309,16 +352,23 @@ def ValidateSchemas(dirname: str) -> ValidatedTypes:
                     print("{:80}".format(subtop), file=outfile)
                     json.dump(value, outfile, sort_keys=True, indent=4)
 
-        CheckAllEqual([v[2] for v in value_list], "type.{}".format(name))
+        CheckAllEqual([graph.FieldsDigest(v[2]) for v in value_list], "type.{}".format(name))
+        graph.AddName(name, value_list[0][2])
     unique_named_types = {key: typelist[0][2] for key, typelist in named_types.items()}
 
     # Finally, check that all the discriminator enums are consistently defined.
     for enum_name, value_list in accum.disc_enums.items():
         CheckAllEqual(value_list, "disc_enum.{}".format(enum_name))
 
-    # The other enums aren't, e.g., there
-    unique_named_enums = {}
+    # The other enums aren't, e.g., there are fields named 'type' with distinct
+    # sets of values in different types. Group them by field name across all
+    # the parent types.
+    field_enums = collections.defaultdict(list)
     for (_, enum_name), value_list in accum.enums.items():
+        field_enums[enum_name].extend(value_list)
+
+    unique_named_enums = {}
+    for enum_name, value_list in sorted(field_enums.items()):
         # Enums aren't unique; make them unique by their set of values and
         # assign them unique names.
         unique_sets = {}
@@ -336,33 +386,116 @@ def ValidateSchemas(dirname: str) -> ValidatedTypes:
     # Now that we've validated consistency, deduplicate to obtain a final list
     # of all the types to generate.
 
-    # Reconcile the oneofs with their enums, matching them one-to-one.
-    # A discriminator maps to a one of a few OneOf maps.
-    discriminator_maps = {
-        'activityType': 'OrderActivity',
-        'assetType': 'Instrument',
-        'type': 'securitiesAccount',
-    }
+    # Reconcile the oneofs with their enums, matching them one-to-one. See
+    # DISCRIMINATOR_MAPS.
 
     # TODO(blais): Map and set these in the conversion.
-    print("-" * 120)
-    for name, oneof in named_oneof.items():
-        print(name, oneof[0].keys())
+    if verbose:
+        print("-" * 120)
+        for name, oneof in named_oneof.items():
+            print(name, oneof[0].keys())
 
     return ValidatedTypes(unique_named_types,
                           unique_named_oneof,
-                          unique_named_enums)
+                          unique_named_enums,
+                          graph)
+
+
+
+# Scalar protocol buffer types by JSON schema type and format.
+SCALAR_TYPES = {
+    ('boolean', None): 'bool',
+    ('integer', 'int32'): 'int32',
+    ('integer', 'int64'): 'int64',
+    ('integer', None): 'int64',
+    ('number', 'double'): 'double',
+    ('number', None): 'double',
+    ('string', None): 'string',
+    ('string', 'date-time'): 'string',
+}
+
+
+# Manual remedies for fields left untyped in the schemas (see the "MISSING
+# PROPERTIES" warnings), by class and field name. The option chains are maps of
+# expiration date to maps of strike price to lists of options.
+_OPTION_MAP = ('map', ('map', ('list', ('message', 'OptionChainQuote'))))
+TYPE_REMEDIES = {
+    ('OptionChain', 'callExpDateMap'): _OPTION_MAP,
+    ('OptionChain', 'putExpDateMap'): _OPTION_MAP,
+}
+
+
+# The shape of a field is one of:
+#
+#   ('scalar', proto type)
+#   ('enum', enum message name)
+#   ('message', message name)
+#   ('json',) for values untyped in the schemas, stored as JSON text
+#   ('list', item shape)
+#   ('map', item shape), keyed by string
+#
+# Lists and maps nested in containers are stored in wrapper messages.
+ProtoField = collections.namedtuple('ProtoField', [
+    # The name of the field in the proto.
+    'name',
+
+    # The name of the field in the JSON messages, or None for the subtypes.
+    'json_name',
+
+    # The tag number of the field.
+    'number',
+
+    # The shape of the field's values.
+    'shape',
+])
+
 
+ProtoMessage = collections.namedtuple('ProtoMessage', [
+    # A list of ProtoField for the fields of the type.
+    'fields',
+
+    # For discriminated types, the name of the discriminator field, or None.
+    'discriminator',
+
+    # A list of (discriminator value, ProtoField) pairs for the subtypes, which
+    # are all part of a 'subtype' oneof. A message with a recognized
+    # discriminator value is stored in its subtype field, otherwise in the
+    # fields of the base type.
+    'alternatives',
+])
+
+
+# An envelope for the exchanges of binary logs. The bodies are encoded with the
+# messages of their types.
+EXCHANGE_PROTO = '''\
+// A request/response exchange with the API, for binary logs.
+message Exchange {
+  optional string endpoint = 1;
+  optional string method = 2;
+  optional string url = 3;
+  // The name of the top-level type of the body, if provided.
+  optional string type = 4;
+  // Whether the body is that of the request, rather than the response.
+  optional bool is_request = 5;
+  // Whether the body is a list of messages, e.g. for GetAccounts.
+  optional bool is_list = 6;
+  repeated Body bodies = 7;
+}
+
+// An encoded message of the body of an exchange.
+message Body {
+  // The name of the message type.
+  optional string type = 1;
+  // The key of the message, for bodies mapping symbols to messages.
+  optional string key = 2;
+  optional bytes message = 3;
+}
+'''
 
 
 def PrintHeader(pr):
     pr('// -*- mode: protobuf -*-')
-    pr('// THIS FILE IS AUTO-GENERATED.')
-
-    if True:
-        pr('')
-        pr("// WARNING: THIS ISN'T WORKING YET. DO NOT USE.")
-        pr('')
+    pr('// THIS FILE IS AUTO-GENERATED by generate_proto_schemas.py.')
     pr()
     pr('syntax = "proto2";')
     pr()
@@ -374,63 +507,198 @@ def Capitalize(string):
     return string[0].capitalize() + string[1:]
 
 
-def GetProtoType(fname, ftype) -> Optional[str]:
-    if not ftype:
-        return None
-    if ftype['type'] == 'boolean':
-        return 'bool'
-    elif ftype['type'] == 'integer':
-        return ftype['format']
-    elif ftype['type'] == 'number':
-        return ftype['format']
-    elif ftype['type'] == 'string':
-        if 'enum' in ftype:
-            return Capitalize(fname)  # TODO(blais):
-        else:
-            return 'string'
-    elif ftype['type'] == 'object':
-        if 'discriminator' in ftype:
-            return 'oneof'  # TODO(blais):
-        elif 'properties' in ftype:
-            fname = re.sub('([a-zA-Z])', lambda x: x.groups()[0].upper(), fname, 1)
-            return Capitalize(fname)  # TODO(blais):
-        elif 'additionalProperties' in ftype:
-            return Capitalize(fname)  # TODO(blais):
-    elif ftype['type'] == 'array':
-        return GetProtoType(ftype['xml']['name'], ftype['items'])
-    else:
-        raise NotImplementedError(str(ftype))
+def FieldName(json_name: str) -> str:
+    """Convert a JSON field name to a valid proto field name, e.g. '52WkHigh'."""
+    name = re.sub(r"\W", "_", json_name)
+    return "_" + name if name[0].isdigit() else name
 
 
-def GenerateEnum(pr, ename, evalues):
-    pr("enum {} {{".format(Capitalize(ename)))
-    for tag, value in enumerate(evalues, 1):
-        pr("  {} = {};".format(value, tag))
-    pr("}")
+def WrapperName(shape: Tuple) -> str:
+    """Return the name of the message wrapping a nested list or map."""
+    kind = shape[0]
+    if kind == 'list':
+        return WrapperName(shape[1]) + 'List'
+    elif kind == 'map':
+        return WrapperName(shape[1]) + 'Map'
+    elif kind == 'json':
+        return 'Json'
+    return Capitalize(shape[1])
 
 
-def GenerateType(pr, dname, dtype):
-    pr("message {} {{".format(dname))
-    for tag, (fname, ftype) in enumerate(dtype.items(), start=1):
-        pcard = 'repeated' if 'array' in ftype else 'optional'
-        ptype = GetProtoType(fname, ftype)
-        pr("  {} {} {} = {};".format(pcard, ptype, fname, tag))
+class ProtoGenerator:
+    """Generate a proto schema from the validated types.
 
-        # if 'top' in response:
-        #     for name, json_schema in response['top'].items():
-        #         proto_schema = ConvertJSONSchema(name, json_schema, pr)
-        #         pr(proto_schema)
-
-        # # Output error codes.
-        # pr("  enum Error {")
-        # for index, (code, message) in enumerate(response['errors'].items(), 1):
-        #     for line in textwrap.wrap(message, 60):
-        #         pr("    // {}".format(line))
-        #     pr("    HTTP_{} = {:d};".format(code, index))
-        # pr("  }")
-        # pr("  optional Error error_code = 1;")
+    There is one message per class of generate_messages, which deduplicates
+    the types and names the nested anonymous ones. The enums are deduplicated
+    by field name and set of values, and each is nested within its own message
+    to scope its values, e.g. 'AssetType1.Value'. The subtypes of the
+    discriminated types (see DISCRIMINATOR_MAPS) go in a 'subtype' oneof. The
+    names of the types of the endpoints are mapped by `name_map`, by default
+    MSG_NAME_MAP, as in ValidateSchemas.
+    """
 
-    pr("}")
+    def __init__(self, valid_types: ValidatedTypes,
+                 name_map: Optional[Dict[Tuple[str, str], str]] = None):
+        self.name_map = MSG_NAME_MAP if name_map is None else name_map
+        self.classes = generate_messages.BuildGenerator(valid_types)
+        class_names = set(self.classes.definitions) | set(self.classes.aliases)
+
+        # A mapping of (field name, sorted values) to enum message name, and of
+        # enum message name to its values.
+        self.enum_names = {}
+        self.enums = {}
+        for key, values in sorted(valid_types.enums.items()):
+            name = Capitalize(key)
+            if name in class_names:
+                name += 'Enum'
+            self.enum_names[(re.sub(r"\d+$", "", key), tuple(sorted(values)))] = name
+            self.enums[name] = values
+        self.used_enums = set()
+
+        # A mapping of wrapper message name to the shape of its field.
+        self.wrappers = {}
+
+        self.messages = {name: self.Message(name)
+                         for name in sorted(self.classes.definitions)}
+
+    def MessageName(self, type_name: str, endpoint: str) -> str:
+        """Return the message name of a named type of an endpoint."""
+        name = generate_messages.ClassName(self.name_map.get((type_name, endpoint), type_name))
+        return self.classes.aliases.get(name, name)
+
+    def Shape(self, class_name: str, field_name: str, ftype, hint: str = None) -> Tuple:
+        """Return the shape of a field."""
+        remedy = TYPE_REMEDIES.get((class_name, field_name))
+        if remedy:
+            return remedy
+        kind = ftype.get('type')
+        if kind == 'string' and 'enum' in ftype:
+            name = self.enum_names[(field_name, tuple(sorted(ftype['enum'])))]
+            self.used_enums.add(name)
+            return ('enum', name)
+        elif kind == 'object':
+            if ftype.get('properties'):
+                return ('message', self.classes.FieldType(field_name, ftype, hint)[1])
+            elif ftype.get('additionalProperties'):
+                return ('map', self.Shape(class_name, field_name,
+                                          ftype['additionalProperties'], hint))
+            return ('json',)
+        elif kind == 'array':
+            if not ftype.get('items'):
+                return ('list', ('json',))
+            xml_name = ftype.get('xml', {}).get('name', '__UNKNOWN')
+            item_hint = (generate_messages.Singular(field_name)
+                         if xml_name == '__UNKNOWN' else xml_name)
+            return ('list', self.Shape(class_name, field_name, ftype['items'], item_hint))
+        return ('scalar', SCALAR_TYPES[(kind, ftype.get('format'))])
+
+    def Message(self, name: str) -> ProtoMessage:
+        """Build the description of the message of a class."""
+        fields, dispatch = self.classes.definitions[name]
+        pfields = [ProtoField(FieldName(field_name), field_name, number,
+                              self.Shape(name, field_name, ftype))
+                   for number, (field_name, ftype) in enumerate(sorted(fields.items()), 1)]
+        discriminator = None
+        alternatives = []
+        if dispatch:
+            discriminator, subclasses = dispatch
+            for number, (value, subclass) in enumerate(sorted(subclasses.items()),
+                                                       len(pfields) + 1):
+                alternatives.append((value, ProtoField(
+                    'as_' + value.lower(), None, number, ('message', subclass))))
+        return ProtoMessage(pfields, discriminator, alternatives)
+
+    def ProtoType(self, shape: Tuple) -> str:
+        """Return the proto type of a value, registering wrappers."""
+        kind = shape[0]
+        if kind == 'scalar':
+            return shape[1]
+        elif kind == 'enum':
+            return '{}.Value'.format(shape[1])
+        elif kind == 'message':
+            return shape[1]
+        elif kind == 'json':
+            return 'string'
+        name = WrapperName(shape)
+        self.wrappers.setdefault(name, shape)
+        return name
+
+    def FieldDecl(self, field: ProtoField) -> str:
+        """Return the declaration of a field."""
+        kind = field.shape[0]
+        if kind == 'list':
+            decl = "repeated {}".format(self.ProtoType(field.shape[1]))
+        elif kind == 'map':
+            decl = "map<string, {}>".format(self.ProtoType(field.shape[1]))
+        else:
+            decl = "optional {}".format(self.ProtoType(field.shape))
+        decl = "{} {} = {}".format(decl, field.name, field.number)
+        if field.json_name is not None and field.json_name != field.name:
+            decl += ' [json_name = "{}"]'.format(field.json_name)
+        decl += ";"
+        if 'json' in field.shape:
+            decl += "  // JSON text"
+        return decl
+
+    def GenerateMessage(self, pr, name: str, message: ProtoMessage):
+        pr("message {} {{".format(name))
+        for field in message.fields:
+            pr("  {}".format(self.FieldDecl(field)))
+        if message.alternatives:
+            pr("  // The subtype selected by the value of '{}'.".format(message.discriminator))
+            pr("  oneof subtype {")
+            for _, field in message.alternatives:
+                # Fields of oneofs have no label.
+                pr("    {}".format(self.FieldDecl(field).replace("optional ", "", 1)))
+            pr("  }")
+        pr("}")
+
+    def Source(self) -> str:
+        """Return the source of the proto schema."""
+        messages = io.StringIO()
+        mpr = functools.partial(print, file=messages)
+        for name, message in sorted(self.messages.items()):
+            self.GenerateMessage(mpr, name, message)
+            mpr()
+
+        # Wrappers may register other wrappers, for deeper nesting.
+        done = set()
+        while set(self.wrappers) - done:
+            for name in sorted(set(self.wrappers) - done):
+                shape = self.wrappers[name]
+                field_name = 'items' if shape[0] == 'list' else 'entries'
+                self.GenerateMessage(mpr, name, ProtoMessage(
+                    [ProtoField(field_name, None, 1, shape)], None, []))
+                mpr()
+                done.add(name)
+
+        oss = io.StringIO()
+        pr = functools.partial(print, file=oss)
+        PrintHeader(pr)
+        for name in sorted(self.used_enums):
+            pr("message {} {{".format(name))
+            pr("  enum Value {")
+            for tag, value in enumerate(self.enums[name], 1):
+                pr("    {} = {};".format(value, tag))
+            pr("  }")
+            pr("}")
+            pr()
+        oss.write(messages.getvalue())
+        oss.write(EXCHANGE_PROTO)
+        return oss.getvalue()
+
+
+def CheckProto(filename: str):
+    """Check that a proto schema compiles, if protoc is available."""
+    protoc = shutil.which('protoc')
+    if protoc is None:
+        logging.warning("protoc not found; not checking %s", filename)
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        subprocess.check_call([protoc,
+                               '--proto_path={}'.format(path.dirname(path.abspath(filename))),
+                               '--descriptor_set_out={}'.format(path.join(tmpdir, 'out.pb')),
+                               path.abspath(filename)])
 
 
 def main():
@@ -443,25 +711,18 @@ def main():
                         default=DEFAULT_OUTPUT,
                         help=("Directory path to write the corresponding protocol buffer "
                               "schemas."))
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Print the type signatures and debug the named types.")
     args = parser.parse_args()
 
     # Validate and deduplicate and clean the types.
-    valid_types = ValidateSchemas(args.clean_schemas)
+    valid_types = ValidateSchemas(args.clean_schemas, verbose=args.verbose)
 
     # Convert to a proto schema.
-    oss = io.StringIO()
-    pr = functools.partial(print, file=oss)
-    PrintHeader(pr)
-    for ename, evalues in sorted(valid_types.enums.items()):
-        GenerateEnum(pr, ename, evalues)
-        pr()
-    for dname, dtype in sorted(valid_types.types.items()):
-        GenerateType(pr, dname, dtype)
-        pr()
+    generator = ProtoGenerator(valid_types)
     with open(args.output, "w") as outfile:
-        outfile.write(oss.getvalue())
-
-
+        outfile.write(generator.Source())
+    CheckProto(args.output)
 
 
 if __name__ == '__main__':
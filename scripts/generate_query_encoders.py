@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""Generate query string encoders for the Ameritrade API endpoints.
+
+The types of the query parameters are resolved once per endpoint by the convert
+step and embedded in the schemas. This script compiles them into a function per
+endpoint which validates the parameter values and encodes the query string in a
+single pass, with the names, enum values and their encodings all resolved at
+generation time: building a query string is a few table lookups, without any
+regexp or schema walk.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Callable, Dict, List
+import argparse
+import hashlib
+import io
+import json
+import logging
+import timeit
+import urllib.parse
+
+import generate_validators
+import parameters
+from convert_ameritrade_schemas import JSON
+from generate_validators import INTEGER_RANGES
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# An encoder function. Returns the query string of a mapping of parameter
+# values, or raises a ValueError.
+Encoder = Callable[[Dict[str, Any]], str]
+
+# The characters left unquoted in the values, besides the alphanumerics, e.g.
+# for lists of symbols like 'AAPL,MSFT'.
+SAFE = ','
+
+
+def Quote(value: str) -> str:
+    """Quote a name or value of a query string."""
+    return urllib.parse.quote(value, safe=SAFE)
+
+
+# The helpers of the generated encoders, also embedded in the generated clients.
+_HELPERS = '''\
+from math import isfinite as _isfinite
+from urllib.parse import quote as _quote
+
+
+class QueryError(ValueError):
+    """An invalid query parameter."""
+
+
+def _Fail(name, message):
+    raise QueryError('{}: {}'.format(name, message))
+
+
+def _Unknown(params, names):
+    _Fail(sorted(set(params) - names)[0], 'unknown parameter')
+
+
+def _Quote(value):
+    if value.isalnum() and value.isascii():
+        return value
+    return _quote(value, safe=%(safe)r)
+
+
+def _TypeName(value):
+    return {dict: 'object', list: 'array', str: 'string', int: 'integer',
+            float: 'number', bool: 'boolean', type(None): 'null'}.get(
+                type(value), type(value).__name__)
+
+
+_NUMBER = frozenset([int, float])
+_SEQUENCE = frozenset([list, tuple])
+''' % {'safe': SAFE}
+
+_PRELUDE = '''\
+# -*- mode: python -*-
+# THIS FILE IS AUTO-GENERATED by generate_query_encoders.py.
+"""Query string encoders for the Ameritrade API endpoints.
+
+Each function validates a mapping of query parameter values and returns the
+encoded query string, or raises a QueryError on the first invalid value. The
+parameters with a None value are omitted, and the others are encoded in the
+order of their names, regardless of the order of the mapping.
+"""
+
+''' + _HELPERS
+
+
+class EncoderGenerator:
+    """Generate the source of a module of query string encoder functions.
+
+    The endpoints with the same (description-stripped) query parameters share a
+    single function, e.g. all those taking only an 'apikey'.
+    """
+
+    def __init__(self):
+        # A mapping of the signature of the parameters to their function name.
+        self.functions = {}
+        # A mapping of constant values (as source) to their global names.
+        self.constants = {}
+        # Generated function definitions.
+        self.chunks = []
+        # Public encoders, by endpoint name.
+        self.encoders = {}
+
+    def Constant(self, prefix: str, source: str) -> str:
+        """Return the name of a global constant, creating it if needed."""
+        name = self.constants.get(source)
+        if name is None:
+            name = self.constants[source] = "_{}{}".format(prefix, len(self.constants))
+        return name
+
+    def EncoderFunction(self, query_params: Dict[str, JSON]) -> str:
+        """Return the name of the function encoding a set of query parameters."""
+        signature = json.dumps(generate_validators.StripDescriptions(query_params),
+                               sort_keys=True)
+        name = self.functions.get(signature)
+        if name is not None:
+            return name
+        name = self.functions[signature] = "_Query_{}".format(
+            hashlib.md5(signature.encode('utf8')).hexdigest()[:12])
+
+        names = self.Constant('Names', "frozenset({!r})".format(sorted(query_params)))
+        lines = ["def {}(params):".format(name),
+                 "    if not {}.issuperset(params):".format(names),
+                 "        _Unknown(params, {})".format(names),
+                 "    parts = []"]
+        for param_name, dtype in sorted(query_params.items()):
+            lines.append("    v = params.get({!r})".format(param_name))
+            encode = []
+            self.EmitEncode(encode, 2, param_name, dtype)
+            if dtype.get('required') is True:
+                lines.extend([
+                    "    if v is None:",
+                    "        _Fail({!r}, 'missing required parameter')".format(param_name),
+                    "    else:"])
+            else:
+                lines.append("    if v is not None:")
+            lines.extend(encode)
+        lines.append("    return '&'.join(parts)")
+        self.chunks.append('\n'.join(lines))
+        return name
+
+    def EmitEncode(self, lines: List[str], indent: int, param_name: str, dtype: JSON):
+        """Emit the statements validating variable 'v' and appending its encoding."""
+        pad = '    ' * indent
+        def Emit(depth, line):
+            lines.append(pad + '    ' * depth + line)
+        def FailType(depth, expected, var):
+            Emit(depth, "_Fail({!r}, 'expected {}, got ' + _TypeName({}))".format(
+                param_name, expected, var))
+        prefix = Quote(param_name) + '='
+
+        kind = dtype['type']
+        if kind == 'boolean':
+            Emit(0, "if v is True:")
+            Emit(1, "parts.append({!r})".format(prefix + 'true'))
+            Emit(0, "elif v is False:")
+            Emit(1, "parts.append({!r})".format(prefix + 'false'))
+            Emit(0, "else:")
+            FailType(1, 'boolean', 'v')
+
+        elif kind == 'string' and 'enum' in dtype:
+            # The encoded pairs are looked up directly from the values.
+            pairs = self.Constant('Pairs', "{{{}}}".format(', '.join(
+                "{!r}: {!r}".format(value, prefix + Quote(value))
+                for value in dtype['enum'])))
+            Emit(0, "p = {}.get(v) if v.__class__ is str else None".format(pairs))
+            Emit(0, "if p is None:")
+            Emit(1, "_Fail({!r}, 'invalid enum value %r' % (v,))".format(param_name))
+            Emit(0, "parts.append(p)")
+
+        elif kind == 'array':
+            Emit(0, "if v.__class__ not in _SEQUENCE:")
+            FailType(1, 'array', 'v')
+            Emit(0, "items = []")
+            Emit(0, "for x in v:")
+            self.EmitItem(lines, indent + 1, param_name, dtype['items'])
+            Emit(0, "parts.append({!r} + ','.join(items))".format(prefix))
+
+        else:
+            self.EmitScalar(lines, indent, param_name, dtype, 'v',
+                            lambda expr: "parts.append({!r} + {})".format(prefix, expr))
+
+    def EmitItem(self, lines: List[str], indent: int, param_name: str, dtype: JSON):
+        """Emit the statements validating and encoding item 'x' of an array."""
+        pad = '    ' * indent
+        if dtype['type'] == 'string' and 'enum' in dtype:
+            values = self.Constant('Values', "{{{}}}".format(', '.join(
+                "{!r}: {!r}".format(value, Quote(value)) for value in dtype['enum'])))
+            lines.extend([
+                pad + "q = {}.get(x) if x.__class__ is str else None".format(values),
+                pad + "if q is None:",
+                pad + "    _Fail({!r}, 'invalid enum value %r' % (x,))".format(param_name),
+                pad + "items.append(q)"])
+        else:
+            self.EmitScalar(lines, indent, param_name, dtype, 'x',
+                            lambda expr: "items.append({})".format(expr))
+
+    def EmitScalar(self, lines: List[str], indent: int, param_name: str, dtype: JSON,
+                   var: str, append: Callable[[str], str]):
+        """Emit the statements validating a scalar and appending its encoding."""
+        pad = '    ' * indent
+        def Emit(depth, line):
+            lines.append(pad + '    ' * depth + line)
+        def Fail(depth, message_expr):
+            Emit(depth, "_Fail({!r}, {})".format(param_name, message_expr))
+        def FailType(expected):
+            Fail(1, "'expected {}, got ' + _TypeName({})".format(expected, var))
+
+        kind = dtype['type']
+        if kind == 'integer':
+            Emit(0, "if {}.__class__ is not int:".format(var))
+            FailType('integer')
+            if dtype.get('format') in INTEGER_RANGES:
+                low, high = INTEGER_RANGES[dtype['format']]
+                Emit(0, "if not {} <= {} <= {}:".format(low, var, high))
+                Fail(1, repr("integer out of range for {}".format(dtype['format'])))
+            Emit(0, append("str({})".format(var)))
+
+        elif kind == 'number':
+            Emit(0, "if {}.__class__ not in _NUMBER:".format(var))
+            FailType('number')
+            Emit(0, "if not _isfinite({}):".format(var))
+            Fail(1, "'expected a finite number'")
+            # The exponents of floats may have a '+', e.g. '1e+16'.
+            Emit(0, append("repr({}).replace('+', '%2B')".format(var)))
+
+        elif kind == 'string':
+            Emit(0, "if {}.__class__ is not str:".format(var))
+            FailType('string')
+            Emit(0, append("_Quote({})".format(var)))
+
+        else:
+            raise NotImplementedError(str(dtype))
+
+    def AddEndpoint(self, schema: JSON):
+        """Generate the encoder of the query parameters of an endpoint."""
+        self.encoders[schema['name']] = self.EncoderFunction(schema['query_params'])
+
+    def Definitions(self) -> str:
+        """Return the source code of the constants and encoder functions."""
+        oss = io.StringIO()
+        pr = lambda *args: print(*args, file=oss)
+        for source, name in self.constants.items():
+            pr("{} = {}".format(name, source))
+        for chunk in self.chunks:
+            pr()
+            pr()
+            pr(chunk)
+        return oss.getvalue()
+
+    def Source(self) -> str:
+        """Return the source code of the generated module."""
+        oss = io.StringIO()
+        pr = lambda *args: print(*args, file=oss)
+        pr(_PRELUDE)
+        pr(self.Definitions())
+        pr()
+        pr("# Encoders, by endpoint name.")
+        pr("ENCODERS = {")
+        for endpoint_name, func in sorted(self.encoders.items()):
+            pr("    {!r}: {},".format(endpoint_name, func))
+        pr("}")
+        pr()
+        pr()
+        pr("def Encode(endpoint_name, params):")
+        pr('    """Validate and encode the query parameters of an endpoint."""')
+        pr("    return ENCODERS[endpoint_name](params)")
+        return oss.getvalue()
+
+
+def GenerateEncoders(schemas: Dict[str, JSON]) -> str:
+    """Generate the source of a module of encoders for the given schemas."""
+    generator = EncoderGenerator()
+    for _, schema in sorted(schemas.items()):
+        generator.AddEndpoint(schema)
+    return generator.Source()
+
+
+def CompileEncoders(schemas: Dict[str, JSON]) -> Dict[str, Encoder]:
+    """Generate and compile the encoders, without writing them out.
+
+    Returns a mapping of endpoint name to encoder function.
+    """
+    source = GenerateEncoders(schemas)
+    namespace = {}
+    exec(compile(source, '<generated query encoders>', 'exec'), namespace)
+    return namespace['ENCODERS']
+
+
+def EncodeGeneric(schema: JSON, params: Dict[str, Any]) -> str:
+    """Validate and encode query parameters by resolving their types at runtime.
+
+    This resolves the type of each parameter from its name and description, as
+    was done before the types were embedded in the schemas, and validates it
+    with the generic validator. This is the baseline of the benchmark.
+    """
+    pairs = []
+    for name, value in sorted(params.items()):
+        if value is None:
+            continue
+        if name not in schema['query_params']:
+            raise ValueError("{}: unknown parameter".format(name))
+        dtype = parameters.QueryParamType(name, schema['query_params'][name]['description'])
+        errors = []
+        generate_validators.ValidateValue(
+            dtype, list(value) if isinstance(value, tuple) else value, '', {}, errors)
+        if errors:
+            raise ValueError("{}: {}".format(name, errors[0][1]))
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        elif isinstance(value, (list, tuple)):
+            value = ','.join(map(str, value))
+        elif isinstance(value, float):
+            value = repr(value)
+        pairs.append((name, value))
+    return urllib.parse.urlencode(pairs, safe=SAFE, quote_via=urllib.parse.quote)
+
+
+# Typical parameters of the queries on the latency path of a trading
+# application, for the benchmark.
+BENCHMARK_PARAMS = [
+    ('GetOptionChain', {
+        'symbol': 'AAPL', 'contractType': 'CALL', 'strikeCount': 10,
+        'includeQuotes': True, 'strategy': 'SINGLE', 'range': 'NTM',
+        'fromDate': '2021-03-01', 'toDate': '2021-04-16', 'expMonth': 'ALL',
+        'optionType': 'S'}),
+    ('GetOptionChain', {
+        'symbol': 'SPY', 'strategy': 'ANALYTICAL', 'interval': 2.5,
+        'strike': 390.0, 'volatility': 0.25, 'underlyingPrice': 391.42,
+        'interestRate': 0.001, 'daysToExpiration': 30}),
+    ('GetPriceHistory', {
+        'periodType': 'day', 'period': 10, 'frequencyType': 'minute',
+        'frequency': 5, 'needExtendedHoursData': False}),
+    ('GetPriceHistory', {
+        'frequencyType': 'minute', 'frequency': 1,
+        'startDate': 1614556800000, 'endDate': 1614643200000}),
+    ('GetQuotes', {'symbol': 'AAPL,MSFT,SPY,$SPX.X'}),
+    ('GetAccount', {'fields': ['positions', 'orders']}),
+    ('GetOrdersByPath', {
+        'maxResults': 50, 'status': 'FILLED',
+        'fromEnteredTime': '2021-03-01', 'toEnteredTime': '2021-03-02'}),
+]
+
+# Invalid parameters, which both implementations must reject.
+BENCHMARK_INVALID = [
+    ('GetOptionChain', {'contractType': 'BOTH'}),
+    ('GetOptionChain', {'strikeCount': '10'}),
+    ('GetPriceHistory', {'periodType': 'day', 'frequency': 2**40}),
+    ('GetPriceHistory', {'needExtendedHoursData': 1}),
+    ('GetAccount', {'fields': ['positions', 'balances']}),
+    ('GetQuotes', {'symbols': 'AAPL'}),
+]
+
+
+def Benchmark(schemas: Dict[str, JSON], iterations: int):
+    """Compare the generated encoders to resolving the types at runtime."""
+    encoders = CompileEncoders(schemas)
+
+    # Check that both implementations agree before timing them.
+    for name, params in BENCHMARK_PARAMS:
+        generic = EncodeGeneric(schemas[name], params)
+        compiled = encoders[name](params)
+        if generic != compiled:
+            raise ValueError("Encoders disagree on {}: {} != {}".format(
+                name, generic, compiled))
+    for name, params in BENCHMARK_INVALID:
+        for encode in (lambda params: EncodeGeneric(schemas[name], params),
+                       encoders[name]):
+            try:
+                encode(params)
+            except ValueError:
+                continue
+            raise ValueError("Invalid parameters accepted for {}: {}".format(name, params))
+
+    print("{:20} {:>12} {:>12} {:>8}  {}".format(
+        "Endpoint", "generic us", "compiled us", "speedup", "query"))
+    for name, params in BENCHMARK_PARAMS:
+        schema, encoder = schemas[name], encoders[name]
+        time_generic = timeit.timeit(lambda: EncodeGeneric(schema, params),
+                                     number=iterations) / iterations
+        time_compiled = timeit.timeit(lambda: encoder(params),
+                                      number=iterations) / iterations
+        print("{:20} {:12.2f} {:12.2f} {:7.1f}x  {}".format(
+            name, time_generic * 1e6, time_compiled * 1e6, time_generic / time_compiled,
+            encoder(params)))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--output', action='store',
+                        help="Python module to write the encoders to (default: stdout).")
+    parser.add_argument('--benchmark', action='store_true',
+                        help=("Benchmark the generated encoders against resolving the "
+                              "parameter types at runtime instead."))
+    parser.add_argument('--iterations', action='store', type=int, default=20000,
+                        help="Number of iterations for the benchmark.")
+    args = parser.parse_args()
+
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    if args.benchmark:
+        Benchmark(schemas, args.iterations)
+        return
+
+    source = GenerateEncoders(schemas)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(source)
+    else:
+        print(source, end='')
+
+
+if __name__ == '__main__':
+    main()
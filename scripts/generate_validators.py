@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""Generate specialized validator functions from the Ameritrade JSON schemas.
+
+Walking the nested schema dicts generically for every message we receive is
+slow. This script compiles the request/response types of each endpoint into
+straight-line Python functions, where the type checks, enum sets, discriminator
+dispatch and field tables are all resolved once, at generation time.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import timeit
+
+import convert_ameritrade_schemas
+import generate_proto_schemas
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples used in the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+
+# A validation error, a pair of (location, message). The location is a path
+# relative to the validated value, e.g. '.positions[0].instrument'.
+Error = Tuple[str, str]
+
+# A validator function. Returns None if the value is valid, or a list of errors.
+Validator = Callable[[JSON], Optional[List[Error]]]
+
+# Valid ranges for the sized integer formats.
+INTEGER_RANGES = {
+    'int32': (-2**31, 2**31 - 1),
+    'int64': (-2**63, 2**63 - 1),
+}
+
+
+def ReadSchemas(dirname: str) -> Dict[str, JSON]:
+    """Read all the endpoint schemas from a directory, by endpoint name."""
+    schemas = {}
+    for filename in sorted(os.listdir(dirname)):
+        if not re.match(r"[A-Z].*.json", filename):
+            continue
+        schema = convert_ameritrade_schemas.ReadJson(path.join(dirname, filename))
+        schemas[schema['name']] = schema
+    return schemas
+
+
+def GetMessages(schema: JSON) -> Tuple[Dict[str, JSON], Dict[str, JSON]]:
+    """Return the (top, sub) type mappings of the payload of an endpoint."""
+    payload = schema.get('response', schema.get('request', {}))
+    top = {name: value
+           for name, value in payload.get('top', {}).items()
+           if value is not None}
+    return top, payload.get('sub', {})
+
+
+def CamelCase(string: str) -> str:
+    """Convert an enum value like 'CASH_EQUIVALENT' to 'CashEquivalent'."""
+    return ''.join(word.capitalize() for word in string.split('_'))
+
+
+def DiscriminatorSubtypes(dtype: JSON, subtypes: Dict[str, JSON]) -> Dict[str, JSON]:
+    """Map the discriminator values of an object type to their subtype fields.
+
+    The subclasses are named after the discriminator values, e.g. 'EQUITY'
+    selects 'Equity' and 'CASH' selects 'CashAccount'. Values without a
+    corresponding subclass (e.g. 'ORDER_ACTION') are absent from the mapping.
+    """
+    disc_field_name = dtype['discriminator']
+    oneof_name = generate_proto_schemas.DISCRIMINATOR_MAPS.get(disc_field_name)
+    alternatives = subtypes.get(oneof_name, {})
+    dispatch = {}
+    for value in dtype['properties'][disc_field_name]['enum']:
+        camel = CamelCase(value)
+        candidates = sorted(name for name in alternatives if name.startswith(camel))
+        if camel in alternatives:
+            dispatch[value] = alternatives[camel]
+        elif candidates:
+            dispatch[value] = alternatives[candidates[0]]
+    return dispatch
+
+
+def TypeName(value: Any) -> str:
+    """Return the JSON name of the type of a decoded value."""
+    return {dict: 'object', list: 'array', str: 'string', int: 'integer',
+            float: 'number', bool: 'boolean', type(None): 'null'}.get(
+                type(value), type(value).__name__)
+
+
+#-------------------------------------------------------------------------------
+# Generic validator, walking the schema for every value.
+
+
+def ValidateValue(dtype: JSON, value: JSON, loc: str,
+                  subtypes: Dict[str, JSON], errors: List[Error]):
+    """Validate a value against its type, walking the schema tree."""
+    kind = dtype['type']
+    if kind == 'boolean':
+        if type(value) is not bool:
+            errors.append((loc, "expected boolean, got {}".format(TypeName(value))))
+
+    elif kind == 'integer':
+        if type(value) is not int:
+            errors.append((loc, "expected integer, got {}".format(TypeName(value))))
+        else:
+            ValidateBounds(dtype, value, loc, errors)
+
+    elif kind == 'number':
+        if type(value) is not float and type(value) is not int:
+            errors.append((loc, "expected number, got {}".format(TypeName(value))))
+        else:
+            ValidateBounds(dtype, value, loc, errors)
+
+    elif kind == 'string':
+        if type(value) is not str:
+            errors.append((loc, "expected string, got {}".format(TypeName(value))))
+        elif 'enum' in dtype and value not in dtype['enum']:
+            errors.append((loc, "invalid enum value {!r}".format(value)))
+
+    elif kind == 'object':
+        if type(value) is not dict:
+            errors.append((loc, "expected object, got {}".format(TypeName(value))))
+            return
+        if 'discriminator' in dtype:
+            dispatch = DiscriminatorSubtypes(dtype, subtypes)
+            disc_value = value.get(dtype['discriminator'])
+            if type(disc_value) is str and disc_value in dispatch:
+                ValidateFields(dispatch[disc_value], value, loc, subtypes, errors)
+                return
+        if dtype.get('properties'):
+            ValidateFields(dtype['properties'], value, loc, subtypes, errors)
+        elif 'additionalProperties' in dtype:
+            for key, item in value.items():
+                ValidateValue(dtype['additionalProperties'], item,
+                              "{}[{!r}]".format(loc, key), subtypes, errors)
+
+    elif kind == 'array':
+        if type(value) is not list:
+            errors.append((loc, "expected array, got {}".format(TypeName(value))))
+        elif dtype.get('items'):
+            for index, item in enumerate(value):
+                ValidateValue(dtype['items'], item, "{}[{}]".format(loc, index),
+                              subtypes, errors)
+
+    else:
+        raise NotImplementedError(str(dtype))
+
+
+def ValidateBounds(dtype: JSON, value: JSON, loc: str, errors: List[Error]):
+    """Validate the format range and minimum of a numerical value."""
+    if dtype.get('format') in INTEGER_RANGES:
+        low, high = INTEGER_RANGES[dtype['format']]
+        if not low <= value <= high:
+            errors.append((loc, "integer out of range for {}".format(dtype['format'])))
+    if 'minimum' in dtype and value < dtype['minimum']:
+        errors.append((loc, "value below minimum {}".format(dtype['minimum'])))
+
+
+def ValidateFields(fields: Dict[str, JSON], value: Dict[str, JSON], loc: str,
+                   subtypes: Dict[str, JSON], errors: List[Error]):
+    """Validate the fields of an object against a mapping of field types."""
+    for field_name, ftype in sorted(fields.items()):
+        floc = "{}.{}".format(loc, field_name)
+        item = value.get(field_name)
+        if item is None:
+            if ftype.get('required') is True:
+                errors.append((floc, "missing required field"))
+        else:
+            ValidateValue(ftype, item, floc, subtypes, errors)
+    for field_name in sorted(set(value) - set(fields)):
+        errors.append(("{}.{}".format(loc, field_name), "unknown field"))
+
+
+def ValidateGeneric(schema: JSON, type_name: str, value: JSON) -> List[Error]:
+    """Validate a value against a top-level type of an endpoint's schema."""
+    top, sub = GetMessages(schema)
+    errors = []
+    ValidateValue({'type': 'object', 'properties': top[type_name]}, value, '', sub, errors)
+    return errors
+
+
+#-------------------------------------------------------------------------------
+# Generated validators, one function per unique object type.
+
+
+_PRELUDE = '''\
+# -*- mode: python -*-
+# THIS FILE IS AUTO-GENERATED by generate_validators.py.
+"""Validators for the Ameritrade API messages.
+
+Each function validates a decoded JSON value and returns None if it is valid, or
+a list of (location, message) errors.
+"""
+
+
+def _Add(errors, loc, message):
+    if errors is None:
+        errors = []
+    errors.append((loc, message))
+    return errors
+
+
+def _Extend(errors, loc, suberrors):
+    if errors is None:
+        errors = []
+    errors.extend((loc + subloc, message) for subloc, message in suberrors)
+    return errors
+
+
+def _Unknown(errors, value, fields):
+    for field_name in sorted(set(value) - fields):
+        errors = _Add(errors, '.' + field_name, 'unknown field')
+    return errors
+
+
+def _TypeName(value):
+    return {dict: 'object', list: 'array', str: 'string', int: 'integer',
+            float: 'number', bool: 'boolean', type(None): 'null'}.get(
+                type(value), type(value).__name__)
+
+
+_NUMBER = frozenset([int, float])
+'''
+
+
+class ValidatorGenerator:
+    """Generate the source of a module of validator functions.
+
+    Object types are deduplicated by their (description-stripped) definitions,
+    so the types shared across endpoints produce a single function.
+    """
+
+    def __init__(self):
+        # A mapping of the signature of an object type to its function name.
+        self.functions = {}
+        # A mapping of constant values (as source) to their global names.
+        self.constants = {}
+        # Generated function definitions and dispatch tables.
+        self.chunks = []
+        # Public validators, by endpoint name and top-level type name.
+        self.validators = {}
+
+    def Constant(self, prefix: str, source: str) -> str:
+        """Return the name of a global constant, creating it if needed."""
+        name = self.constants.get(source)
+        if name is None:
+            name = self.constants[source] = "_{}{}".format(prefix, len(self.constants))
+        return name
+
+    def ObjectFunction(self, fields: Dict[str, JSON], subtypes: Dict[str, JSON],
+                       dispatch: Optional[Dict[str, str]] = None) -> str:
+        """Return the name of the function validating an object's fields."""
+        signature = json.dumps([StripDescriptions({'properties': fields}), dispatch],
+                               sort_keys=True)
+        name = self.functions.get(signature)
+        if name is not None:
+            return name
+        name = self.functions[signature] = "_Object_{}".format(
+            hashlib.md5(signature.encode('utf8')).hexdigest()[:12])
+
+        lines = ["def {}(value):".format(name),
+                 "    if value.__class__ is not dict:",
+                 "        return [('', 'expected object, got ' + _TypeName(value))]"]
+        if dispatch:
+            (disc_field_name, table), = dispatch.items()
+            lines.extend([
+                "    disc = value.get({!r})".format(disc_field_name),
+                "    if disc.__class__ is str:",
+                "        func = {}.get(disc)".format(table),
+                "        if func is not None:",
+                "            return func(value)"])
+        lines.append("    errors = None")
+        for field_name, ftype in sorted(fields.items()):
+            lines.append("    v = value.get({!r})".format(field_name))
+            check = []
+            self.EmitCheck(check, 2, ftype, 'v', repr('.' + field_name), subtypes, [0])
+            if ftype.get('required') is True:
+                lines.extend([
+                    "    if v is None:",
+                    "        errors = _Add(errors, {!r}, 'missing required field')".format(
+                        '.' + field_name)])
+                if check:
+                    lines.append("    else:")
+                    lines.extend(check)
+            elif check:
+                lines.append("    if v is not None:")
+                lines.extend(check)
+        keys = self.Constant('Fields', "frozenset({!r})".format(sorted(fields)))
+        lines.extend([
+            "    if not {}.issuperset(value):".format(keys),
+            "        errors = _Unknown(errors, value, {})".format(keys),
+            "    return errors"])
+        self.chunks.append('\n'.join(lines))
+        return name
+
+    def EmitCheck(self, lines: List[str], indent: int, dtype: JSON, var: str,
+                  loc: str, subtypes: Dict[str, JSON], counter: List[int]):
+        """Emit the statements checking the value in variable `var`.
+
+        `loc` is a Python expression for the location of the value, only
+        evaluated on error. `counter` is used to create unique loop variables.
+        """
+        pad = '    ' * indent
+        def Emit(depth, line):
+            lines.append(pad + '    ' * depth + line)
+        def Fail(depth, message_expr):
+            Emit(depth, "errors = _Add(errors, {}, {})".format(loc, message_expr))
+        def FailType(expected):
+            Emit(1, "errors = _Add(errors, {}, 'expected {}, got ' + _TypeName({}))".format(
+                loc, expected, var))
+
+        kind = dtype['type']
+        if kind == 'boolean':
+            Emit(0, "if {}.__class__ is not bool:".format(var))
+            FailType('boolean')
+
+        elif kind in ('integer', 'number'):
+            if kind == 'integer':
+                Emit(0, "if {}.__class__ is not int:".format(var))
+            else:
+                Emit(0, "if {}.__class__ not in _NUMBER:".format(var))
+            FailType(kind)
+            bounds = []
+            if dtype.get('format') in INTEGER_RANGES:
+                low, high = INTEGER_RANGES[dtype['format']]
+                bounds.append(("not {} <= {} <= {}".format(low, var, high),
+                               "integer out of range for {}".format(dtype['format'])))
+            if 'minimum' in dtype:
+                bounds.append(("{} < {!r}".format(var, dtype['minimum']),
+                               "value below minimum {}".format(dtype['minimum'])))
+            if len(bounds) == 1:
+                (condition, message), = bounds
+                Emit(0, "elif {}:".format(condition))
+                Fail(1, repr(message))
+            elif bounds:
+                Emit(0, "else:")
+                for condition, message in bounds:
+                    Emit(1, "if {}:".format(condition))
+                    Fail(2, repr(message))
+
+        elif kind == 'string':
+            if 'enum' in dtype:
+                enum = self.Constant('Enum', "frozenset({!r})".format(sorted(dtype['enum'])))
+                Emit(0, "if {}.__class__ is not str:".format(var))
+                FailType('string')
+                Emit(0, "elif {} not in {}:".format(var, enum))
+                Fail(1, "'invalid enum value %r' % ({},)".format(var))
+            else:
+                Emit(0, "if {}.__class__ is not str:".format(var))
+                FailType('string')
+
+        elif kind == 'object':
+            dispatch = None
+            if 'discriminator' in dtype:
+                subfuncs = {value: self.ObjectFunction(fields, subtypes)
+                            for value, fields in DiscriminatorSubtypes(dtype, subtypes).items()}
+                if subfuncs:
+                    table = self.Constant('Dispatch', "{{{}}}".format(', '.join(
+                        "{!r}: {}".format(value, func)
+                        for value, func in sorted(subfuncs.items()))))
+                    dispatch = {dtype['discriminator']: table}
+            if dtype.get('properties'):
+                func = self.ObjectFunction(dtype['properties'], subtypes, dispatch)
+                Emit(0, "e = {}({})".format(func, var))
+                Emit(0, "if e is not None:")
+                Emit(1, "errors = _Extend(errors, {}, e)".format(loc))
+            elif 'additionalProperties' in dtype:
+                counter[0] += 1
+                key, item = 'k{}'.format(counter[0]), 'x{}'.format(counter[0])
+                Emit(0, "if {}.__class__ is not dict:".format(var))
+                FailType('object')
+                Emit(0, "else:")
+                Emit(1, "for {}, {} in {}.items():".format(key, item, var))
+                self.EmitCheck(lines, indent + 2, dtype['additionalProperties'], item,
+                               "{} + '[%r]' % ({},)".format(loc, key), subtypes, counter)
+            else:
+                Emit(0, "if {}.__class__ is not dict:".format(var))
+                FailType('object')
+
+        elif kind == 'array':
+            Emit(0, "if {}.__class__ is not list:".format(var))
+            FailType('array')
+            if dtype.get('items'):
+                counter[0] += 1
+                index, item = 'i{}'.format(counter[0]), 'x{}'.format(counter[0])
+                Emit(0, "else:")
+                Emit(1, "for {}, {} in enumerate({}):".format(index, item, var))
+                self.EmitCheck(lines, indent + 2, dtype['items'], item,
+                               "{} + '[%d]' % {}".format(loc, index), subtypes, counter)
+
+        else:
+            raise NotImplementedError(str(dtype))
+
+    def AddEndpoint(self, schema: JSON):
+        """Generate the validators for all the top-level types of an endpoint."""
+        top, sub = GetMessages(schema)
+        validators = self.validators.setdefault(schema['name'], {})
+        for type_name, fields in sorted(top.items()):
+            validators[type_name] = self.ObjectFunction(fields, sub)
+
+    def Source(self) -> str:
+        """Return the source code of the generated module."""
+        oss = io.StringIO()
+        pr = lambda *args: print(*args, file=oss)
+        pr(_PRELUDE)
+        for source, name in self.constants.items():
+            if not name.startswith('_Dispatch'):
+                pr("{} = {}".format(name, source))
+        for chunk in self.chunks:
+            pr()
+            pr()
+            pr(chunk)
+        pr()
+        pr()
+        for source, name in self.constants.items():
+            if name.startswith('_Dispatch'):
+                pr("{} = {}".format(name, source))
+        pr()
+        pr()
+        pr("# Validators, by endpoint name and top-level type name.")
+        pr("VALIDATORS = {")
+        for endpoint_name, validators in sorted(self.validators.items()):
+            pr("    {!r}: {{".format(endpoint_name))
+            for type_name, func in sorted(validators.items()):
+                pr("        {!r}: {},".format(type_name, func))
+            pr("    },")
+        pr("}")
+        pr()
+        pr()
+        pr("def Validate(endpoint_name, type_name, value):")
+        pr('    """Validate a value. Return a list of (location, message) errors."""')
+        pr("    return VALIDATORS[endpoint_name][type_name](value) or []")
+        return oss.getvalue()
+
+
+def StripDescriptions(dtype: JSON) -> JSON:
+    """Remove the descriptions from a type tree, which don't affect validation."""
+    if isinstance(dtype, dict):
+        stripped = {}
+        for key, value in dtype.items():
+            if key == 'description':
+                continue
+            if key == 'properties':
+                # Field names themselves may be 'description'.
+                value = {field_name: StripDescriptions(ftype)
+                         for field_name, ftype in value.items()}
+            else:
+                value = StripDescriptions(value)
+            stripped[key] = value
+        return stripped
+    elif isinstance(dtype, list):
+        return [StripDescriptions(value) for value in dtype]
+    return dtype
+
+
+def GenerateValidators(schemas: Dict[str, JSON]) -> str:
+    """Generate the source of a module of validators for the given schemas."""
+    generator = ValidatorGenerator()
+    for _, schema in sorted(schemas.items()):
+        generator.AddEndpoint(schema)
+    return generator.Source()
+
+
+def CompileValidators(schemas: Dict[str, JSON]) -> Dict[str, Dict[str, Validator]]:
+    """Generate and compile the validators, without writing them out.
+
+    Returns a mapping of endpoint name to a mapping of top-level type name to
+    validator function.
+    """
+    source = GenerateValidators(schemas)
+    namespace = {}
+    exec(compile(source, '<generated validators>', 'exec'), namespace)
+    return namespace['VALIDATORS']
+
+
+def Benchmark(schemas: Dict[str, JSON], raw_dir: str, iterations: int):
+    """Compare the generated validators to the generic one on the examples."""
+    validators = CompileValidators(schemas)
+    total_generic = total_compiled = 0
+    print("{:40} {:>12} {:>12} {:>8}".format("Endpoint", "generic us", "compiled us", "speedup"))
+    for name, schema in sorted(schemas.items()):
+        filename = path.join(raw_dir, name, 'example.json')
+        if not path.exists(filename):
+            continue
+        examples = convert_ameritrade_schemas.ReadExample(filename)
+        examples = [(type_name, value) for type_name, value in sorted(examples.items())
+                    if type_name in validators[name]]
+        if not examples:
+            continue
+
+        # Check that both implementations agree before timing them.
+        for type_name, value in examples:
+            generic = ValidateGeneric(schema, type_name, value)
+            compiled = validators[name][type_name](value) or []
+            if generic != compiled:
+                raise ValueError("Validators disagree on {}.{}: {} != {}".format(
+                    name, type_name, generic, compiled))
+            for loc, message in generic:
+                logging.warning("%s.%s%s: %s", name, type_name, loc, message)
+
+        def RunGeneric():
+            for type_name, value in examples:
+                ValidateGeneric(schema, type_name, value)
+        def RunCompiled():
+            for type_name, value in examples:
+                validators[name][type_name](value)
+        time_generic = timeit.timeit(RunGeneric, number=iterations) / iterations
+        time_compiled = timeit.timeit(RunCompiled, number=iterations) / iterations
+        total_generic += time_generic
+        total_compiled += time_compiled
+        print("{:40} {:12.1f} {:12.1f} {:7.1f}x".format(
+            name, time_generic * 1e6, time_compiled * 1e6, time_generic / time_compiled))
+    print("{:40} {:12.1f} {:12.1f} {:7.1f}x".format(
+        "Total", total_generic * 1e6, total_compiled * 1e6, total_generic / total_compiled))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--output', action='store',
+                        help="Python module to write the validators to (default: stdout).")
+    parser.add_argument('--benchmark', action='store_true',
+                        help=("Benchmark the generated validators against the generic "
+                              "validator on the examples instead."))
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples from, for the benchmark.")
+    parser.add_argument('--iterations', action='store', type=int, default=2000,
+                        help="Number of iterations for the benchmark.")
+    args = parser.parse_args()
+
+    schemas = ReadSchemas(args.clean_schemas)
+    if args.benchmark:
+        Benchmark(schemas, args.raw_downloaded_data, args.iterations)
+        return
+
+    source = GenerateValidators(schemas)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(source)
+    else:
+        print(source, end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""Serve a local copy of the API documentation pages, rendered from raw/.
+
+The pages have the structure read by the scraper: a listing of the categories,
+a listing of the endpoints of each category, and a page per endpoint with its
+example and schema, error codes and query parameters. They are rendered on the
+server, so the scraper can read them with --static, without a browser or the
+network:
+
+    ./scripts/local_doc_site.py --port 8000 &
+    ./scripts/scrape_ameritrade_api.py --static --root_url http://localhost:8000/apis/
+
+With --check, the site is served in-process and scraped with one and several
+sessions, with a cold and a warm cache, and the scraped files are compared to
+the raw downloads they were rendered from.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, List
+import argparse
+import collections
+import filecmp
+import functools
+import html
+import http.server
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import scrape_ameritrade_api
+
+
+# Raw downloads scraped from the site.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'raw')
+
+
+_PAGE = '''<!DOCTYPE html>
+<html>
+<head><title>{title}</title></head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+'''
+
+_ROW = '''<div class="views-row">
+  <div class="method">{method}</div>
+  <div class="title"><a href="{link}">{title}</a></div>
+  <div class="url">{url}</div>
+</div>
+'''
+
+
+def ReadFile(filename: str) -> str:
+    with open(filename) as infile:
+        return infile.read()
+
+
+def Category(url: str) -> str:
+    """Return a category name for an endpoint URL, from its first path segment."""
+    return url.split('/v1/')[1].split('/')[0].capitalize()
+
+
+def RenderEndpoint(root: str, endpoint: Dict[str, object]) -> str:
+    """Render the page of an endpoint directory."""
+    escape = html.escape
+    parts = []
+    example = ReadFile(path.join(root, 'example.json'))
+    for filename, example_attr, schema_attr in [
+            ('request.json', 'class="payload_text"', 'class="payload_text_schema"'),
+            ('response.json', 'id="response_body_example"', 'id="response_body_schema"')]:
+        filename = path.join(root, filename)
+        if path.exists(filename):
+            parts.append('<textarea {}>{}</textarea>'.format(example_attr, escape(example)))
+            parts.append('<textarea {}>{}</textarea>'.format(
+                schema_attr, escape(ReadFile(filename))))
+
+    if endpoint['query_params']:
+        parts.append('<div id="queryTable"><table>')
+        parts.append('<tr><th>Parameter</th><th>Type</th><th>Description</th></tr>')
+        for name, param in sorted(endpoint['query_params'].items()):
+            parts.append('<tr><td>{}{}</td><td>string</td><td>{}</td></tr>'.format(
+                escape(name), ' (required)' if param['required'] else '',
+                escape(param['description']).replace('\n', '<br>')))
+        parts.append('</table></div>')
+
+    parts.append('<table class="table-error-codes">')
+    errcodes = json.loads(ReadFile(path.join(root, 'errcodes.json')))
+    for code, message in sorted(errcodes.items()):
+        parts.append('<tr class="listErrorCodes"><td>{}</td><td>{}</td></tr>'.format(
+            code, escape(message).replace('\n', '<br>')))
+    parts.append('</table>')
+    return _PAGE.format(title=escape(path.basename(root)), body='\n'.join(parts))
+
+
+def RenderSite(raw_dir: str, site_dir: str) -> int:
+    """Render the pages of the raw downloads under a directory. Return their number."""
+    categories = collections.defaultdict(list)
+    for root in sorted(os.listdir(raw_dir)):
+        dirname = path.join(raw_dir, root)
+        if not path.exists(path.join(dirname, 'endpoint.json')):
+            continue
+        endpoint = json.loads(ReadFile(path.join(dirname, 'endpoint.json')))
+        categories[Category(endpoint['url'])].append((root, endpoint))
+        page = RenderEndpoint(dirname, endpoint)
+        os.makedirs(path.join(site_dir, 'apis', 'endpoints'), exist_ok=True)
+        with open(path.join(site_dir, 'apis', 'endpoints', root + '.html'), 'w') as outfile:
+            outfile.write(page)
+
+    rows = []
+    for category, endpoints in sorted(categories.items()):
+        rows.append('<div class="views-row"><a href="{0}.html">{0}</a></div>'.format(category))
+        page = _PAGE.format(title=category, body=''.join(
+            _ROW.format(method=endpoint['method'], title=name,
+                        link='endpoints/{}.html'.format(name),
+                        url=html.escape(endpoint['url']))
+            for name, endpoint in endpoints))
+        with open(path.join(site_dir, 'apis', category + '.html'), 'w') as outfile:
+            outfile.write(page)
+    page = _PAGE.format(title='APIs', body='<div class="view-smartdocs-models">{}</div>'.format(
+        ''.join(rows)))
+    with open(path.join(site_dir, 'apis', 'index.html'), 'w') as outfile:
+        outfile.write(page)
+    return sum(len(endpoints) for endpoints in categories.values())
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    """Serve the files of the site, after a delay, without logging."""
+
+    def __init__(self, *args, delay: float = 0, **kwargs):
+        self.delay = delay
+        super().__init__(*args, **kwargs)
+
+    def send_head(self):
+        if self.delay:
+            time.sleep(self.delay)
+        return super().send_head()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def Serve(site_dir: str, port: int, delay: float = 0) -> http.server.ThreadingHTTPServer:
+    """Start serving a site in a thread. Return the server.
+
+    The `delay` is added to the processing of each request, to simulate the
+    latency of the site.
+    """
+    handler = functools.partial(_Handler, directory=site_dir, delay=delay)
+    server = http.server.ThreadingHTTPServer(('localhost', port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# The files written by the scraper as formatted JSON, compared by value: some of
+# the raw downloads were edited by hand.
+_JSON_FILES = {'endpoint.json', 'errcodes.json'}
+
+
+def CompareTrees(raw_dir: str, output_dir: str) -> List[str]:
+    """Return the files of the endpoint directories which differ."""
+    differing = []
+    for root in sorted(os.listdir(raw_dir)):
+        if not path.exists(path.join(raw_dir, root, 'endpoint.json')):
+            continue
+        output_root = path.join(output_dir, root)
+        names = set(os.listdir(path.join(raw_dir, root)))
+        if path.exists(output_root):
+            names.update(os.listdir(output_root))
+        for name in sorted(names):
+            filenames = [path.join(raw_dir, root, name), path.join(output_root, name)]
+            if not all(path.exists(filename) for filename in filenames):
+                equal = False
+            elif name in _JSON_FILES:
+                equal = json.loads(ReadFile(filenames[0])) == json.loads(ReadFile(filenames[1]))
+            else:
+                equal = filecmp.cmp(*filenames, shallow=False)
+            if not equal:
+                differing.append(path.join(root, name))
+    return differing
+
+
+def Check(raw_dir: str, jobs: int, delay: float) -> bool:
+    """Scrape a local copy of the site and compare with the raw downloads."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        site_dir = path.join(tmpdir, 'site')
+        num_pages = RenderSite(raw_dir, site_dir)
+        server = Serve(site_dir, 0, delay)
+        root_url = 'http://localhost:{}/apis/index.html'.format(server.server_address[1])
+        logging.info("Serving %d endpoint pages at %s, with %.0f ms of latency",
+                     num_pages, root_url, delay * 1e3)
+
+        # Silence the logging of each file and page.
+        logging.getLogger().setLevel(logging.WARNING)
+        ok = True
+        print("{:>6} {:>8} {:>8} {:>10}".format("jobs", "cache", "cached", "s"))
+        for run_jobs, cache in [(1, None), (jobs, None), (jobs, 'cold'), (jobs, 'warm')]:
+            output_dir = path.join(tmpdir, 'raw-{}-{}'.format(run_jobs, cache))
+            start = time.perf_counter()
+            _, num_cached = scrape_ameritrade_api.Scrape(
+                output_dir, scrape_ameritrade_api.StaticSession, run_jobs,
+                path.join(tmpdir, 'cache') if cache else None, root_url)
+            elapsed = time.perf_counter() - start
+            print("{:6} {:>8} {:8} {:10.3f}".format(run_jobs, cache or '-', num_cached, elapsed))
+            differing = CompareTrees(raw_dir, output_dir)
+            if differing:
+                logging.error("Scraped files differ from the raw downloads: %s", differing)
+                ok = False
+        server.shutdown()
+        return ok
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the raw downloaded data from.")
+    parser.add_argument('--site_dir', action='store',
+                        help="Directory to render the site to. Defaults to a temporary one.")
+    parser.add_argument('--port', action='store', type=int, default=8000,
+                        help="Port to serve the site on.")
+    parser.add_argument('--delay', action='store', type=float, default=0,
+                        help="Latency added to each request, in seconds.")
+    parser.add_argument('--check', action='store_true',
+                        help="Scrape the site and compare with the raw downloads.")
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=4,
+                        help="Number of concurrent sessions of the check.")
+    args = parser.parse_args()
+
+    if args.check:
+        if not Check(args.raw_downloaded_data, args.jobs, args.delay or 0.05):
+            raise SystemExit(1)
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        site_dir = args.site_dir or tmpdir
+        num_pages = RenderSite(args.raw_downloaded_data, site_dir)
+        server = Serve(site_dir, args.port, args.delay)
+        logging.info("Serving %d endpoint pages at http://localhost:%d/apis/index.html",
+                     num_pages, server.server_address[1])
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+"""A mock of the TD Ameritrade API, serving all the endpoints of the schemas.
+
+The requests are routed to their endpoints by method and URL, with the trie of
+url_router. The endpoints with a response reply with the valid example payload
+of their top-level type from raw/*/example.json, or with a payload generated
+from the schema where the example is missing or invalid (or with --generated).
+The endpoints without one reply with an empty body. The bodies of the quotes
+and instrument searches are mappings of the requested symbols to the payload.
+
+Faults are injected at a configurable rate, globally or per endpoint: the
+faulty requests fail with one of the documented error codes of their endpoint,
+drawn at random. With a rate limit, the requests beyond it fail with 429, like
+those beyond the quota of the API.
+
+The server is a bare asyncio protocol speaking HTTP/1.1 with keep-alive and
+pipelining. The responses are encoded once on startup. It measures the time it
+takes to handle each request, and logs the latency percentiles periodically;
+GET /__stats returns them in JSON. See --benchmark for its throughput under a
+load of pipelined requests.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import collections
+import http
+import json
+import logging
+import multiprocessing
+import random
+import re
+import time
+import urllib.parse
+
+import generate_validators
+import transcode_proto
+import url_router
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+# The path of the statistics of the server.
+STATS_PATH = '/__stats'
+
+# The top-level types of the payloads of the endpoints with several, where the
+# first isn't the most common one.
+PAYLOAD_TYPES = {
+    'GetInstrument': 'Instrument',
+    'GetOptionChain': 'OptionChain',
+    'GetQuote': 'Equity',
+    'GetQuotes': 'Equity',
+    'SearchInstruments': 'Instrument',
+}
+
+# The endpoints replying with an array of their top-level type.
+ARRAY_RESPONSES = {
+    'GetAccounts',
+    'GetInstrument',
+    'GetMovers',
+    'GetOrdersByPath',
+    'GetOrdersByQuery',
+    'GetSavedOrdersbyPath',
+    'GetTransactions',
+    'GetWatchlistsForMultipleAccounts',
+    'GetWatchlistsForSingleAccount',
+}
+
+# The endpoints replying with a mapping of the requested symbols to their
+# top-level type, and the parameter listing the symbols, from the URL or query.
+SYMBOL_RESPONSES = {
+    'GetQuote': 'symbol',
+    'GetQuotes': 'symbol',
+    'SearchInstruments': 'symbol',
+}
+
+# The maximum nesting depth of the generated payloads, for the recursive types,
+# e.g. the child orders of orders.
+MAX_DEPTH = 8
+
+# The number of buckets of the histogram of latencies, of a microsecond each.
+# The last one holds the latencies over its size.
+HISTOGRAM_SIZE = 100000
+
+# The percentiles reported.
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def SampleValue(dtype: JSON, subtypes: Dict[str, JSON], depth: int = 0) -> JSON:
+    """Generate a value of a type, with the first enum values and empty strings.
+
+    The objects with a discriminator have the fields of the subtype of its
+    first value.
+    """
+    kind = dtype.get('type')
+    if kind == 'object':
+        fields = dtype.get('properties') or {}
+        value = {}
+        if 'discriminator' in dtype:
+            dispatch = generate_validators.DiscriminatorSubtypes(dtype, subtypes)
+            if dispatch:
+                disc_value, fields = next(iter(dispatch.items()))
+                value[dtype['discriminator']] = disc_value
+        if depth < MAX_DEPTH:
+            for field_name, ftype in sorted(fields.items()):
+                value.setdefault(field_name, SampleValue(ftype, subtypes, depth + 1))
+        return value
+    elif kind == 'array':
+        if depth >= MAX_DEPTH or not dtype.get('items'):
+            return []
+        return [SampleValue(dtype['items'], subtypes, depth + 1)]
+    elif kind == 'string':
+        return dtype['enum'][0] if dtype.get('enum') else 'string'
+    elif kind == 'integer':
+        return 0
+    elif kind == 'number':
+        return 0.0
+    elif kind == 'boolean':
+        return False
+    raise NotImplementedError(str(dtype))
+
+
+def Payloads(schemas: Dict[str, JSON], raw_dir: str,
+             generated: bool = False) -> Dict[str, JSON]:
+    """Return the payloads of the endpoints with a response, by name.
+
+    The valid examples are used unless `generated` is true.
+    """
+    examples = {}
+    if not generated:
+        for name, type_name, value in transcode_proto.IterExamples(schemas, raw_dir):
+            examples[(name, type_name)] = value
+    payloads = {}
+    for name, schema in sorted(schemas.items()):
+        if 'response' not in schema:
+            continue
+        top, sub = generate_validators.GetMessages(schema)
+        if not top:
+            continue
+        type_name = PAYLOAD_TYPES.get(name, next(iter(top)))
+        value = examples.get((name, type_name))
+        if value is None:
+            value = SampleValue({'type': 'object', 'properties': top[type_name]}, sub)
+        payloads[name] = value
+    return payloads
+
+
+def EncodeResponse(status: int, body: bytes = b'', close: bool = False) -> bytes:
+    """Encode a complete HTTP response."""
+    headers = ["HTTP/1.1 {} {}".format(status, http.HTTPStatus(status).phrase),
+               "Content-Type: application/json",
+               "Content-Length: {}".format(len(body))]
+    if close:
+        headers.append("Connection: close")
+    return '\r\n'.join(headers).encode('ascii') + b'\r\n\r\n' + body
+
+
+def EncodeJson(value: JSON) -> bytes:
+    return json.dumps(value, separators=(',', ':')).encode('utf8')
+
+
+class LatencyHistogram:
+    """A histogram of latencies in microseconds, with cheap updates."""
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_SIZE
+        # The counts at the last interval report.
+        self.previous = list(self.counts)
+
+    def Percentiles(self, counts: Optional[List[int]] = None) -> Dict[str, float]:
+        """Return the count and percentiles of the latencies, in microseconds."""
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        result = {'count': total}
+        if not total:
+            return result
+        targets = [(percentile, total * percentile / 100) for percentile in PERCENTILES]
+        cumulative = 0
+        for micros, count in enumerate(counts):
+            if not count:
+                continue
+            cumulative += count
+            while targets and cumulative >= targets[0][1]:
+                result['p{}'.format(targets.pop(0)[0])] = micros
+            maximum = micros
+        result['max'] = maximum
+        return result
+
+    def Interval(self) -> Dict[str, float]:
+        """Return the count and percentiles since the last interval."""
+        current = list(self.counts)
+        counts = [now - before for now, before in zip(current, self.previous)]
+        self.previous = current
+        return self.Percentiles(counts)
+
+
+class MockApi:
+    """The handler of the requests, returning prepared responses.
+
+    The responses are sent after `delay` seconds, to simulate the latency of the
+    network and of the real API. The requests are admitted at `rate_limit` per
+    second at most, with bursts of a second of requests, if set.
+    """
+
+    def __init__(self, schemas: Dict[str, JSON], payloads: Dict[str, JSON],
+                 fault_rate: float = 0, fault_rates: Optional[Dict[str, float]] = None,
+                 seed: int = 0, delay: float = 0, rate_limit: float = 0):
+        self.router = url_router.UrlRouter(schemas)
+        self.delay = delay
+        self.rate_limit = rate_limit
+        self.tokens = rate_limit
+        self.refilled = time.monotonic()
+        self.throttled = collections.Counter()
+        self.random = random.Random(seed).random
+        self.choice = random.Random(seed + 1).choice
+        self.histogram = LatencyHistogram()
+        self.requests = collections.Counter()
+        self.faults = collections.Counter()
+
+        # The complete responses, and for the mappings by symbol, the encoded
+        # payloads of the symbols.
+        self.responses: Dict[str, bytes] = {}
+        self.symbol_payloads: Dict[str, bytes] = {}
+        for name, schema in schemas.items():
+            payload = payloads.get(name)
+            if payload is None:
+                self.responses[name] = EncodeResponse(201 if schema['method'] == 'POST' else 200)
+            elif name in SYMBOL_RESPONSES:
+                self.symbol_payloads[name] = EncodeJson(payload)
+            else:
+                self.responses[name] = EncodeResponse(200, EncodeJson(
+                    [payload] if name in ARRAY_RESPONSES else payload))
+        self.not_found = EncodeResponse(404, EncodeJson({'error': "Not Found"}))
+        self.too_many_requests = EncodeResponse(429, EncodeJson({'error': "Too Many Requests"}))
+
+        # The rates and error responses of the faults.
+        fault_rates = fault_rates or {}
+        self.fault_rates = {name: fault_rates.get(name, fault_rate) for name in schemas}
+        self.errors: Dict[str, List[bytes]] = {}
+        for name, schema in schemas.items():
+            self.errors[name] = [EncodeResponse(int(code), EncodeJson({'error': message}))
+                                 for code, message in sorted(schema['errors'].items())
+                                 if int(code) >= 400]
+
+    def Handle(self, method: str, target: str) -> bytes:
+        """Return the response to a request."""
+        start = time.perf_counter_ns()
+        url, _, query = target.partition('?')
+        match = self.router.Match(method, url)
+        if match is not None:
+            name, params = match
+            self.requests[name] += 1
+            rate = self.fault_rates[name]
+            if self.rate_limit and not self.Admit():
+                self.throttled[name] += 1
+                response = self.too_many_requests
+            elif rate and self.random() < rate and self.errors[name]:
+                self.faults[name] += 1
+                response = self.choice(self.errors[name])
+            else:
+                response = self.responses.get(name)
+                if response is None:
+                    response = self.SymbolResponse(name, params, query)
+        elif method == 'GET' and url == STATS_PATH:
+            response = EncodeResponse(200, EncodeJson(self.Stats()))
+        else:
+            response = self.not_found
+        micros = (time.perf_counter_ns() - start) // 1000
+        self.histogram.counts[micros if micros < HISTOGRAM_SIZE else -1] += 1
+        return response
+
+    def Admit(self) -> bool:
+        """Take a token of the rate limit, if any is left."""
+        now = time.monotonic()
+        self.tokens = min(self.rate_limit,
+                          self.tokens + (now - self.refilled) * self.rate_limit)
+        self.refilled = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def SymbolResponse(self, name: str, params: Dict[str, Any], query: str) -> bytes:
+        """Return the response mapping the requested symbols to the payload."""
+        param_name = SYMBOL_RESPONSES[name]
+        symbols = params.get(param_name)
+        if symbols is None:
+            symbols = urllib.parse.parse_qs(query).get(param_name, [''])[0]
+        payload = self.symbol_payloads[name]
+        body = b'{' + b','.join(
+            EncodeJson(symbol) + b':' + payload
+            for symbol in symbols.split(',') if symbol) + b'}'
+        return EncodeResponse(200, body)
+
+    def Stats(self) -> Dict[str, Any]:
+        """Return the statistics of the server, with the latencies in microseconds."""
+        return {'latency': self.histogram.Percentiles(),
+                'requests': dict(sorted(self.requests.items())),
+                'faults': dict(sorted(self.faults.items())),
+                'throttled': dict(sorted(self.throttled.items()))}
+
+
+class HttpProtocol(asyncio.Protocol):
+    """A minimal HTTP/1.1 server connection, with keep-alive and pipelining.
+
+    The responses to all the requests of the data received are written at once.
+    """
+
+    def __init__(self, api: MockApi):
+        self.api = api
+        self.transport = None
+        self.buffer = b''
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def data_received(self, data: bytes):
+        buffer = self.buffer + data if self.buffer else data
+        responses = []
+        close = False
+        index = 0
+        while True:
+            end = buffer.find(b'\r\n\r\n', index)
+            if end < 0:
+                break
+            head = buffer[index:end]
+            body_end = end + 4
+            lower = head.lower()
+            length_index = lower.find(b'\r\ncontent-length:')
+            if length_index >= 0:
+                line_end = lower.find(b'\r\n', length_index + 2)
+                try:
+                    length = int(head[length_index + 17:line_end if line_end >= 0 else None])
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    responses.append(EncodeResponse(400, close=True))
+                    close = True
+                    break
+                body_end += length
+                if body_end > len(buffer):
+                    break
+            line_end = head.find(b'\r\n')
+            try:
+                method, target, version = head[:line_end if line_end >= 0 else None].split(b' ')
+                method = method.decode('ascii')
+            except (ValueError, UnicodeDecodeError):
+                responses.append(EncodeResponse(400, close=True))
+                close = True
+                break
+            responses.append(self.api.Handle(method, target.decode('latin-1')))
+            index = body_end
+            if b'\r\nconnection: close' in lower or version == b'HTTP/1.0':
+                close = True
+                break
+        self.buffer = buffer[index:]
+        if not responses and not close:
+            return
+        if self.api.delay:
+            asyncio.get_running_loop().call_later(
+                self.api.delay, self.Write, b''.join(responses), close)
+        else:
+            self.Write(b''.join(responses), close)
+
+    def Write(self, data: bytes, close: bool):
+        if self.transport.is_closing():
+            return
+        if data:
+            self.transport.write(data)
+        if close:
+            self.transport.close()
+
+
+async def ReportStats(api: MockApi, interval: float):
+    """Log the latency percentiles of the intervals with requests."""
+    while True:
+        await asyncio.sleep(interval)
+        stats = api.histogram.Interval()
+        if stats['count']:
+            logging.info("%d requests, %.0f/s; latency us: %s", stats['count'],
+                         stats['count'] / interval,
+                         ' '.join('{}={}'.format(key, value)
+                                  for key, value in stats.items() if key != 'count'))
+
+
+async def Serve(api: MockApi, host: str, port: int, report_interval: float,
+                ready: Optional[Any] = None):
+    """Serve the mock API forever."""
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: HttpProtocol(api), host, port,
+                                      reuse_address=True, backlog=1024)
+    logging.info("Serving %d endpoints on http://%s:%d", len(api.fault_rates), host,
+                 server.sockets[0].getsockname()[1])
+    if ready is not None:
+        ready.set()
+    if report_interval:
+        loop.create_task(ReportStats(api, report_interval))
+    async with server:
+        await server.serve_forever()
+
+
+def CreateApi(schemas_dir: str, raw_dir: str, generated: bool = False,
+              fault_rate: float = 0, fault_rates: Optional[Dict[str, float]] = None,
+              seed: int = 0, delay: float = 0, rate_limit: float = 0) -> MockApi:
+    """Create the mock API of the schemas of a directory."""
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING)
+    schemas = generate_validators.ReadSchemas(schemas_dir)
+    payloads = Payloads(schemas, raw_dir, generated)
+    logging.getLogger().setLevel(level)
+    return MockApi(schemas, payloads, fault_rate, fault_rates, seed, delay, rate_limit)
+
+
+#-------------------------------------------------------------------------------
+# Load generator and benchmark.
+
+
+class LoadProtocol(asyncio.Protocol):
+    """A client connection keeping `depth` pipelined requests in flight.
+
+    This only parses the responses of the mock server.
+    """
+
+    def __init__(self, requests: List[bytes], depth: int, deadline: float,
+                 latencies: List[float], done: asyncio.Future):
+        self.requests = requests
+        self.depth = depth
+        self.deadline = deadline
+        self.latencies = latencies
+        self.done = done
+        self.index = random.randrange(len(requests))
+        self.sent = collections.deque()
+        self.buffer = b''
+        self.statuses = collections.Counter()
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.Send(self.depth)
+
+    def Send(self, count: int):
+        now = time.perf_counter()
+        requests = []
+        for _ in range(count):
+            requests.append(self.requests[self.index])
+            self.index = (self.index + 1) % len(self.requests)
+            self.sent.append(now)
+        self.transport.write(b''.join(requests))
+
+    def data_received(self, data: bytes):
+        buffer = self.buffer + data if self.buffer else data
+        index = 0
+        received = 0
+        now = time.perf_counter()
+        while True:
+            end = buffer.find(b'\r\n\r\n', index)
+            if end < 0:
+                break
+            length_index = buffer.find(b'\r\nContent-Length: ', index, end)
+            line_end = buffer.find(b'\r\n', length_index + 2)
+            body_end = end + 4 + int(buffer[length_index + 18:line_end])
+            if body_end > len(buffer):
+                break
+            self.statuses[buffer[index + 9:index + 12]] += 1
+            self.latencies.append(now - self.sent.popleft())
+            received += 1
+            index = body_end
+        self.buffer = buffer[index:]
+        if now < self.deadline:
+            if received:
+                self.Send(received)
+        elif not self.sent:
+            self.transport.close()
+
+    def connection_lost(self, exc: Optional[Exception]):
+        if not self.done.done():
+            self.done.set_result(self.statuses)
+
+
+def BenchmarkRequests(schemas: Dict[str, JSON], count: int) -> List[bytes]:
+    """Encode a mix of requests, from that of the url_router benchmark."""
+    requests = []
+    for name, method, url in url_router.BenchmarkRequests(schemas, count):
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path + ('?' + parts.query if parts.query else '')
+        if 'symbol' in schemas[name]['query_params']:
+            target += '&symbol=AAPL,MSFT' if parts.query else '?symbol=AAPL,MSFT'
+        body = b'{}' if method in ('POST', 'PUT', 'PATCH') else b''
+        head = "{} {} HTTP/1.1\r\nHost: localhost\r\n".format(method, target)
+        if body:
+            head += "Content-Type: application/json\r\nContent-Length: {}\r\n".format(len(body))
+        requests.append(head.encode('latin-1') + b'\r\n' + body)
+    return requests
+
+
+async def RunLoad(host: str, port: int, requests: List[bytes], connections: int,
+                  depth: int, duration: float) -> Tuple[List[float], collections.Counter]:
+    """Load a server for a duration. Return the latencies and counts of statuses."""
+    loop = asyncio.get_running_loop()
+    deadline = time.perf_counter() + duration
+    latencies = []
+    futures = []
+    for _ in range(connections):
+        done = loop.create_future()
+        await loop.create_connection(
+            lambda: LoadProtocol(requests, depth, deadline, latencies, done), host, port)
+        futures.append(done)
+    statuses = collections.Counter()
+    for counts in await asyncio.gather(*futures):
+        statuses.update(counts)
+    return latencies, statuses
+
+
+async def FetchStats(host: str, port: int) -> Dict[str, Any]:
+    """Fetch the statistics of a mock server."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".format(
+        STATS_PATH).encode('ascii'))
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.partition(b'\r\n\r\n')[2])
+
+
+def _RunServer(schemas_dir: str, raw_dir: str, port: int, fault_rate: float, ready,
+               delay: float = 0, rate_limit: float = 0):
+    api = CreateApi(schemas_dir, raw_dir, fault_rate=fault_rate, delay=delay,
+                    rate_limit=rate_limit)
+    asyncio.run(Serve(api, '127.0.0.1', port, 0, ready))
+
+
+def Benchmark(schemas_dir: str, raw_dir: str, port: int, connections: int, duration: float,
+              fault_rate: float):
+    """Measure the throughput and latencies of the server, from another process.
+
+    The load is the mix of requests of the url_router benchmark, from
+    `connections` connections with 1 or 16 requests in flight each.
+    """
+    schemas = generate_validators.ReadSchemas(schemas_dir)
+    requests = BenchmarkRequests(schemas, 10000)
+    print("{:>6} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "conns", "depth", "requests", "req/s", "client p50", "p99",
+        "server p50", "p99", "p99.9"))
+    for depth in 1, 16:
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(
+            target=_RunServer, args=(schemas_dir, raw_dir, port, fault_rate, ready))
+        server.start()
+        ready.wait()
+        try:
+            start = time.perf_counter()
+            latencies, statuses = asyncio.run(
+                RunLoad('127.0.0.1', port, requests, connections, depth, duration))
+            elapsed = time.perf_counter() - start
+            stats = asyncio.run(FetchStats('127.0.0.1', port))['latency']
+        finally:
+            server.terminate()
+            server.join()
+        latencies.sort()
+        count = len(latencies)
+        print("{:6} {:6} {:10} {:10.0f} {:8.2f}ms {:8.2f}ms {:8}us {:8}us {:8}us".format(
+            connections, depth, count, count / elapsed,
+            latencies[count // 2] * 1e3, latencies[int(count * 0.99)] * 1e3,
+            stats['p50'], stats['p99'], stats['p99.9']))
+        logging.info("Statuses: %s", dict(sorted(
+            (status.decode('ascii'), number) for status, number in statuses.items())))
+
+
+def ParseFaultRates(specs: List[str]) -> Dict[str, float]:
+    """Parse the per-endpoint fault rates, e.g. 'GetQuotes=0.1'."""
+    rates = {}
+    for spec in specs:
+        match = re.fullmatch(r"(\w+)=([0-9.]+)", spec)
+        if not match:
+            raise ValueError("Invalid fault rate: {}".format(spec))
+        rates[match.group(1)] = float(match.group(2))
+    return rates
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples from.")
+    parser.add_argument('--host', action='store', default='127.0.0.1',
+                        help="Address to listen on.")
+    parser.add_argument('--port', action='store', type=int, default=8080,
+                        help="Port to listen on.")
+    parser.add_argument('--generated', action='store_true',
+                        help="Serve payloads generated from the schemas, not the examples.")
+    parser.add_argument('--fault_rate', action='store', type=float, default=0,
+                        help="Fraction of the requests failing with a documented error.")
+    parser.add_argument('--fault', action='append', default=[],
+                        help="Fault rate of an endpoint, e.g. GetQuotes=0.1. Repeatable.")
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help="Seed of the random draws of the faults.")
+    parser.add_argument('--delay', action='store', type=float, default=0,
+                        help="Latency added to each response, in seconds.")
+    parser.add_argument('--rate_limit', action='store', type=float, default=0,
+                        help="Maximum number of requests per second, beyond which they fail "
+                        "with 429.")
+    parser.add_argument('--report_interval', action='store', type=float, default=10,
+                        help="Interval between the logs of the latencies, in seconds.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Measure the throughput and latencies under load.")
+    parser.add_argument('--benchmark_connections', action='store', type=int, default=32,
+                        help="Number of connections of the benchmark.")
+    parser.add_argument('--benchmark_duration', action='store', type=float, default=5,
+                        help="Duration of each run of the benchmark, in seconds.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.raw_downloaded_data, args.port,
+                  args.benchmark_connections, args.benchmark_duration, args.fault_rate)
+        return
+
+    api = CreateApi(args.clean_schemas, args.raw_downloaded_data, args.generated,
+                    args.fault_rate, ParseFaultRates(args.fault), args.seed, args.delay,
+                    args.rate_limit)
+    try:
+        asyncio.run(Serve(api, args.host, args.port, args.report_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
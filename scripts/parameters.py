@@ -5,6 +5,8 @@ both of which do not have type definitions. Unfortunately, these were created
 manually and are pulled in by the convert_ameritrade_schemas script.
 """
 
+import re
+
 # Type definitions for all the known URL params, key'ed by parameter name.
 URL_PARAM_TYPES = {
     'accountId': {
@@ -143,13 +145,8 @@ QUERY_PARAM_TYPES = {
             }})
     ],
     "frequency": {
-        "enum": [
-            "minute",
-            "daily",
-            "weekly",
-            "monthly",
-        ],
-        "type": "string",
+        "format": "int32",
+        "type": "integer",
     },
     "frequencyType": {
         "enum": [
@@ -160,15 +157,13 @@ QUERY_PARAM_TYPES = {
         ],
         "type": "string",
     },
-    "fromDate": [
-        ("yyyy-MM-dd\"T\"HH:mm:ssz", {
-            "format": "date-time",
-            "type": "string",
-        }),
-        ("Date must be within 60 days", {
-            "type": "string"
-        })
-    ],
+    "fromDate": {
+        "format": "date-time",
+        "type": "string",
+    },
+    "fromEnteredTime": {
+        "type": "string",
+    },
     "includeQuotes": {
         "type": "boolean"
     },
@@ -328,3 +323,19 @@ QUERY_PARAM_TYPES = {
         "type": "number"
     },
 }
+
+
+def QueryParamType(name: str, description: str) -> dict:
+    """Return the type of a query parameter of an endpoint.
+
+    The parameters with many types are resolved with the first regexp matching
+    their description.
+    """
+    dtype = QUERY_PARAM_TYPES[name]
+    if isinstance(dtype, dict):
+        return dtype
+    for regexp, alt_dtype in dtype:
+        if re.search(regexp, description):
+            return alt_dtype
+    raise ValueError("No type for query parameter '{}' with description: {}".format(
+        name, description))
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""A scheduler of the requests to the API, within its rate limit, by priority.
+
+The API limits the number of requests per account, and the bulk jobs, e.g. the
+backfills of transactions and sweeps of price histories, would use all of it,
+delaying the orders. The scheduler admits the requests with a token bucket of
+`rate` requests per second, in order of the priority class of their endpoint,
+derived from its method and URL in the catalogue by PRIORITY_RULES:
+
+    order        PlaceOrder, ReplaceOrder, CancelOrder
+    interactive  the other endpoints
+    bulk         GetTransactions, GetPriceHistory
+
+Within a class, the requests are admitted by earliest deadline. The requests not
+admitted by their deadline, from the timeout of their class or call, fail with
+DeadlineExceeded without being sent. The classes after the first one leave
+`reserve` tokens in the bucket, so that an order is sent as soon as it arrives,
+even behind a saturating bulk load.
+
+A response with status 429 halves the rate, down to a minimum, empties the
+bucket, and pauses the admissions for its Retry-After header or a token's
+interval; its request is requeued with its deadline. The successful responses
+increase the rate back to its configured value, additively.
+
+    scheduler = request_scheduler.Scheduler(schemas, rate=2)
+    client = request_scheduler.SchedulingClient(ameritrade_client.Client(...), scheduler)
+    await client.PlaceOrder(account_id, order, timeout=1.0)
+
+The `timeout` keyword of the calls is the scheduler's. See --list for the classes
+of the endpoints, and --benchmark for the latencies of orders under a
+saturating bulk load, from the mock server with a rate limit.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import math
+import multiprocessing
+import re
+import time
+
+import generate_client
+import generate_validators
+import mock_server
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples served by the mock server of the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+# The priority classes, from the most urgent.
+ORDER, INTERACTIVE, BULK = range(3)
+CLASS_NAMES = ['order', 'interactive', 'bulk']
+
+# The priority classes of the endpoints, by the first pair of regexps matching
+# their method and URL. The others are interactive.
+PRIORITY_RULES = [
+    # The orders placed, replaced and cancelled, not their queries.
+    (r"POST|PUT|DELETE", r"/accounts/\{accountId\}/orders(/\{orderId\})?$", ORDER),
+    # The lists of transactions and price histories, requested in bulk.
+    (r"GET", r"/accounts/\{accountId\}/transactions$", BULK),
+    (r"GET", r"/pricehistory$", BULK),
+]
+
+# The default time to wait for the admission of the requests of each class, in
+# seconds. The bulk requests wait indefinitely.
+DEFAULT_TIMEOUTS = [5.0, 30.0, None]
+
+# The default rate of the requests, per second: the API allows 120 per minute.
+DEFAULT_RATE = 2.0
+
+# The default number of tokens left for the orders by the other classes.
+DEFAULT_RESERVE = 1
+
+# The default number of times a request failing with 429 is requeued.
+DEFAULT_RETRIES = 3
+
+# The increase of the rate after each successful response, as a fraction of the
+# configured rate.
+RATE_INCREASE = 0.01
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """A request not admitted by its deadline."""
+
+
+def DefaultPriorities(schemas: Dict[str, JSON]) -> Dict[str, int]:
+    """Return the priority classes of the endpoints, from PRIORITY_RULES."""
+    priorities = {}
+    for name, schema in sorted(schemas.items()):
+        priorities[name] = INTERACTIVE
+        for method_regexp, url_regexp, priority in PRIORITY_RULES:
+            if (re.fullmatch(method_regexp, schema['method']) and
+                re.search(url_regexp, schema['url'])):
+                priorities[name] = priority
+                break
+    return priorities
+
+
+def RetryAfter(exc: Exception) -> Optional[float]:
+    """Return the delay of the Retry-After header of an error, in seconds, if any."""
+    headers = getattr(exc, 'headers', None) or {}
+    try:
+        return float(headers['retry-after'])
+    except (KeyError, ValueError):
+        return None
+
+
+class Scheduler:
+    """Admit the requests at a rate, by priority class and deadline.
+
+    `priorities` overrides the classes of the endpoints, by name, and `timeouts`
+    the default timeouts of the classes. The bucket holds `burst` tokens, by
+    default a tenth of a second of requests, and at least `reserve` plus one.
+    """
+
+    def __init__(self, schemas: Dict[str, JSON], rate: float = DEFAULT_RATE,
+                 burst: Optional[float] = None, reserve: int = DEFAULT_RESERVE,
+                 priorities: Optional[Dict[str, int]] = None,
+                 timeouts: Optional[List[Optional[float]]] = None,
+                 min_rate: Optional[float] = None, retries: int = DEFAULT_RETRIES):
+        self.priorities = DefaultPriorities(schemas)
+        self.priorities.update(priorities or {})
+        self.timeouts = timeouts or DEFAULT_TIMEOUTS
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.reserve = reserve
+        self.burst = max(burst or rate / 10, reserve + 1)
+        self.retries = retries
+
+        self.tokens = self.burst
+        self.refilled: Optional[float] = None
+        self.paused_until = 0.0
+        # The (priority, deadline, sequence number, future) of the queued requests.
+        self.queue: List[Tuple[int, float, int, asyncio.Future]] = []
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.stats: Dict[str, collections.Counter] = collections.defaultdict(
+            collections.Counter)
+
+    async def Call(self, endpoint: str, fetch: Callable[..., Awaitable[Any]],
+                   args: Tuple[Any, ...], kwargs: Dict[str, Any],
+                   timeout: Optional[float] = None) -> Any:
+        """Call `fetch(*args, **kwargs)` once admitted. Return its result.
+
+        The timeout defaults to the one of the class of the endpoint.
+        """
+        priority = self.priorities[endpoint]
+        stats = self.stats[CLASS_NAMES[priority]]
+        stats['calls'] += 1
+        if timeout is None:
+            timeout = self.timeouts[priority]
+        loop = asyncio.get_running_loop()
+        deadline = math.inf if timeout is None else loop.time() + timeout
+        for attempt in itertools.count():
+            try:
+                await self.Admit(priority, deadline)
+            except DeadlineExceeded:
+                stats['expired'] += 1
+                raise
+            try:
+                value = await fetch(*args, **kwargs)
+            except Exception as exc:
+                if getattr(exc, 'status', None) != 429 or attempt >= self.retries:
+                    raise
+                stats['throttled'] += 1
+                self.Throttle(RetryAfter(exc))
+                continue
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_INCREASE)
+            return value
+
+    async def Admit(self, priority: int, deadline: float):
+        """Wait for a token, in order of priority and deadline."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self.queue, (priority, deadline, next(self.sequence), future))
+        if self.dispatcher is None:
+            self.dispatcher = loop.create_task(self.Dispatch())
+        else:
+            self.wakeup.set()
+        try:
+            await asyncio.wait_for(future, None if deadline == math.inf
+                                   else deadline - loop.time())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("{} request not admitted by its deadline".format(
+                CLASS_NAMES[priority])) from None
+
+    async def Dispatch(self):
+        """Grant the tokens to the queued requests, as they are refilled."""
+        loop = asyncio.get_running_loop()
+        while self.queue:
+            priority, _, _, future = self.queue[0]
+            if future.done():
+                heapq.heappop(self.queue)
+                continue
+            now = loop.time()
+            if self.refilled is not None:
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.refilled) * self.rate)
+            self.refilled = now
+            needed = 1 if priority == ORDER else 1 + self.reserve
+            wait = max(self.paused_until - now, (needed - self.tokens) / self.rate)
+            if wait <= 0:
+                heapq.heappop(self.queue)
+                self.tokens -= 1
+                future.set_result(None)
+                continue
+            # Wait for the tokens, or for a new request, which may be more urgent.
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        self.dispatcher = None
+
+    def Throttle(self, retry_after: Optional[float]):
+        """Slow down after a 429 response.
+
+        The rate is only halved once per pause, for the responses of the requests
+        already sent.
+        """
+        now = asyncio.get_running_loop().time()
+        if now >= self.paused_until:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+        self.paused_until = max(self.paused_until,
+                                now + (retry_after if retry_after is not None
+                                       else 1 / self.rate))
+
+    def Stats(self) -> Dict[str, Any]:
+        """Return the current rate, and the statistics of the classes."""
+        return {'rate': self.rate,
+                'queued': len(self.queue),
+                'classes': {name: dict(self.stats[name]) for name in CLASS_NAMES
+                            if name in self.stats}}
+
+
+class SchedulingClient:
+    """A client whose calls are admitted by a scheduler, e.g. the generated one.
+
+    The methods of the endpoints take an additional `timeout` keyword, the time
+    to wait for their admission. The other attributes are those of the client.
+    """
+
+    def __init__(self, client: Any, scheduler: Scheduler):
+        self.client = client
+        self.scheduler = scheduler
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.client, name)
+        if name not in self.scheduler.priorities:
+            return method
+        async def Call(*args, timeout: Optional[float] = None, **kwargs):
+            return await self.scheduler.Call(name, method, args, kwargs, timeout)
+        Call.__name__ = name
+        setattr(self, name, Call)
+        return Call
+
+
+#-------------------------------------------------------------------------------
+# Benchmark, with orders under a bulk load, from the mock server.
+
+
+# The calls of the bulk load, cycled by each worker, and of the orders.
+BULK_CALLS = [
+    ('GetPriceHistory', ('AAPL',), {'periodType': 'day', 'frequencyType': 'minute'}),
+    ('GetTransactions', (100000,), {'type': 'ALL'}),
+]
+ORDER_CALLS = [
+    ('PlaceOrder', (100000, {'orderType': 'LIMIT'}), {}),
+    ('ReplaceOrder', (100000, 1, {'orderType': 'LIMIT'}), {}),
+    ('CancelOrder', (100000, 1), {}),
+]
+
+
+async def Unscheduled(method: Callable[..., Awaitable[Any]], args: Tuple[Any, ...],
+                      kwargs: Dict[str, Any], pause: float) -> Any:
+    """Call a method, retrying after a pause while it fails with 429."""
+    while True:
+        try:
+            return await method(*args, **kwargs)
+        except Exception as exc:
+            if getattr(exc, 'status', None) != 429:
+                raise
+            await asyncio.sleep(pause)
+
+
+async def RunLoad(client: Any, scheduled: bool, workers: int, order_interval: float,
+                  duration: float, pause: float) -> Tuple[List[float], int, int]:
+    """Send orders at an interval under a bulk load, for a duration.
+
+    Return the latencies of the orders, and the numbers of bulk calls and of
+    expired orders.
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + duration
+    latencies = []
+    counts = collections.Counter()
+
+    async def Call(name, args, kwargs):
+        method = getattr(client, name)
+        if scheduled:
+            return await method(*args, **kwargs)
+        return await Unscheduled(method, args, kwargs, pause)
+
+    async def Bulk(index: int):
+        for name, args, kwargs in itertools.islice(
+                itertools.cycle(BULK_CALLS), index, None):
+            if loop.time() >= end:
+                break
+            await Call(name, args, kwargs)
+            counts['bulk'] += 1
+
+    async def Order(name, args, kwargs):
+        start = time.perf_counter()
+        try:
+            await Call(name, args, kwargs)
+        except DeadlineExceeded:
+            counts['expired'] += 1
+            return
+        latencies.append(time.perf_counter() - start)
+
+    async def Orders():
+        tasks = []
+        for name, args, kwargs in itertools.cycle(ORDER_CALLS):
+            await asyncio.sleep(order_interval)
+            if loop.time() >= end:
+                break
+            tasks.append(loop.create_task(Order(name, args, kwargs)))
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(Orders(), *[Bulk(index) for index in range(workers)])
+    return latencies, counts['bulk'], counts['expired']
+
+
+def Benchmark(schemas_dir: str, raw_dir: str, port: int, delay: float, rate_limit: float,
+              workers: int, duration: float):
+    """Compare the latencies of orders under a bulk load, with and without scheduling."""
+    logging.getLogger().setLevel(logging.ERROR)
+    schemas = generate_validators.ReadSchemas(schemas_dir)
+    client_class = generate_client.CompileClient(schemas)['Client']
+    interactive = {name: INTERACTIVE for name in schemas}
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=mock_server._RunServer,
+        args=(schemas_dir, raw_dir, port, 0, ready, delay, rate_limit))
+    server.start()
+    ready.wait()
+
+    async def Run(scheduler: Optional[Scheduler]):
+        # Start from a full bucket of the server.
+        await asyncio.sleep(1)
+        async with client_class('http://127.0.0.1:{}'.format(port), max_connections=8,
+                                pipeline=8) as client:
+            throttled_before = sum((await mock_server.FetchStats(
+                '127.0.0.1', port))['throttled'].values())
+            if scheduler is not None:
+                client = SchedulingClient(client, scheduler)
+            latencies, bulk, expired = await RunLoad(
+                client, scheduler is not None, workers, 0.05, duration, 1 / rate_limit)
+            throttled = sum((await mock_server.FetchStats(
+                '127.0.0.1', port))['throttled'].values()) - throttled_before
+            return latencies, bulk, expired, throttled
+
+    print("{} bulk workers and an order every 50 ms for {:.0f} s, {:.0f} requests/s "
+          "at most, {:.1f} ms of latency".format(workers, duration, rate_limit, delay * 1e3))
+    print("{:24} {:>7} {:>8} {:>8} {:>8} {:>8} {:>7} {:>7}".format(
+        "", "orders", "p50 ms", "p99 ms", "max ms", "bulk/s", "429s", "expired"))
+    runs = [
+        ('unscheduled', None),
+        ('fifo', lambda: Scheduler(schemas, rate_limit * 0.9, priorities=interactive)),
+        ('priority', lambda: Scheduler(schemas, rate_limit * 0.9)),
+        ('priority, 2x rate', lambda: Scheduler(schemas, rate_limit * 2)),
+    ]
+    try:
+        for label, create in runs:
+            async def RunScheduler():
+                return await Run(create() if create else None)
+            latencies, bulk, expired, throttled = asyncio.run(RunScheduler())
+            latencies.sort()
+            count = len(latencies)
+            print("{:24} {:7} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:7} {:7}".format(
+                label, count, latencies[count // 2] * 1e3,
+                latencies[int(count * 0.99)] * 1e3, latencies[-1] * 1e3,
+                bulk / duration, throttled, expired))
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--list', action='store_true',
+                        help="List the priority classes of the endpoints.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Compare the latencies of orders under a bulk load.")
+    parser.add_argument('--benchmark_workers', action='store', type=int, default=32,
+                        help="Number of concurrent workers of the bulk load.")
+    parser.add_argument('--benchmark_duration', action='store', type=float, default=5,
+                        help="Duration of each run of the benchmark, in seconds.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples served by the mock server.")
+    parser.add_argument('--port', action='store', type=int, default=8080,
+                        help="Port of the mock server of the benchmark.")
+    parser.add_argument('--delay', action='store', type=float, default=0.005,
+                        help="Latency of the responses of the mock server, in seconds.")
+    parser.add_argument('--rate_limit', action='store', type=float, default=50,
+                        help="Rate limit of the mock server, in requests per second.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.raw_downloaded_data, args.port, args.delay,
+                  args.rate_limit, args.benchmark_workers, args.benchmark_duration)
+        return
+
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    priorities = DefaultPriorities(schemas)
+    for priority, class_name in enumerate(CLASS_NAMES):
+        timeout = DEFAULT_TIMEOUTS[priority]
+        print("{} (timeout {}):".format(
+            class_name, 'none' if timeout is None else '{:.0f} s'.format(timeout)))
+        for name, endpoint_priority in sorted(priorities.items()):
+            if endpoint_priority == priority:
+                print("    {:32} {:6} {}".format(name, schemas[name]['method'],
+                                                 schemas[name]['url']))
+
+
+if __name__ == '__main__':
+    main()
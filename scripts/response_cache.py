@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""A cache of the responses of the endpoints returning data that rarely changes.
+
+The market hours, instruments, preferences and user principals change at most a
+few times a day, but are requested constantly. The cache keeps their responses
+for a time-to-live per endpoint, derived from the URLs of the catalogue of
+endpoints by TTL_RULES, and bounded in number with least-recently-used eviction.
+The other endpoints, e.g. the quotes and orders, aren't cached.
+
+The responses are keyed by the canonical name of the endpoint and the values of
+its URL and query parameters, converted to their types, so that e.g. an account
+id given as an integer or a string, or the names of endpoints in any case,
+share an entry. Concurrent misses of the same key are fetched once, and all
+their callers receive the same response. A successful request to a write
+endpoint of the same URL as a cached one, e.g. UpdatePreferences, invalidates
+the cached responses of its URL parameters.
+
+    cache = response_cache.ResponseCache(schemas)
+    client = response_cache.CachingClient(ameritrade_client.Client(...), cache)
+    hours = await client.GetHoursForMultipleMarkets(markets='EQUITY', date='2021-03-01')
+
+The cached responses are shared by all their callers: they must not be
+modified. See --list for the time-to-live of each endpoint, and --benchmark for
+the hit ratio and latencies of a typical mix of requests from the mock server.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import collections
+import logging
+import multiprocessing
+import random
+import re
+import time
+
+import generate_client
+import generate_validators
+import mock_server
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples served by the mock server of the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+# The time-to-live of the responses of the GET endpoints, in seconds, by the
+# first regexp matching their URL. The others aren't cached.
+TTL_RULES = [
+    # The market hours of a date are published in advance.
+    (r"/hours$", 3600),
+    # An instrument by CUSIP doesn't change; the fundamentals of the searches
+    # are updated daily.
+    (r"/instruments/\{cusip\}$", 86400),
+    (r"/instruments$", 3600),
+    # The preferences only change with UpdatePreferences, which invalidates them.
+    (r"/preferences$", 900),
+    # The user principals and streamer keys, with tokens valid for hours.
+    (r"/userprincipals", 600),
+]
+
+# The default maximum number of cached responses.
+DEFAULT_MAX_ENTRIES = 4096
+
+# The statistics of the cache, per endpoint. The lookups of expired entries are
+# also counted as misses, or coalesced if their key is being fetched, so that the
+# hits, coalesced and misses add up to the lookups.
+STATS = ['hits', 'misses', 'coalesced', 'expired', 'evictions', 'invalidations']
+
+
+# The key of a cached response: the canonical endpoint name, and the canonical
+# values of its URL and query parameters.
+Key = Tuple[str, Tuple[Any, ...], Tuple[Tuple[str, Any], ...]]
+
+
+def DefaultTtls(schemas: Dict[str, JSON]) -> Dict[str, float]:
+    """Return the time-to-live of the cached endpoints, from TTL_RULES."""
+    ttls = {}
+    for name, schema in sorted(schemas.items()):
+        if schema['method'] != 'GET':
+            continue
+        for regexp, ttl in TTL_RULES:
+            if re.search(regexp, schema['url']):
+                ttls[name] = ttl
+                break
+    return ttls
+
+
+def Canonical(dtype: JSON, value: Any) -> Any:
+    """Convert the value of a parameter to its type, e.g. from a string.
+
+    The arrays given as comma-separated strings are split, and converted to
+    tuples, to be hashable.
+    """
+    kind = dtype.get('type')
+    if kind == 'array':
+        if isinstance(value, str):
+            value = value.split(',')
+        return tuple(Canonical(dtype['items'], item) for item in value)
+    if not isinstance(value, str):
+        return value
+    if kind == 'integer':
+        return int(value)
+    if kind == 'number':
+        return float(value)
+    if kind == 'boolean':
+        return {'true': True, 'false': False}.get(value.lower(), value)
+    return value
+
+
+class _Entry:
+    """A cached response, and the time it expires."""
+    __slots__ = ('value', 'expires')
+
+    def __init__(self, value: Any, expires: float):
+        self.value = value
+        self.expires = expires
+
+
+class ResponseCache:
+    """A bounded cache of responses, with a time-to-live per endpoint.
+
+    `ttls` overrides the time-to-live of the endpoints, by name; a zero value
+    disables their caching.
+    """
+
+    def __init__(self, schemas: Dict[str, JSON], max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttls: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.schemas = schemas
+        self.max_entries = max_entries
+        self.clock = clock
+        self.ttls = DefaultTtls(schemas)
+        self.ttls.update(ttls or {})
+        self.names = {name.lower(): name for name in schemas}
+
+        # The names of the URL parameters of the endpoints, in order.
+        self.url_params = {name: list(schema.get('url_params') or {})
+                           for name, schema in schemas.items()}
+
+        # The cached endpoints invalidated by each write endpoint of the same URL.
+        self.invalidated: Dict[str, List[str]] = collections.defaultdict(list)
+        for name, schema in sorted(schemas.items()):
+            if schema['method'] == 'GET':
+                continue
+            for cached_name in sorted(self.ttls):
+                if schemas[cached_name]['url'] == schema['url']:
+                    self.invalidated[name].append(cached_name)
+
+        self.entries: 'collections.OrderedDict[Key, _Entry]' = collections.OrderedDict()
+        self.pending: Dict[Key, asyncio.Task] = {}
+        # The numbers of invalidations of the keys being fetched.
+        self.generations: Dict[Key, int] = collections.Counter()
+        self.stats: Dict[str, collections.Counter] = collections.defaultdict(
+            collections.Counter)
+
+    def CanonicalName(self, endpoint: str) -> str:
+        """Return the name of an endpoint in the schemas, given in any case."""
+        name = self.names.get(endpoint.lower())
+        if name is None:
+            raise KeyError("Unknown endpoint: {}".format(endpoint))
+        return name
+
+    def Key(self, endpoint: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Key:
+        """Return the key of a call, from its URL parameters and query keywords."""
+        schema = self.schemas[endpoint]
+        url_params = schema.get('url_params') or {}
+        url_values = tuple(Canonical(url_params[param_name], value)
+                           for param_name, value in zip(self.url_params[endpoint], args))
+        query_params = schema['query_params']
+        query_values = tuple(sorted(
+            (param_name, Canonical(query_params.get(param_name, {}), value))
+            for param_name, value in kwargs.items() if value is not None))
+        return endpoint, url_values, query_values
+
+    async def Fetch(self, endpoint: str, args: Tuple[Any, ...], kwargs: Dict[str, Any],
+                    fetch: Callable[..., Awaitable[Any]]) -> Any:
+        """Return the cached response of a call, or fetch it with `fetch(*args, **kwargs)`."""
+        endpoint = self.CanonicalName(endpoint)
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            value = await fetch(*args, **kwargs)
+            if endpoint in self.invalidated:
+                self.Invalidate(endpoint, args)
+            return value
+
+        key = self.Key(endpoint, args, kwargs)
+        stats = self.stats[endpoint]
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry.expires > self.clock():
+                self.entries.move_to_end(key)
+                stats['hits'] += 1
+                return entry.value
+            del self.entries[key]
+            stats['expired'] += 1
+
+        # The misses are fetched in a task of their own, so that cancelling any
+        # of their callers, including the first one, doesn't cancel the others.
+        task = self.pending.get(key)
+        if task is not None:
+            stats['coalesced'] += 1
+        else:
+            stats['misses'] += 1
+            task = self.pending[key] = asyncio.get_running_loop().create_task(
+                self.FetchAndStore(key, ttl, fetch, args, kwargs))
+            # Mark the exception as retrieved, for the misses without waiters.
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(task)
+
+    async def FetchAndStore(self, key: Key, ttl: float, fetch: Callable[..., Awaitable[Any]],
+                            args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Any:
+        """Fetch a missing response and cache it, unless invalidated meanwhile."""
+        generation = self.generations.get(key, 0)
+        try:
+            value = await fetch(*args, **kwargs)
+        finally:
+            del self.pending[key]
+            current = self.generations.pop(key, 0)
+        if current == generation:
+            self.Store(key, value, ttl)
+        return value
+
+    def Store(self, key: Key, value: Any, ttl: float):
+        """Cache a response, evicting the least recently used ones beyond the size."""
+        self.entries[key] = _Entry(value, self.clock() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self.stats[evicted[0]]['evictions'] += 1
+
+    def Invalidate(self, endpoint: str, args: Tuple[Any, ...]):
+        """Drop the cached responses invalidated by a call to a write endpoint."""
+        for cached_name in self.invalidated[endpoint]:
+            url_values = self.Key(cached_name, args[:len(self.url_params[cached_name])], {})[1]
+            for key in [key for key in self.entries
+                        if key[0] == cached_name and key[1] == url_values]:
+                del self.entries[key]
+                self.stats[cached_name]['invalidations'] += 1
+            for key in self.pending:
+                if key[0] == cached_name and key[1] == url_values:
+                    self.generations[key] += 1
+
+    def Clear(self):
+        """Drop all the cached responses, and those being fetched."""
+        self.entries.clear()
+        for key in self.pending:
+            self.generations[key] += 1
+
+    def Stats(self) -> Dict[str, Any]:
+        """Return the statistics of the cache, in total and per endpoint."""
+        total = collections.Counter()
+        for counter in self.stats.values():
+            total.update(counter)
+        lookups = total['hits'] + total['coalesced'] + total['misses']
+        return {
+            'entries': len(self.entries),
+            'hit_ratio': (total['hits'] + total['coalesced']) / lookups if lookups else 0,
+            'total': {name: total[name] for name in STATS},
+            'endpoints': {endpoint: {name: counter[name] for name in STATS}
+                          for endpoint, counter in sorted(self.stats.items())},
+        }
+
+
+class CachingClient:
+    """A client whose calls are cached, e.g. the generated one.
+
+    The methods of the endpoints of the cache are wrapped; the other attributes
+    are those of the client.
+    """
+
+    def __init__(self, client: Any, cache: ResponseCache):
+        self.client = client
+        self.cache = cache
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.client, name)
+        if name not in self.cache.schemas:
+            return method
+        async def Call(*args, **kwargs):
+            return await self.cache.Fetch(name, args, kwargs, method)
+        Call.__name__ = name
+        setattr(self, name, Call)
+        return Call
+
+
+#-------------------------------------------------------------------------------
+# Benchmark, with a mix of requests from the mock server.
+
+
+# The weights of the endpoints of the requests of the benchmark, and the numbers
+# of distinct values of their parameters, drawn from a skewed distribution.
+BENCHMARK_MIX = [
+    ('GetInstrument', 10, 2000),
+    ('SearchInstruments', 4, 1000),
+    ('GetHoursForMultipleMarkets', 2, 5),
+    ('GetPreferences', 2, 200),
+    ('GetUserPrincipals', 1, 1),
+    ('UpdatePreferences', 0.05, 200),
+]
+
+
+def BenchmarkCalls(count: int, seed: int) -> List[Tuple[str, Tuple[Any, ...], Dict[str, Any]]]:
+    """Return a mix of (endpoint, args, kwargs) calls of endpoints to cache."""
+    rng = random.Random(seed)
+    names = [name for name, _, _ in BENCHMARK_MIX]
+    weights = [weight for _, weight, _ in BENCHMARK_MIX]
+    sizes = {name: size for name, _, size in BENCHMARK_MIX}
+    calls = []
+    for name in rng.choices(names, weights, k=count):
+        # A skewed rank, favoring the first values.
+        rank = int(sizes[name] * rng.random() ** 3)
+        if name == 'GetInstrument':
+            calls.append((name, ('{:09d}'.format(rank),), {'apikey': 'KEY'}))
+        elif name == 'SearchInstruments':
+            calls.append((name, (), {'symbol': 'S{}'.format(rank), 'projection': 'symbol-search'}))
+        elif name == 'GetHoursForMultipleMarkets':
+            calls.append((name, (), {'markets': 'EQUITY',
+                                     'date': '2021-03-{:02d}'.format(rank + 1)}))
+        elif name == 'GetPreferences':
+            calls.append((name, (100000 + rank,), {}))
+        elif name == 'UpdatePreferences':
+            calls.append((name, (100000 + rank, {}), {}))
+        else:
+            calls.append((name, (), {'fields': ['streamerSubscriptionKeys']}))
+    return calls
+
+
+async def RunCalls(client: Any, calls: List[Tuple[str, Tuple[Any, ...], Dict[str, Any]]],
+                   concurrency: int) -> List[float]:
+    """Make calls from concurrent workers. Return their latencies."""
+    latencies = []
+    queue = collections.deque(calls)
+
+    async def Worker():
+        while queue:
+            name, args, kwargs = queue.popleft()
+            start = time.perf_counter()
+            await getattr(client, name)(*args, **kwargs)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[Worker() for _ in range(concurrency)])
+    return latencies
+
+
+def Benchmark(schemas_dir: str, raw_dir: str, port: int, delay: float, count: int,
+              concurrency: int, max_entries: int):
+    """Compare a mix of requests with and without the cache, from a mock server."""
+    logging.getLogger().setLevel(logging.ERROR)
+    schemas = generate_validators.ReadSchemas(schemas_dir)
+    client_class = generate_client.CompileClient(schemas)['Client']
+    calls = BenchmarkCalls(count, 0)
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=mock_server._RunServer, args=(schemas_dir, raw_dir, port, 0, ready, delay))
+    server.start()
+    ready.wait()
+
+    async def Run(cache: Optional[ResponseCache]):
+        async with client_class('http://127.0.0.1:{}'.format(port), max_connections=8,
+                                pipeline=8) as client:
+            if cache is not None:
+                client = CachingClient(client, cache)
+            start = time.perf_counter()
+            latencies = await RunCalls(client, calls, concurrency)
+            return latencies, time.perf_counter() - start
+
+    print("{} calls from {} workers, {:.1f} ms of latency".format(
+        count, concurrency, delay * 1e3))
+    print("{:16} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        "cache entries", "fetched", "hit %", "calls/s", "p50 ms", "p99 ms", "evicted"))
+    try:
+        for size in [None, max_entries // 8, max_entries]:
+            cache = ResponseCache(schemas, size) if size else None
+            latencies, elapsed = asyncio.run(Run(cache))
+            latencies.sort()
+            if cache is None:
+                fetched, ratio, evictions = len(latencies), 0, 0
+            else:
+                stats = cache.Stats()
+                fetched = stats['total']['misses'] + sum(
+                    1 for name, _, _ in calls if name not in cache.ttls)
+                ratio, evictions = stats['hit_ratio'], stats['total']['evictions']
+            print("{:16} {:8} {:8.1f} {:10.0f} {:10.2f} {:10.2f} {:10}".format(
+                size or '-', fetched, ratio * 100, len(latencies) / elapsed,
+                latencies[len(latencies) // 2] * 1e3,
+                latencies[int(len(latencies) * 0.99)] * 1e3, evictions))
+        logging.getLogger().setLevel(logging.INFO)
+        logging.info("Statistics per endpoint: %s", cache.Stats()['endpoints'])
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--list', action='store_true',
+                        help="List the time-to-live of the cached endpoints.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Compare a mix of requests with and without the cache.")
+    parser.add_argument('--benchmark_count', action='store', type=int, default=20000,
+                        help="Number of calls of the benchmark.")
+    parser.add_argument('--benchmark_concurrency', action='store', type=int, default=64,
+                        help="Number of concurrent workers of the benchmark.")
+    parser.add_argument('--max_entries', action='store', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="Maximum number of cached responses of the benchmark.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples served by the mock server.")
+    parser.add_argument('--port', action='store', type=int, default=8080,
+                        help="Port of the mock server of the benchmark.")
+    parser.add_argument('--delay', action='store', type=float, default=0.005,
+                        help="Latency of the responses of the mock server, in seconds.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.raw_downloaded_data, args.port, args.delay,
+                  args.benchmark_count, args.benchmark_concurrency, args.max_entries)
+        return
+
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    cache = ResponseCache(schemas)
+    for name, ttl in sorted(cache.ttls.items()):
+        invalidated_by = sorted(write for write, names in cache.invalidated.items()
+                                if name in names)
+        print("{:32} {:8.0f} s  {}".format(name, ttl, ', '.join(invalidated_by)))
+
+
+if __name__ == '__main__':
+    main()
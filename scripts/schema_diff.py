@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Compare two snapshots of the schemas, structurally.
+
+The version file of each snapshot holds, in addition to the hashes of the schema
+files, a tree of the hashes of the subtrees of each schema, computed bottom-up
+like a Merkle tree. Two snapshots are compared from their version files: the
+schemas with the same hash are skipped without reading their files, and within
+the others, only the subtrees whose hashes differ are descended into. The cost
+is proportional to the size of the changes, not of the schemas.
+
+The differences are printed as a list of semantic changes, e.g.:
+
+    PlaceOrder.request.top.PlaceOrder.session: enum +['SEAMLESS_X'] -['SEAMLESS']
+    GetQuotes.response.top.Option.delta: type number/double -> string
+    GetQuotes.response.top.Option.vega2: added
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Dict, List, Optional, Union
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import time
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# The dicts of at least this size, in bytes of compact JSON, have the hashes of
+# their items stored in the trees. The smaller ones only have their own, and
+# are compared by value when they differ.
+TREE_MIN_SIZE = 1024
+
+# The number of hexadecimal digits of the hashes of the trees.
+DIGEST_SIZE = 12
+
+
+# A node of a tree of hashes: the digest of a subtree, or for the large dicts, a
+# [digest, {key: node}] pair with the nodes of its items.
+Node = Union[str, List[Any]]
+
+
+# A change between two snapshots. 'kind' is one of 'added', 'removed', 'enum',
+# 'type' or 'changed', and 'path' the dotted path of the changed subtree.
+Change = collections.namedtuple('Change', 'kind path old new')
+
+
+def HashTree(value: Any) -> Node:
+    """Compute the tree of the hashes of a schema."""
+    return _HashTree(value)[0]
+
+
+def _HashTree(value: Any):
+    """Return the node of a value and the size of its compact JSON."""
+    if value.__class__ is dict:
+        items = {}
+        parts = []
+        size = 1 + len(value)
+        for key, item in sorted(value.items()):
+            node, item_size = _HashTree(item)
+            items[key] = node
+            parts.append('{}:{}'.format(json.dumps(key), Digest(node)))
+            size += len(json.dumps(key)) + 1 + item_size
+        string = '{{{}}}'.format(','.join(parts))
+    elif value.__class__ is list:
+        items = None
+        nodes = [_HashTree(item) for item in value]
+        parts = [Digest(node) for node, _ in nodes]
+        size = 1 + max(len(value), 1) + sum(item_size for _, item_size in nodes)
+        string = '[{}]'.format(','.join(parts))
+    else:
+        items = None
+        string = json.dumps(value)
+        size = len(string)
+    digest = hashlib.sha256(string.encode('utf8')).hexdigest()[:DIGEST_SIZE]
+    if items is not None and size >= TREE_MIN_SIZE:
+        return [digest, items], size
+    return digest, size
+
+
+def Digest(node: Node) -> str:
+    """Return the digest of a node."""
+    return node if node.__class__ is str else node[0]
+
+
+def _Items(node: Optional[Node]) -> Optional[Dict[str, Node]]:
+    """Return the nodes of the items of a node, if it has them."""
+    return None if node is None or node.__class__ is str else node[1]
+
+
+class Differ:
+    """Accumulate the changes between pairs of values, guided by their trees."""
+
+    def __init__(self):
+        self.changes: List[Change] = []
+        # The number of subtrees compared, with hashes or by value.
+        self.visited = 0
+
+    def Diff(self, old: Any, new: Any, old_node: Optional[Node], new_node: Optional[Node],
+             path: str):
+        """Compare two values, skipping the subtrees with identical hashes."""
+        self.visited += 1
+        if old_node is not None and new_node is not None:
+            if Digest(old_node) == Digest(new_node):
+                return
+        if old.__class__ is dict and new.__class__ is dict:
+            self.DiffDicts(old, new, _Items(old_node), _Items(new_node), path)
+        elif old != new:
+            self.changes.append(Change('changed', path, old, new))
+
+    def DiffDicts(self, old: Dict[str, Any], new: Dict[str, Any],
+                  old_items: Optional[Dict[str, Node]], new_items: Optional[Dict[str, Node]],
+                  path: str):
+        """Compare two dicts, interpreting the enums and types of the schemas."""
+        skipped = set()
+        old_enum, new_enum = old.get('enum'), new.get('enum')
+        if (old_enum.__class__ is list and new_enum.__class__ is list and
+                set(old_enum) != set(new_enum)):
+            self.changes.append(Change('enum', path,
+                                       [value for value in old_enum if value not in new_enum],
+                                       [value for value in new_enum if value not in old_enum]))
+            skipped.add('enum')
+        old_type = (old.get('type'), old.get('format'))
+        new_type = (new.get('type'), new.get('format'))
+        if old_type != new_type and 'type' in old and 'type' in new:
+            self.changes.append(Change('type', path, old_type, new_type))
+            skipped.update(['type', 'format'])
+
+        for key in sorted(old.keys() | new.keys()):
+            if key in skipped:
+                continue
+            key_path = '{}.{}'.format(path, key)
+            if key not in new:
+                self.changes.append(Change('removed', key_path, old[key], None))
+            elif key not in old:
+                self.changes.append(Change('added', key_path, None, new[key]))
+            else:
+                self.Diff(old[key], new[key],
+                          None if old_items is None else old_items.get(key),
+                          None if new_items is None else new_items.get(key),
+                          key_path)
+
+
+def FormatType(type_format) -> str:
+    """Render a (type, format) pair."""
+    return '/'.join(part for part in type_format if part is not None)
+
+
+def FormatChange(change: Change) -> str:
+    """Render a change on a single line."""
+    if change.kind == 'enum':
+        return "{}: enum +{} -{}".format(change.path, change.new, change.old)
+    if change.kind == 'type':
+        return "{}: type {} -> {}".format(
+            change.path, FormatType(change.old), FormatType(change.new))
+    if change.kind == 'changed':
+        return "{}: {} -> {}".format(change.path, json.dumps(change.old),
+                                     json.dumps(change.new))
+    return "{}: {}".format(change.path, change.kind)
+
+
+def ReadVersion(dirname: str) -> Dict[str, Any]:
+    """Read the version file of a snapshot."""
+    with open(path.join(dirname, 'version.json')) as infile:
+        return json.load(infile)
+
+
+def ReadSchema(dirname: str, name: str) -> Dict[str, Any]:
+    """Read the schema of an endpoint from a snapshot."""
+    with open(path.join(dirname, "{}.json".format(name))) as infile:
+        return json.load(infile)
+
+
+def DiffSnapshots(old_dir: str, new_dir: str, use_trees: bool = True) -> Differ:
+    """Compare the schemas of two snapshots.
+
+    Only the files of the schemas whose hashes differ are read. If `use_trees`
+    is false, or a version file has no trees, e.g. one written before they
+    were, their values are compared in full.
+    """
+    old_version, new_version = ReadVersion(old_dir), ReadVersion(new_dir)
+    old_hashes, new_hashes = old_version['messages'], new_version['messages']
+    old_trees = old_version.get('trees', {}) if use_trees else {}
+    new_trees = new_version.get('trees', {}) if use_trees else {}
+    differ = Differ()
+    for name in sorted(old_hashes.keys() | new_hashes.keys()):
+        if name not in new_hashes:
+            differ.changes.append(Change('removed', name, None, None))
+        elif name not in old_hashes:
+            differ.changes.append(Change('added', name, None, None))
+        elif old_hashes[name] != new_hashes[name] or not use_trees:
+            differ.Diff(ReadSchema(old_dir, name), ReadSchema(new_dir, name),
+                        old_trees.get(name), new_trees.get(name), name)
+    return differ
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('old', action='store',
+                        help="Directory of the old snapshot of the schemas.")
+    parser.add_argument('new', action='store', nargs='?', default=DEFAULT_INPUT,
+                        help="Directory of the new snapshot of the schemas.")
+    parser.add_argument('--full', action='store_true',
+                        help="Compare all the schemas in full, ignoring the hashes.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    differ = DiffSnapshots(args.old, args.new, not args.full)
+    elapsed = time.perf_counter() - start
+    for change in differ.changes:
+        print(FormatChange(change))
+    logging.info("%d changes; compared %d subtrees in %.2f ms",
+                 len(differ.changes), differ.visited, elapsed * 1e3)
+
+
+if __name__ == '__main__':
+    main()
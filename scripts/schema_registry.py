@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""A registry of the endpoint schemas, loaded lazily from a prebuilt bundle.
+
+The convert step writes all the schemas to a single bundle file next to
+'version.json', with an index of the endpoints by name, method and URL
+template. Opening the registry only reads that index; each schema is read and
+decoded on first access. This keeps the startup time and memory of short-lived
+processes which only use a few endpoints low.
+
+This module only imports 'json' and 'os', to be cheap to import (not even
+'typing' or 'collections'):
+
+    import schema_registry
+    schema = schema_registry.Load()['GetQuotes']
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+import json
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# The name of the bundle file, in the schemas directory.
+BUNDLE_FILENAME = 'schemas.bundle'
+DEFAULT_BUNDLE = path.join(DEFAULT_INPUT, BUNDLE_FILENAME)
+
+
+# The bundle starts with a magic number and the little-endian size of the index,
+# followed by the index in JSON and the compact JSON of each schema.
+BUNDLE_MAGIC = b'AMTDSCH1'
+_SIZE_BYTES = 4
+
+
+class IndexEntry:
+    """The entry of an endpoint in the index of a bundle."""
+    __slots__ = ('name', 'method', 'url', 'offset', 'size')
+
+    def __init__(self, name: str, method: str, url: str, offset: int, size: int):
+        self.name = name
+        self.method = method
+        self.url = url
+        # The offset and size of the schema, from the end of the index.
+        self.offset = offset
+        self.size = size
+
+    def __repr__(self):
+        return "IndexEntry({!r}, {!r}, {!r}, {}, {})".format(
+            self.name, self.method, self.url, self.offset, self.size)
+
+
+def WriteBundle(dirname: str, version: dict, filename: str = None):
+    """Write the bundle of the schemas of a directory.
+
+    The schemas are those listed in its `version`, as written to 'version.json'.
+    """
+    blobs = []
+    entries = []
+    offset = 0
+    for name in sorted(version['messages']):
+        with open(path.join(dirname, "{}.json".format(name))) as infile:
+            schema = json.load(infile)
+        blob = json.dumps(schema, sort_keys=True, separators=(',', ':')).encode('utf8')
+        entries.append([name, schema['method'], schema['url'], offset, len(blob)])
+        blobs.append(blob)
+        offset += len(blob)
+    index = json.dumps({'hash': version['hash'], 'endpoints': entries},
+                       separators=(',', ':')).encode('utf8')
+    with open(filename or path.join(dirname, BUNDLE_FILENAME), 'wb') as outfile:
+        outfile.write(BUNDLE_MAGIC)
+        outfile.write(len(index).to_bytes(_SIZE_BYTES, 'little'))
+        outfile.write(index)
+        for blob in blobs:
+            outfile.write(blob)
+
+
+def _ReadIndex(infile, filename: str):
+    """Read the index of a bundle. Return it, with its size."""
+    magic = infile.read(len(BUNDLE_MAGIC))
+    if magic != BUNDLE_MAGIC:
+        raise ValueError("Invalid schema bundle: {}".format(filename))
+    index_size = int.from_bytes(infile.read(_SIZE_BYTES), 'little')
+    return json.loads(infile.read(index_size)), index_size
+
+
+def BundleHash(filename: str):
+    """Return the hash of the version of a bundle, or None if absent or invalid."""
+    try:
+        with open(filename, 'rb') as infile:
+            index, _ = _ReadIndex(infile, filename)
+    except (OSError, ValueError):
+        return None
+    return index.get('hash')
+
+
+class SchemaRegistry:
+    """A read-only mapping of endpoint name to schema, loaded from a bundle.
+
+    Only the index is read on creation. The schemas are decoded on first
+    access and cached. This supports the read methods of a dict.
+    """
+
+    def __init__(self, filename: str = DEFAULT_BUNDLE):
+        self.filename = filename
+        with open(filename, 'rb') as infile:
+            index, index_size = _ReadIndex(infile, filename)
+        self.version = index['hash']
+        self.base = len(BUNDLE_MAGIC) + _SIZE_BYTES + index_size
+        self.entries = {entry[0]: IndexEntry(*entry) for entry in index['endpoints']}
+        self.templates = {(entry.method, entry.url): entry.name
+                          for entry in self.entries.values()}
+        self.schemas = {}
+
+    def __getitem__(self, name: str) -> dict:
+        schema = self.schemas.get(name)
+        if schema is None:
+            entry = self.entries[name]
+            with open(self.filename, 'rb') as infile:
+                infile.seek(self.base + entry.offset)
+                schema = self.schemas[name] = json.loads(infile.read(entry.size))
+        return schema
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, name: str, default: dict = None) -> dict:
+        return self[name] if name in self.entries else default
+
+    def keys(self):
+        return self.entries.keys()
+
+    def values(self):
+        return [self[name] for name in self.entries]
+
+    def items(self):
+        return [(name, self[name]) for name in self.entries]
+
+    def Entry(self, name: str) -> IndexEntry:
+        """Return the index entry of an endpoint, without loading its schema."""
+        return self.entries[name]
+
+    def ByMethod(self, method: str) -> list:
+        """Return the names of the endpoints of an HTTP method."""
+        return [entry.name for entry in self.entries.values() if entry.method == method]
+
+    def ByUrl(self, url: str) -> list:
+        """Return the names of the endpoints of a URL template, for any method."""
+        return [entry.name for entry in self.entries.values() if entry.url == url]
+
+    def Find(self, method: str, url: str) -> str:
+        """Return the name of the endpoint of a method and URL template, or None."""
+        return self.templates.get((method, url))
+
+
+# The registries loaded in this process, by filename.
+_REGISTRIES = {}
+
+
+def Load(filename: str = DEFAULT_BUNDLE) -> SchemaRegistry:
+    """Return the registry of a bundle, shared by all its users in a process."""
+    registry = _REGISTRIES.get(filename)
+    if registry is None:
+        registry = _REGISTRIES[filename] = SchemaRegistry(filename)
+    return registry
+
+
+# The code of the workers of the benchmark, which touch a single endpoint. The
+# baseline reads all the schemas, as generate_validators.ReadSchemas does. The
+# workers would decode JSON anyway, so 'json' is imported before the timing.
+_WORKER_PREFIX = '''
+import json, re, time
+start = time.perf_counter()
+'''
+_WORKER_SUFFIX = '''
+elapsed = time.perf_counter() - start
+import os
+with open('/proc/self/statm') as statm:
+    print(elapsed, int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'))
+'''
+BENCHMARK_WORKERS = {
+    'bare': '',
+    'files': '''
+import json, os, re
+schemas = {}
+for filename in sorted(os.listdir(DIRNAME)):
+    if re.match(r"[A-Z].*.json", filename):
+        with open(os.path.join(DIRNAME, filename)) as infile:
+            schema = json.load(infile)
+        schemas[schema['name']] = schema
+schema = schemas[NAME]
+''',
+    'registry': '''
+import schema_registry
+schema = schema_registry.Load(BUNDLE)[NAME]
+''',
+}
+
+
+def Benchmark(dirname: str, name: str, count: int):
+    """Compare workers touching one endpoint, reading all the files or the bundle.
+
+    The time is that of the imports and loading, and the memory is the resident
+    size at the end, from /proc (on Linux).
+    """
+    import subprocess
+    import sys
+    import time
+
+    results = {}
+    for worker, code in BENCHMARK_WORKERS.items():
+        source = "DIRNAME = {!r}\nBUNDLE = {!r}\nNAME = {!r}\n{}{}{}".format(
+            dirname, path.join(dirname, BUNDLE_FILENAME), name,
+            _WORKER_PREFIX, code, _WORKER_SUFFIX)
+        runs = []
+        for _ in range(count):
+            start = time.perf_counter()
+            output = subprocess.check_output([sys.executable, '-c', source],
+                                             cwd=path.dirname(path.abspath(__file__)))
+            wall = time.perf_counter() - start
+            elapsed, rss = output.split()
+            runs.append((wall, float(elapsed), int(rss)))
+        results[worker] = [min(column) for column in zip(*runs)]
+
+    bare_rss = results['bare'][2]
+    print("Worker touching {}, best of {} runs".format(name, count))
+    print("{:10} {:>10} {:>10} {:>10} {:>12}".format(
+        "Worker", "wall ms", "load ms", "RSS MB", "extra RSS MB"))
+    for worker, (wall, elapsed, rss) in results.items():
+        print("{:10} {:10.1f} {:10.2f} {:10.1f} {:12.1f}".format(
+            worker, wall * 1e3, elapsed * 1e3, rss / 2**20, (rss - bare_rss) / 2**20))
+    print("Load speedup: {:.1f}x".format(results['files'][1] / results['registry'][1]))
+
+
+def main():
+    # Imported here to keep the import of the registry cheap.
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('names', nargs='*',
+                        help="Names of endpoints to print the schemas of.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas and bundle from.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark workers touching one endpoint.")
+    parser.add_argument('--benchmark_endpoint', action='store', default='GetQuotes',
+                        help="Name of the endpoint touched by the workers.")
+    parser.add_argument('--benchmark_count', action='store', type=int, default=10,
+                        help="Number of runs of each worker.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.benchmark_endpoint, args.benchmark_count)
+        return
+
+    registry = Load(path.join(args.clean_schemas, BUNDLE_FILENAME))
+    if not args.names:
+        for entry in registry.entries.values():
+            print("{:32} {:7} {}".format(entry.name, entry.method, entry.url))
+    for name in args.names:
+        print(json.dumps(registry[name], sort_keys=True, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""A flat, read-only store of the compiled schemas, shared by worker processes.
+
+The master process compiles the endpoints, messages and enums of the schemas,
+as deduplicated for the proto schema (see ProtoGenerator), once into a file of
+fixed-size records which refer to each other by index and to their strings by
+id. Workers map the file read-only and read the records in place: the pages are
+shared by all of them, and nothing is decoded but the strings they access. Put
+the file in /dev/shm for it to live in shared memory.
+
+The layout is a header with the offset and count of each table, followed by the
+tables:
+
+  strings       (offset, size) of each string, in the string data
+  string data   the UTF-8 text of all the strings
+  endpoints     name, method, URL, direction and range of top types
+  tops          the top-level types of the endpoints: JSON type name, message
+  messages      name, range of fields, discriminator and range of alternatives
+  fields        name, JSON name, number and shape
+  alternatives  discriminator value, field number and message of the subtypes
+  enums         name and range of values
+  enum values   the string of each value
+  hash tables   one per kind of named record, for lookups by name
+
+All integers are little-endian. References to strings, messages and enums are
+indexes into their tables, NONE if absent.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+
+STORE_MAGIC = b'AMTDSTO1'
+
+# An absent reference.
+NONE = 0xFFFFFFFF
+
+# The tables of the store, in order.
+TABLES = ['strings', 'string_data', 'endpoints', 'tops', 'messages', 'fields',
+          'alternatives', 'enums', 'enum_values',
+          'endpoint_slots', 'message_slots', 'enum_slots']
+
+# The header: the magic number, then the (offset, count) of each table.
+HEADER = struct.Struct('<8s' + 'II' * len(TABLES))
+
+STRING = struct.Struct('<II')           # offset, size
+ENDPOINT = struct.Struct('<IIIBII')     # name, method, url, is_request, first top, count
+TOP = struct.Struct('<II')              # JSON type name, message
+MESSAGE = struct.Struct('<IIIIII')      # name, first field, count, discriminator,
+                                        # first alternative, count
+FIELD = struct.Struct('<IIIBB4sI')      # name, json name, number, leaf kind, number of
+                                        # containers, containers, leaf target
+ALTERNATIVE = struct.Struct('<III')     # discriminator value, number, message
+ENUM = struct.Struct('<III')            # name, first value, count
+ENUM_VALUE = struct.Struct('<I')        # value
+SLOT = struct.Struct('<I')              # record index + 1, or 0 for an empty slot
+
+# The kinds of the leaves of the field shapes, and their targets: the string of
+# the proto scalar type, or the index of the enum or message.
+LEAF_KINDS = ['scalar', 'enum', 'message', 'json']
+
+# The codes of the containers of the field shapes, outermost first.
+CONTAINER_CODES = {'list': b'l', 'map': b'm'}
+MAX_CONTAINERS = 4
+
+
+def NameHash(name: bytes) -> int:
+    """The hash of a name for the lookup tables, stable across processes."""
+    return zlib.crc32(name)
+
+
+class StoreWriter:
+    """Accumulate the tables of a store, interning the strings."""
+
+    def __init__(self):
+        self.string_ids = {}
+        self.tables = {name: bytearray() for name in TABLES}
+        self.counts = {name: 0 for name in TABLES}
+
+    def String(self, string: Optional[str]) -> int:
+        """Return the id of a string, adding it if needed."""
+        if string is None:
+            return NONE
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            data = string.encode('utf8')
+            string_id = self.string_ids[string] = self.Append(
+                'strings', STRING, len(self.tables['string_data']), len(data))
+            self.tables['string_data'] += data
+            self.counts['string_data'] += len(data)
+        return string_id
+
+    def Append(self, table: str, record: struct.Struct, *values) -> int:
+        """Append a record to a table, returning its index."""
+        self.tables[table] += record.pack(*values)
+        index = self.counts[table]
+        self.counts[table] += 1
+        return index
+
+    def HashTable(self, table: str, names: List[str]):
+        """Build the lookup table of the names of the records of a table."""
+        size = 1
+        while size < 2 * len(names):
+            size *= 2
+        slots = [0] * size
+        for index, name in enumerate(names):
+            slot = NameHash(name.encode('utf8')) & (size - 1)
+            while slots[slot]:
+                slot = (slot + 1) & (size - 1)
+            slots[slot] = index + 1
+        for value in slots:
+            self.Append(table, SLOT, value)
+
+    def Write(self, filename: str):
+        """Write the store, atomically replacing the file."""
+        offset = HEADER.size
+        descriptors = []
+        for name in TABLES:
+            descriptors.extend([offset, self.counts[name]])
+            offset += len(self.tables[name])
+        dirname = path.dirname(path.abspath(filename))
+        with tempfile.NamedTemporaryFile('wb', dir=dirname, delete=False) as outfile:
+            outfile.write(HEADER.pack(STORE_MAGIC, *descriptors))
+            for name in TABLES:
+                outfile.write(self.tables[name])
+        os.replace(outfile.name, filename)
+
+
+def CompileStore(dirname: str, filename: str):
+    """Compile the schemas of a directory to a store file."""
+    # Imported here, as the workers only need to read stores.
+    import generate_proto_schemas
+    import generate_validators
+
+    schemas = generate_validators.ReadSchemas(dirname)
+    generator = generate_proto_schemas.ProtoGenerator(
+        generate_proto_schemas.ValidateSchemas(dirname))
+    message_names = sorted(generator.messages)
+    message_index = {name: index for index, name in enumerate(message_names)}
+    enum_names = sorted(generator.enums)
+    enum_index = {name: index for index, name in enumerate(enum_names)}
+    writer = StoreWriter()
+
+    for name, schema in sorted(schemas.items()):
+        top, _ = generate_validators.GetMessages(schema)
+        first_top = writer.counts['tops']
+        for type_name in sorted(top):
+            message = generator.MessageName(type_name, name)
+            writer.Append('tops', TOP, writer.String(type_name), message_index[message])
+        writer.Append('endpoints', ENDPOINT, writer.String(name),
+                      writer.String(schema['method']), writer.String(schema['url']),
+                      'request' in schema, first_top, len(top))
+
+    for name in message_names:
+        message = generator.messages[name]
+        first_field = writer.counts['fields']
+        for field in message.fields:
+            shape = field.shape
+            containers = b''
+            while shape[0] in CONTAINER_CODES:
+                containers += CONTAINER_CODES[shape[0]]
+                shape = shape[1]
+            assert len(containers) <= MAX_CONTAINERS, field
+            if shape[0] == 'scalar':
+                target = writer.String(shape[1])
+            elif shape[0] == 'enum':
+                target = enum_index[shape[1]]
+            elif shape[0] == 'message':
+                target = message_index[shape[1]]
+            else:
+                target = NONE
+            writer.Append('fields', FIELD, writer.String(field.name),
+                          writer.String(field.json_name), field.number,
+                          LEAF_KINDS.index(shape[0]), len(containers), containers, target)
+        first_alternative = writer.counts['alternatives']
+        for value, field in message.alternatives:
+            writer.Append('alternatives', ALTERNATIVE, writer.String(value), field.number,
+                          message_index[field.shape[1]])
+        writer.Append('messages', MESSAGE, writer.String(name), first_field,
+                      len(message.fields), writer.String(message.discriminator),
+                      first_alternative, len(message.alternatives))
+
+    for name in enum_names:
+        first_value = writer.counts['enum_values']
+        for value in generator.enums[name]:
+            writer.Append('enum_values', ENUM_VALUE, writer.String(value))
+        writer.Append('enums', ENUM, writer.String(name), first_value,
+                      len(generator.enums[name]))
+
+    writer.HashTable('endpoint_slots', sorted(schemas))
+    writer.HashTable('message_slots', message_names)
+    writer.HashTable('enum_slots', enum_names)
+    writer.Write(filename)
+
+
+class Field:
+    """A view of a field of a message in a store."""
+    __slots__ = ('store', 'values')
+
+    def __init__(self, store: 'SchemaStore', values: Tuple):
+        self.store = store
+        self.values = values
+
+    @property
+    def name(self) -> str:
+        return self.store.String(self.values[0])
+
+    @property
+    def json_name(self) -> Optional[str]:
+        return self.store.String(self.values[1])
+
+    @property
+    def number(self) -> int:
+        return self.values[2]
+
+    @property
+    def shape(self) -> Tuple:
+        """The shape of the field, as in generate_proto_schemas.ProtoField."""
+        _, _, _, kind, num_containers, containers, target = self.values
+        kind = LEAF_KINDS[kind]
+        if kind == 'scalar':
+            shape = (kind, self.store.String(target))
+        elif kind == 'enum':
+            shape = (kind, self.store.Enum(target).name)
+        elif kind == 'message':
+            shape = (kind, self.store.Message(target).name)
+        else:
+            shape = (kind,)
+        for code in reversed(containers[:num_containers]):
+            shape = ('list' if code == ord('l') else 'map', shape)
+        return shape
+
+
+class Message:
+    """A view of a message in a store."""
+    __slots__ = ('store', 'index', 'values')
+
+    def __init__(self, store: 'SchemaStore', index: int):
+        self.store = store
+        self.index = index
+        self.values = store.Record('messages', MESSAGE, index)
+
+    @property
+    def name(self) -> str:
+        return self.store.String(self.values[0])
+
+    @property
+    def fields(self) -> List[Field]:
+        _, first, count, _, _, _ = self.values
+        return [Field(self.store, self.store.Record('fields', FIELD, index))
+                for index in range(first, first + count)]
+
+    def Field(self, json_name: str) -> Optional[Field]:
+        """Return a field by JSON name."""
+        for field in self.fields:
+            if self.store.StringEquals(field.values[1], json_name.encode('utf8')):
+                return field
+        return None
+
+    @property
+    def discriminator(self) -> Optional[str]:
+        return self.store.String(self.values[3])
+
+    @property
+    def alternatives(self) -> List[Tuple[str, int, 'Message']]:
+        """The (discriminator value, field number, message) of the subtypes."""
+        _, _, _, _, first, count = self.values
+        alternatives = []
+        for index in range(first, first + count):
+            value, number, message = self.store.Record('alternatives', ALTERNATIVE, index)
+            alternatives.append((self.store.String(value), number,
+                                 self.store.Message(message)))
+        return alternatives
+
+
+class Enum:
+    """A view of an enum in a store."""
+    __slots__ = ('store', 'index', 'values')
+
+    def __init__(self, store: 'SchemaStore', index: int):
+        self.store = store
+        self.index = index
+        self.values = store.Record('enums', ENUM, index)
+
+    @property
+    def name(self) -> str:
+        return self.store.String(self.values[0])
+
+    @property
+    def enum_values(self) -> List[str]:
+        _, first, count = self.values
+        return [self.store.String(self.store.Record('enum_values', ENUM_VALUE, index)[0])
+                for index in range(first, first + count)]
+
+
+class Endpoint:
+    """A view of an endpoint in a store."""
+    __slots__ = ('store', 'index', 'values')
+
+    def __init__(self, store: 'SchemaStore', index: int):
+        self.store = store
+        self.index = index
+        self.values = store.Record('endpoints', ENDPOINT, index)
+
+    @property
+    def name(self) -> str:
+        return self.store.String(self.values[0])
+
+    @property
+    def method(self) -> str:
+        return self.store.String(self.values[1])
+
+    @property
+    def url(self) -> str:
+        return self.store.String(self.values[2])
+
+    @property
+    def is_request(self) -> bool:
+        return bool(self.values[3])
+
+    @property
+    def top(self) -> Dict[str, Message]:
+        """The messages of the top-level types of the payload, by type name."""
+        _, _, _, _, first, count = self.values
+        top = {}
+        for index in range(first, first + count):
+            type_name, message = self.store.Record('tops', TOP, index)
+            top[self.store.String(type_name)] = self.store.Message(message)
+        return top
+
+
+class SchemaStore:
+    """A store of compiled schemas, mapped read-only from a file."""
+
+    def __init__(self, filename: str):
+        with open(filename, 'rb') as infile:
+            self.mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self.mmap)
+        header = HEADER.unpack_from(self.data)
+        if header[0] != STORE_MAGIC:
+            raise ValueError("Invalid schema store: {}".format(filename))
+        self.offsets = dict(zip(TABLES, header[1::2]))
+        self.counts = dict(zip(TABLES, header[2::2]))
+
+    def Close(self):
+        self.data.release()
+        self.mmap.close()
+
+    def Record(self, table: str, record: struct.Struct, index: int) -> Tuple:
+        """Unpack the record at an index of a table."""
+        return record.unpack_from(self.data, self.offsets[table] + index * record.size)
+
+    def StringSpan(self, string_id: int) -> Tuple[int, int]:
+        offset, size = self.Record('strings', STRING, string_id)
+        start = self.offsets['string_data'] + offset
+        return start, start + size
+
+    def String(self, string_id: int) -> Optional[str]:
+        """Return a string by id, or None for NONE."""
+        if string_id == NONE:
+            return None
+        start, end = self.StringSpan(string_id)
+        return str(self.data[start:end], 'utf8')
+
+    def StringEquals(self, string_id: int, data: bytes) -> bool:
+        """Compare a string to encoded text, in place."""
+        if string_id == NONE:
+            return False
+        start, end = self.StringSpan(string_id)
+        return self.data[start:end] == data
+
+    def Lookup(self, table: str, slots: str, record: struct.Struct, name: str) -> int:
+        """Return the index of a record by name, or raise KeyError."""
+        data = name.encode('utf8')
+        size = self.counts[slots]
+        slot = NameHash(data) & (size - 1)
+        while True:
+            value, = self.Record(slots, SLOT, slot)
+            if value == 0:
+                raise KeyError(name)
+            if self.StringEquals(self.Record(table, record, value - 1)[0], data):
+                return value - 1
+            slot = (slot + 1) & (size - 1)
+
+    def Endpoint(self, name: str) -> Endpoint:
+        return Endpoint(self, self.Lookup('endpoints', 'endpoint_slots', ENDPOINT, name))
+
+    def Message(self, key) -> Message:
+        """Return a message by name or index."""
+        if isinstance(key, str):
+            key = self.Lookup('messages', 'message_slots', MESSAGE, key)
+        return Message(self, key)
+
+    def Enum(self, key) -> Enum:
+        """Return an enum by name or index."""
+        if isinstance(key, str):
+            key = self.Lookup('enums', 'enum_slots', ENUM, key)
+        return Enum(self, key)
+
+    def Endpoints(self) -> Iterator[Endpoint]:
+        return (Endpoint(self, index) for index in range(self.counts['endpoints']))
+
+    def Messages(self) -> Iterator[Message]:
+        return (Message(self, index) for index in range(self.counts['messages']))
+
+    def Enums(self) -> Iterator[Enum]:
+        return (Enum(self, index) for index in range(self.counts['enums']))
+
+
+def PrivateMemory() -> int:
+    """Return the memory private to this process, in bytes (on Linux)."""
+    total = 0
+    with open('/proc/self/smaps_rollup') as infile:
+        for line in infile:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+def ResolveStore(filename: str):
+    """Map a store and resolve all its endpoints, messages and enums."""
+    store = SchemaStore(filename)
+    for endpoint in store.Endpoints():
+        endpoint.top
+    for message in store.Messages():
+        for field in message.fields:
+            field.shape
+        message.alternatives
+    for enum in store.Enums():
+        enum.enum_values
+    return store
+
+
+def CompileTypes(dirname: str):
+    """Parse the schemas and build their types, as each worker does otherwise."""
+    import generate_proto_schemas
+    import generate_validators
+    schemas = generate_validators.ReadSchemas(dirname)
+    generator = generate_proto_schemas.ProtoGenerator(
+        generate_proto_schemas.ValidateSchemas(dirname))
+    return schemas, generator
+
+
+def RunWorkers(function, num_workers: int) -> List[Tuple[float, int]]:
+    """Fork workers running a function, returning their CPU times and private memory."""
+    pids = []
+    for _ in range(num_workers):
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            # The workers run concurrently, time their CPU only. The result is
+            # kept alive for its memory to be accounted for.
+            start = time.process_time()
+            result = function()
+            elapsed = time.process_time() - start
+            os.write(wfd, json.dumps([elapsed, PrivateMemory()]).encode('ascii'))
+            os._exit(0)
+        os.close(wfd)
+        pids.append((pid, rfd))
+    results = []
+    for pid, rfd in pids:
+        with os.fdopen(rfd, 'rb') as infile:
+            results.append(json.loads(infile.read()))
+        os.waitpid(pid, 0)
+    return results
+
+
+def Benchmark(dirname: str, num_workers: int):
+    """Compare pre-forked workers building their own types to workers mapping a store."""
+    logging.getLogger().setLevel(logging.ERROR)
+
+    shm_dir = '/dev/shm' if path.isdir('/dev/shm') else None
+    with tempfile.TemporaryDirectory(dir=shm_dir) as tmpdir:
+        filename = path.join(tmpdir, 'schemas.store')
+        start = time.perf_counter()
+        CompileStore(dirname, filename)
+        compile_time = time.perf_counter() - start
+
+        results = {
+            'idle': RunWorkers(lambda: None, num_workers),
+            'own types': RunWorkers(lambda: CompileTypes(dirname), num_workers),
+            'store': RunWorkers(lambda: ResolveStore(filename), num_workers),
+        }
+        size = path.getsize(filename)
+
+    print("Store: {:.1f} KB, compiled in {:.1f} ms".format(size / 1024, compile_time * 1e3))
+    print("{} workers".format(num_workers))
+    idle = sum(memory for _, memory in results['idle']) / num_workers
+    print("{:12} {:>14} {:>18} {:>18}".format(
+        "Worker", "CPU ms/worker", "private MB/worker", "total private MB"))
+    for name, runs in results.items():
+        elapsed = sum(elapsed for elapsed, _ in runs) / num_workers
+        memory = sum(memory for _, memory in runs) / num_workers - idle
+        print("{:12} {:14.2f} {:18.2f} {:18.1f}".format(
+            name, elapsed * 1e3, memory / 2**20, memory * num_workers / 2**20))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', nargs='?',
+                        help="Filename of the store to compile, e.g. in /dev/shm.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark pre-forked workers with and without a store.")
+    parser.add_argument('--benchmark_workers', action='store', type=int, default=32,
+                        help="Number of workers for the benchmark.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.benchmark_workers)
+        return
+    if not args.output:
+        parser.error("An output filename is required")
+    CompileStore(args.clean_schemas, args.output)
+    store = SchemaStore(args.output)
+    logging.info("Compiled %d endpoints, %d messages and %d enums to %s",
+                 store.counts['endpoints'], store.counts['messages'],
+                 store.counts['enums'], args.output)
+    store.Close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,78 @@
 #!/usr/bin/env python3
 """Scrape the TD Ameritrade API Schemas.
+
+The endpoint pages are processed concurrently by a pool of sessions, each
+driving its own browser. The data extracted from each page is stored in a
+content-addressed cache, by URL and hash of the HTML of the page, so that re-runs
+and resumed runs only render the pages which have changed.
+
+With --static, the pages are parsed from their HTML without a browser, which
+works for server-rendered copies of the site, e.g. one served locally by
+local_doc_site.py for testing.
 """
 __author__ = 'Martin Blais <blais@furius.ca>'
 __license__ = "GNU GPLv2"
 
 from os import path
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import html
+import html.parser
 import json
 import logging
-import logging
 import os
 import pprint
 import re
 import tempfile
+import threading
 import time
-
-from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
-from selenium.webdriver.chrome import options
-from selenium.webdriver.chrome.webdriver import WebDriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
+import urllib.parse
+import urllib.request
+
+try:
+    from selenium import webdriver
+    from selenium.common.exceptions import WebDriverException
+    from selenium.webdriver.chrome import options
+    from selenium.webdriver.chrome.webdriver import WebDriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+except ImportError:
+    # Selenium is only required to render the pages with a browser.
+    webdriver = None
+    WebDriverException = Exception
+    WebDriver = Any
 
 
 # Raw downloads scraped from the site. These get processed by another script
 # into sanitized versions that can be processed.
-DEFAULT_OUTPUT = path.join(path.dirname(path.dirname(__file__)), 'raw')
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_OUTPUT = path.join(_ROOT, 'raw')
+
+# The cache of the data extracted from the pages.
+DEFAULT_CACHE = path.join(_ROOT, '.cache', 'pages')
+
+# The page listing the categories of endpoints.
+ROOT_URL = "https://developer.tdameritrade.com/apis"
+
+
+# The data extracted from an endpoint page: its 'example', 'schema', 'errcodes'
+# and 'query_params'.
+Page = Dict[str, Any]
+
+# An endpoint to scrape: (category, function name, method, URL, link to its page).
+Endpoint = Tuple[str, str, str, str, str]
 
 
 def CreateDriver(driver_exec: str = "/usr/local/bin/chromedriver",
                   headless: bool = False) -> WebDriver:
     """Create web driver instance with all the options."""
+    if webdriver is None:
+        raise ImportError("Selenium is required to render the pages; use --static "
+                          "for server-rendered pages")
     opts = options.Options()
     opts.headless = headless
     return webdriver.Chrome(executable_path=driver_exec, options=opts)
@@ -46,28 +86,37 @@ def CleanName(name: str) -> str:
     return re.sub(r" ", "", name)
 
 
-def GetEndpoints(driver: WebDriver, trace: bool = False) -> Dict[str, str]:
-    """Get a list of endpoints to fetch."""
-    driver.get("https://developer.tdameritrade.com/apis")
-    elem = driver.find_element_by_class_name('view-smartdocs-models')
+def GetEndpoints(pool: 'SessionPool', root_url: str = ROOT_URL,
+                 trace: bool = False) -> List[Endpoint]:
+    """Get a list of endpoints to fetch.
+
+    The pages of the categories are processed concurrently, by the sessions of
+    the pool.
+    """
+    with pool.Session() as session:
+        rows = session.Rows(root_url, 'view-smartdocs-models')
     categories = {}
-    for row in elem.find_elements_by_class_name('views-row'):
-        category = CleanName(row.text.splitlines()[0])
-        link = row.find_element_by_tag_name('a').get_attribute('href')
-        categories[category] = link
+    for text, link in rows:
+        categories[CleanName(text.splitlines()[0])] = link
     if trace:
         pprint.pprint(categories)
 
     # Process each of the categories.
-    endpoints = []
-    for catname, catlink in sorted(categories.items()):
+    def GetCategory(item: Tuple[str, str]) -> List[Endpoint]:
+        catname, catlink = item
         logging.info("Getting %s", catlink)
-        driver.get(catlink)
-        for row in driver.find_elements_by_class_name('views-row'):
-            link = row.find_element_by_tag_name('a').get_attribute('href')
-            method, funcname, url = row.text.splitlines()[:3]
+        with pool.Session() as session:
+            rows = session.Rows(catlink)
+        endpoints = []
+        for text, link in rows:
+            method, funcname, url = text.splitlines()[:3]
             funcname = CleanName(funcname.strip())
             endpoints.append((catname, funcname, method, url, link))
+        return endpoints
+    endpoints = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=pool.size) as executor:
+        for category_endpoints in executor.map(GetCategory, sorted(categories.items())):
+            endpoints.extend(category_endpoints)
     if trace:
         pprint.pprint(endpoints)
 
@@ -102,16 +151,10 @@ def GetErrorCodes(driver: WebDriver) -> Dict[int, str]:
     return errcodes
 
 
-def GetQueryParameters(driver: WebDriver) -> Dict[str, str]:
-    """Extract the query parameters from the page."""
+def ParseQueryParameters(rows: List[List[str]]) -> Dict[str, str]:
+    """Convert the rows of cells of the table of query parameters."""
     query_params = {}
-    try:
-        div = driver.find_element_by_id('queryTable')
-    except WebDriverException:
-        return query_params
-    table = div.find_element_by_tag_name('table')
-    for row in table.find_elements_by_tag_name('tr'):
-        row = [td.text for td in row.find_elements_by_tag_name('td')]
+    for row in rows:
         if not row:
             continue
         name, description = row[0], row[2]
@@ -128,6 +171,308 @@ def GetQueryParameters(driver: WebDriver) -> Dict[str, str]:
     return query_params
 
 
+def GetQueryParameters(driver: WebDriver) -> Dict[str, str]:
+    """Extract the query parameters from the page."""
+    try:
+        div = driver.find_element_by_id('queryTable')
+    except WebDriverException:
+        return {}
+    table = div.find_element_by_tag_name('table')
+    return ParseQueryParameters([[td.text for td in row.find_elements_by_tag_name('td')]
+                                 for row in table.find_elements_by_tag_name('tr')])
+
+
+class DriverSession:
+    """A session rendering the pages in a browser, with a Chrome WebDriver."""
+
+    def __init__(self, driver: WebDriver):
+        self.driver = driver
+
+    def Rows(self, url: str, container: Optional[str] = None) -> List[Tuple[str, str]]:
+        """Return the text and link of the rows of a listing page.
+
+        If `container` is provided, only the rows within the first element of
+        that class are returned.
+        """
+        self.driver.get(url)
+        elem = self.driver.find_element_by_class_name(container) if container else self.driver
+        return [(row.text, row.find_element_by_tag_name('a').get_attribute('href'))
+                for row in elem.find_elements_by_class_name('views-row')]
+
+    def Page(self, url: str, contents: Optional[bytes] = None) -> Page:
+        """Extract the data of an endpoint page."""
+        self.driver.get(url)
+        example, schema = GetExampleAndSchema(self.driver)
+        return {'example': example,
+                'schema': schema,
+                'errcodes': GetErrorCodes(self.driver),
+                'query_params': GetQueryParameters(self.driver)}
+
+    def Close(self):
+        self.driver.quit()
+
+
+class _PageParser(html.parser.HTMLParser):
+    """Collect the elements of the pages read by the scraper, from their HTML.
+
+    The text of the elements is collapsed like the browser renders it, a line
+    per text node.
+    """
+
+    VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                 'link', 'meta', 'source', 'track', 'wbr'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        # A stack of (tag, selectors of the element and its ancestors, capture,
+        # row) tuples, for the open elements. The selectors are '.class' and
+        # '#id', the capture is the list of the text nodes of the element, if
+        # collected, and the row the index of the innermost open 'views-row'.
+        self.stack = []
+        # The (ancestor selectors, text nodes, link) of the 'views-row' elements.
+        self.rows = []
+        # A mapping of the selectors of the textareas to their text nodes.
+        self.textareas = {}
+        # The (ancestor selectors, cells) of the table rows, with the text nodes
+        # of their cells.
+        self.table_rows = []
+        # The open captures of text nodes, innermost last.
+        self.captures = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, str]]):
+        attrs = dict(attrs)
+        names = {'.' + name for name in (attrs.get('class') or '').split()}
+        if attrs.get('id'):
+            names.add('#' + attrs['id'])
+        scope, row = (self.stack[-1][1], self.stack[-1][3]) if self.stack else (frozenset(), None)
+        scope |= names
+        capture = None
+        if '.views-row' in names:
+            capture = []
+            row = len(self.rows)
+            self.rows.append([scope, capture, None])
+        elif tag == 'a' and row is not None and self.rows[row][2] is None:
+            self.rows[row][2] = attrs.get('href')
+        if tag == 'textarea':
+            capture = []
+            for name in names:
+                self.textareas.setdefault(name, capture)
+            # The contents of textareas are text, not markup.
+            self.set_cdata_mode(tag)
+        elif tag == 'tr':
+            self.table_rows.append((scope, []))
+        elif tag == 'td' and self.table_rows:
+            capture = []
+            self.table_rows[-1][1].append(capture)
+        elif tag == 'br':
+            self.handle_data(_BREAK)
+        if tag not in self.VOID_TAGS:
+            self.stack.append((tag, scope, capture, row))
+            if capture is not None:
+                self.captures.append(capture)
+
+    def handle_endtag(self, tag: str):
+        if tag == 'textarea':
+            self.clear_cdata_mode()
+        if not any(entry[0] == tag for entry in self.stack):
+            return
+        # Close the elements left open within this one.
+        while self.stack:
+            open_tag, _, capture, _ = self.stack.pop()
+            if capture is not None:
+                self.captures.pop()
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data: str):
+        for capture in self.captures:
+            capture.append(data)
+
+    def Rows(self, container: Optional[str] = None) -> List[Tuple[str, str]]:
+        selector = '.' + container if container else None
+        return [('\n'.join(Collapse(line) for line in lines if line.strip(_BREAK + ' \t\r\n')),
+                 link)
+                for scope, lines, link in self.rows
+                if selector is None or selector in scope]
+
+    def Textarea(self, selector: str) -> Optional[str]:
+        capture = self.textareas.get(selector)
+        # In CDATA mode, the character references are not converted.
+        return None if capture is None else html.unescape(''.join(capture))
+
+    def TableRows(self, selector: str) -> List[List[str]]:
+        return [[Collapse(''.join(cell)) for cell in cells]
+                for scope, cells in self.table_rows
+                if selector in scope]
+
+
+# A marker of the line breaks in the text nodes, for the <br> elements.
+_BREAK = '\0'
+
+
+def Collapse(text: str) -> str:
+    """Collapse the whitespace of a text, like a browser renders it."""
+    return '\n'.join(' '.join(line.split()) for line in text.split(_BREAK))
+
+
+def FetchPage(url: str) -> bytes:
+    """Fetch the HTML of a page, without rendering it."""
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
+
+
+class StaticSession:
+    """A session parsing the HTML of the pages, without a browser.
+
+    This only works for server-rendered pages. It has the same interface as
+    DriverSession.
+    """
+
+    def Parse(self, url: str, contents: Optional[bytes] = None) -> _PageParser:
+        parser = _PageParser()
+        parser.feed((contents or FetchPage(url)).decode('utf8'))
+        parser.close()
+        return parser
+
+    def Rows(self, url: str, container: Optional[str] = None) -> List[Tuple[str, str]]:
+        return [(text, urllib.parse.urljoin(url, link))
+                for text, link in self.Parse(url).Rows(container)]
+
+    def Page(self, url: str, contents: Optional[bytes] = None) -> Page:
+        parser = self.Parse(url, contents)
+        example = parser.Textarea('.payload_text')
+        schema = parser.Textarea('.payload_text_schema')
+        if example is None:
+            example = parser.Textarea('#response_body_example')
+            schema = parser.Textarea('#response_body_schema')
+            if example is None:
+                example = ''
+                schema = ''
+        errcodes = {}
+        for code, message in parser.TableRows('.listErrorCodes'):
+            errcodes[int(code)] = message
+        return {'example': example,
+                'schema': schema,
+                'errcodes': errcodes,
+                'query_params': ParseQueryParameters(parser.TableRows('#queryTable'))}
+
+    def Close(self):
+        pass
+
+
+class SessionPool:
+    """A pool of up to `size` sessions, created on first use.
+
+    Each session is used by one thread at a time; the browsers are not
+    thread-safe.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int):
+        self.factory = factory
+        self.size = size
+        self.idle = []
+        self.sessions = []
+        # The number of sessions being created, whose slots are reserved.
+        self.starting = 0
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def Session(self) -> Iterator[Any]:
+        """Borrow a session, waiting for one if they are all in use."""
+        with self.condition:
+            while not self.idle and len(self.sessions) + self.starting >= self.size:
+                self.condition.wait()
+            if self.idle:
+                session = self.idle.pop()
+            else:
+                # Reserve the slot; the sessions are slow to start.
+                session = None
+                self.starting += 1
+        if session is None:
+            try:
+                session = self.factory()
+            finally:
+                # Release the slot if the session failed to start, so that a
+                # waiting thread may try again rather than wait forever.
+                with self.condition:
+                    self.starting -= 1
+                    if session is not None:
+                        self.sessions.append(session)
+                    self.condition.notify()
+        try:
+            yield session
+        finally:
+            with self.condition:
+                self.idle.append(session)
+                self.condition.notify()
+
+    def Close(self):
+        for session in self.sessions:
+            if session is not None:
+                session.Close()
+
+
+class PageCache:
+    """A content-addressed cache of the data extracted from the pages.
+
+    The data is stored by URL and hash of the HTML of the page. The pages are
+    fetched without rendering them to look them up, so that the unchanged pages
+    don't need to be rendered and processed again. Each entry is written
+    atomically as soon as its page is processed, so an interrupted run can be
+    resumed.
+    """
+
+    def __init__(self, dirname: str):
+        self.dirname = dirname
+        os.makedirs(dirname, exist_ok=True)
+
+    def Filename(self, url: str, content_hash: str) -> str:
+        url_hash = hashlib.sha256(url.encode('utf8')).hexdigest()
+        return path.join(self.dirname, "{}-{}.json".format(url_hash, content_hash))
+
+    def Get(self, url: str, content_hash: str) -> Optional[Page]:
+        filename = self.Filename(url, content_hash)
+        if not path.exists(filename):
+            return None
+        with open(filename) as infile:
+            return json.load(infile)
+
+    def Put(self, url: str, content_hash: str, page: Page):
+        with tempfile.NamedTemporaryFile('w', dir=self.dirname, delete=False) as outfile:
+            json.dump(page, outfile, sort_keys=True)
+        os.replace(outfile.name, self.Filename(url, content_hash))
+
+
+def ScrapePage(session: Any, cache: Optional[PageCache], link: str) -> Tuple[Page, bool]:
+    """Extract the data of an endpoint page. Return it and whether it was cached."""
+    if cache is None:
+        return session.Page(link), False
+    contents = FetchPage(link)
+    content_hash = hashlib.sha256(contents).hexdigest()
+    page = cache.Get(link, content_hash)
+    if page is not None:
+        return page, True
+    page = session.Page(link, contents)
+    cache.Put(link, content_hash, page)
+    return page, False
+
+
+def ScrapeEndpoints(pool: SessionPool, cache: Optional[PageCache],
+                    endpoints: List[Endpoint]) -> Iterator[Tuple[Endpoint, Page, bool]]:
+    """Process the endpoint pages concurrently, with the sessions of the pool.
+
+    Yield (endpoint, page data, cached) triples, in the order of the endpoints.
+    """
+    def Scrape(endpoint: Endpoint) -> Tuple[Page, bool]:
+        _, _, method, _, link = endpoint
+        logging.info("Processing: %s %s", method, link)
+        with pool.Session() as session:
+            return ScrapePage(session, cache, link)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=pool.size) as executor:
+        for endpoint, (page, cached) in zip(endpoints, executor.map(Scrape, endpoints)):
+            yield endpoint, page, cached
+
+
 def WriteFile(filename: str, contents: Union[str, Any]):
     """Write a file, creating dir, conditionally, and with some debugging."""
     if not isinstance(contents, str):
@@ -138,67 +483,89 @@ def WriteFile(filename: str, contents: Union[str, Any]):
         ofile.write(contents)
 
 
+def WriteEndpoint(output_dir: str, endpoint: Endpoint, page: Page):
+    """Write the raw files of an endpoint."""
+    _, funcname, method, url, _ = endpoint
+    errcodes_json = json.dumps({int(code): message
+                                for code, message in page['errcodes'].items()},
+                               sort_keys=True, indent=4)
+    endpoint_json = json.dumps({
+        'method': method,
+        'url': url,
+        'query_params': page['query_params'],
+    }, sort_keys=True, indent=4)
+    # TODO(blais): Also fetch and add the description and other information
+    # from the page here. Furthermore, automatically insert the types of the
+    # arugments from the URL as JSON schema as well.
+
+    # Write out the output files.
+    dirname = path.join(output_dir, funcname)
+
+    # Write the schema. It is always either for a POST request payload or
+    # for a GET response, there is never both of them.
+    if page['schema']:
+        schema_filename = ("response.json"
+                           if method == 'GET'
+                           else "request.json")
+        WriteFile(path.join(dirname, schema_filename), page['schema'])
+
+    WriteFile(path.join(dirname, "endpoint.json"), endpoint_json)
+    WriteFile(path.join(dirname, "errcodes.json"), errcodes_json)
+    WriteFile(path.join(dirname, "example.json"), page['example'])
+
+
+def Scrape(output_dir: str, factory: Callable[[], Any], jobs: int,
+           cache_dir: Optional[str], root_url: str = ROOT_URL) -> Tuple[int, int]:
+    """Scrape the site to the raw files. Return the numbers of pages and cached pages."""
+    pool = SessionPool(factory, jobs)
+    cache = PageCache(cache_dir) if cache_dir else None
+    try:
+        # Find the categories and their top-level links to each of the available
+        # API endpoints.
+        logging.info("Getting %s", root_url)
+        endpoints = GetEndpoints(pool, root_url)
+
+        # Process each endpoint page, fetching related data with minimal process
+        # (we'll post-process, to minimize traffic on the site from re-runs).
+        os.makedirs(output_dir, exist_ok=True)
+        num_cached = 0
+        for endpoint, page, cached in ScrapeEndpoints(pool, cache, endpoints):
+            WriteEndpoint(output_dir, endpoint, page)
+            num_cached += cached
+    finally:
+        pool.Close()
+    return len(endpoints), num_cached
+
+
 def main():
     logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
     parser = argparse.ArgumentParser(description=__doc__.strip())
     parser.add_argument('--output',
                         default=DEFAULT_OUTPUT,
                         help='Output directory to produce scraped API')
+    parser.add_argument('--root_url', action='store', default=ROOT_URL,
+                        help="URL of the page listing the categories of endpoints.")
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=4,
+                        help="Number of concurrent sessions, i.e., browsers.")
+    parser.add_argument('--cache', action='store', default=DEFAULT_CACHE,
+                        help="Directory of the cache of the pages.")
+    parser.add_argument('--no_cache', action='store_true',
+                        help="Process all the pages, without a cache.")
+    parser.add_argument('--static', action='store_true',
+                        help="Parse the HTML of the pages without a browser.")
+    parser.add_argument('--headless', action='store_true',
+                        help="Run the browsers without a window.")
     args = parser.parse_args()
 
-    # Create a Chrome WebDriver.
-    driver = CreateDriver()
-    logging.info("Getting %s", "https://developer.tdameritrade.com/apis")
-
-    # Find the categories and their top-level links to each of the available API
-    # endpoints.
-    endpoints = GetEndpoints(driver)
-
-    # Process each endpoint page, fetching related data with minimal process
-    # (we'll post-process, to minimize traffic on the site from re-runs).
-    if not path.exists(args.output):
-        os.makedirs(args.output)
-    for catname, funcname, method, url, link in endpoints:
-        logging.info("Processing: %s %s", method, link)
-
-        # Open the page.
-        driver.get(link)
-
-        # Fetch the schema and example.
-        example, schema = GetExampleAndSchema(driver)
-
-        # Get the table of error codes.
-        errcodes = GetErrorCodes(driver)
-        errcodes_json = json.dumps(errcodes, sort_keys=True, indent=4)
-
-        # Get the query parameters.
-        query_params = GetQueryParameters(driver)
-        endpoint = {
-            'method': method,
-            'url': url,
-            'query_params': query_params,
-        }
-        # TODO(blais): Also fetch and add the description and other information
-        # from the page here. Furthermore, automatically insert the types of the
-        # arugments from the URL as JSON schema as well.
-        endpoint_json = json.dumps(endpoint, sort_keys=True, indent=4)
-
-        # Write out the output files.
-        dirname = path.join(args.output, funcname)
-
-        # Write the schema. It is always either for a POST request payload or
-        # for a GET response, there is never both of them.
-        if schema:
-            schema_filename = ("response.json"
-                               if method == 'GET'
-                               else "request.json")
-            WriteFile(path.join(dirname, schema_filename), schema)
-
-        WriteFile(path.join(dirname, "endpoint.json"), endpoint_json)
-        WriteFile(path.join(dirname, "errcodes.json"), errcodes_json)
-        WriteFile(path.join(dirname, "example.json"), example)
-
-    logging.info("Done")
+    if args.static:
+        factory = StaticSession
+    else:
+        factory = lambda: DriverSession(CreateDriver(headless=args.headless))
+    start = time.perf_counter()
+    num_pages, num_cached = Scrape(args.output, factory, args.jobs,
+                                   None if args.no_cache else args.cache, args.root_url)
+    logging.info("Done: %d pages, %d unchanged from the cache, in %.1fs",
+                 num_pages, num_cached, time.perf_counter() - start)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+"""Transcode Ameritrade JSON messages to and from their protocol buffers.
+
+The proto schema is generated from the clean schemas by
+generate_proto_schemas.py and compiled with protoc, and the messages classes
+are created dynamically from the descriptors. The conversion of each message
+type is driven by the shapes of its fields: scalars and enums are copied,
+nested lists and maps go through their wrapper messages, and the discriminated
+types are stored in the field of their subtype.
+
+Exchange logs in JSONL format (see validate_logs.py) can be converted to
+binary logs of length-delimited Exchange messages, and back.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import BinaryIO, Callable, Dict, Iterator, Tuple
+import argparse
+import json
+import logging
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from google.protobuf import descriptor_pb2
+from google.protobuf import message_factory
+
+import convert_ameritrade_schemas
+import generate_proto_schemas
+import generate_validators
+import validate_logs
+import validate_stream
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples used in the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+# The package of the generated messages.
+PACKAGE = 'ameritrade'
+
+
+def CompileProto(source: str) -> Dict[str, type]:
+    """Compile a proto schema with protoc and create its message classes.
+
+    Returns a mapping of message name (without package) to class.
+    """
+    protoc = shutil.which('protoc')
+    if protoc is None:
+        raise RuntimeError("protoc is required to compile the proto schema")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        proto_filename = path.join(tmpdir, 'ameritrade.proto')
+        with open(proto_filename, 'w') as outfile:
+            outfile.write(source)
+        descriptors_filename = path.join(tmpdir, 'ameritrade.pb')
+        subprocess.check_call([protoc,
+                               '--proto_path={}'.format(tmpdir),
+                               '--descriptor_set_out={}'.format(descriptors_filename),
+                               proto_filename])
+        with open(descriptors_filename, 'rb') as infile:
+            file_set = descriptor_pb2.FileDescriptorSet.FromString(infile.read())
+    prefix = PACKAGE + '.'
+    return {name[len(prefix):]: cls
+            for name, cls in message_factory.GetMessages(file_set.file).items()}
+
+
+# Setters set a field from a JSON value, as func(message, value); converters
+# convert a message or the value of a field, as func(value) -> JSON.
+Setter = Callable[[object, JSON], None]
+Converter = Callable[[object], JSON]
+
+
+class Transcoder:
+    """Convert JSON messages to protos and back, by message name.
+
+    The converters of each message type are built on first use. Null values
+    and empty lists and maps are dropped.
+    """
+
+    def __init__(self, generator: generate_proto_schemas.ProtoGenerator,
+                 classes: Dict[str, type]):
+        self.generator = generator
+        self.classes = classes
+        self.messages = dict(generator.messages)
+        for name, shape in generator.wrappers.items():
+            field_name = 'items' if shape[0] == 'list' else 'entries'
+            self.messages[name] = generate_proto_schemas.ProtoMessage(
+                [generate_proto_schemas.ProtoField(field_name, field_name, 1, shape)],
+                None, [])
+        # Mappings of message name to the function encoding a JSON object into a
+        # message, and decoding a message into a JSON object.
+        self.encoders: Dict[str, Callable[[JSON, object], None]] = {}
+        self.decoders: Dict[str, Converter] = {}
+
+    def Encode(self, name: str, value: JSON) -> bytes:
+        """Encode a JSON object as the serialized message of a type."""
+        message = self.classes[name]()
+        self.Encoder(name)(value, message)
+        return message.SerializeToString()
+
+    def Decode(self, name: str, data: bytes) -> JSON:
+        """Decode a serialized message of a type to a JSON object."""
+        return self.Decoder(name)(self.classes[name].FromString(data))
+
+    def Encoder(self, name: str) -> Callable[[JSON, object], None]:
+        """Return the function encoding a JSON object into a message."""
+        encoder = self.encoders.get(name)
+        if encoder is not None:
+            return encoder
+
+        message = self.messages[name]
+        descriptor = self.classes[name].DESCRIPTOR
+        setters = {field.json_name: self.FieldEncoder(descriptor, field)
+                   for field in message.fields}
+        if name in self.generator.wrappers:
+            # The value of a wrapper is the list or map of its single field.
+            setter, = setters.values()
+            self.encoders[name] = lambda value, msg: setter(msg, value)
+            for subname in self.MessageNames(message):
+                self.Encoder(subname)
+            return self.encoders[name]
+        alternatives = {value: (field.name, field.shape[1])
+                        for value, field in message.alternatives}
+        encoders = self.encoders
+
+        def Encode(value, msg):
+            if not isinstance(value, dict):
+                raise ValueError("Expected an object for {}: {!r}".format(name, value))
+            if alternatives:
+                alternative = alternatives.get(value.get(message.discriminator))
+                if alternative is not None:
+                    attr, subname = alternative
+                    submsg = getattr(msg, attr)
+                    submsg.SetInParent()
+                    return encoders[subname](value, submsg)
+            for key, fvalue in value.items():
+                if fvalue is None:
+                    continue
+                setter = setters.get(key)
+                if setter is None:
+                    raise ValueError("Unknown field {!r} for {}".format(key, name))
+                setter(msg, fvalue)
+
+        self.encoders[name] = Encode
+        # Build the converters of the nested messages.
+        for _, subname in alternatives.values():
+            self.Encoder(subname)
+        for subname in self.MessageNames(message):
+            self.Encoder(subname)
+        return Encode
+
+    def MessageNames(self, message: generate_proto_schemas.ProtoMessage) -> Iterator[str]:
+        """Yield the names of the messages referenced by the fields of a message."""
+        for field in message.fields:
+            shape = field.shape
+            while shape[0] in ('list', 'map'):
+                shape = shape[1]
+                if shape[0] in ('list', 'map'):
+                    yield self.generator.ProtoType(shape)
+                    break
+            if shape[0] == 'message':
+                yield shape[1]
+
+    def ItemShape(self, descriptor, field: generate_proto_schemas.ProtoField) -> Tuple:
+        """Return the field descriptor and shape of the values of a field.
+
+        These are those of the elements for lists, and of the values for maps.
+        Nested containers are messages of their wrappers.
+        """
+        fdesc = descriptor.fields_by_name[field.name]
+        kind = field.shape[0]
+        if kind not in ('list', 'map'):
+            return fdesc, field.shape
+        if kind == 'map':
+            fdesc = fdesc.message_type.fields_by_name['value']
+        item = field.shape[1]
+        if item[0] in ('list', 'map'):
+            item = ('message', self.generator.ProtoType(item))
+        return fdesc, item
+
+    def FieldEncoder(self, descriptor, field: generate_proto_schemas.ProtoField) -> Setter:
+        """Return a function setting a field of a message from a JSON value."""
+        attr = field.name
+        kind = field.shape[0]
+        fdesc, item = self.ItemShape(descriptor, field)
+        if item[0] == 'enum':
+            numbers = {value.name: value.number for value in fdesc.enum_type.values}
+            def convert(value):
+                try:
+                    return numbers[value]
+                except KeyError:
+                    raise ValueError("Invalid value {!r} for {}".format(value, field.json_name))
+        elif item[0] == 'json':
+            convert = lambda value: json.dumps(value, separators=(',', ':'))
+        else:
+            convert = None
+        encoders = self.encoders
+
+        if item[0] == 'message':
+            subname = item[1]
+            if kind == 'list':
+                def SetField(msg, value):
+                    repeated = getattr(msg, attr)
+                    encode = encoders[subname]
+                    for element in value:
+                        encode(element, repeated.add())
+            elif kind == 'map':
+                def SetField(msg, value):
+                    mapping = getattr(msg, attr)
+                    encode = encoders[subname]
+                    for key, element in value.items():
+                        encode(element, mapping[key])
+            else:
+                def SetField(msg, value):
+                    submsg = getattr(msg, attr)
+                    submsg.SetInParent()
+                    encoders[subname](value, submsg)
+        elif kind == 'list':
+            if convert is None:
+                SetField = lambda msg, value: getattr(msg, attr).extend(value)
+            else:
+                SetField = lambda msg, value: getattr(msg, attr).extend(map(convert, value))
+        elif kind == 'map':
+            if convert is None:
+                SetField = lambda msg, value: getattr(msg, attr).update(value)
+            else:
+                SetField = lambda msg, value: getattr(msg, attr).update(
+                    (key, convert(element)) for key, element in value.items())
+        else:
+            if convert is None:
+                SetField = lambda msg, value: setattr(msg, attr, value)
+            else:
+                SetField = lambda msg, value: setattr(msg, attr, convert(value))
+
+        def Set(msg, value):
+            try:
+                SetField(msg, value)
+            except (TypeError, AttributeError) as exc:
+                raise ValueError("Invalid value for {}: {}".format(field.json_name, exc))
+        return Set
+
+    def Decoder(self, name: str) -> Converter:
+        """Return the function decoding a message into a JSON object."""
+        decoder = self.decoders.get(name)
+        if decoder is not None:
+            return decoder
+
+        message = self.messages[name]
+        descriptor = self.classes[name].DESCRIPTOR
+        fields = {field.number: (field.json_name, self.FieldDecoder(descriptor, field))
+                  for field in message.fields}
+        if name in self.generator.wrappers:
+            (attr,), ((_, decode),) = [field.name for field in message.fields], fields.values()
+            self.decoders[name] = lambda msg: decode(getattr(msg, attr))
+            for subname in self.MessageNames(message):
+                self.Decoder(subname)
+            return self.decoders[name]
+        alternatives = {field.number: (value, field.shape[1])
+                        for value, field in message.alternatives}
+        decoders = self.decoders
+
+        def Decode(msg):
+            value = {}
+            for fdesc, fvalue in msg.ListFields():
+                entry = fields.get(fdesc.number)
+                if entry is None:
+                    disc_value, subname = alternatives[fdesc.number]
+                    value = decoders[subname](fvalue)
+                    value.setdefault(message.discriminator, disc_value)
+                    return value
+                json_name, decode = entry
+                value[json_name] = fvalue if decode is None else decode(fvalue)
+            return value
+
+        self.decoders[name] = Decode
+        for _, subname in alternatives.values():
+            self.Decoder(subname)
+        for subname in self.MessageNames(message):
+            self.Decoder(subname)
+        return Decode
+
+    def FieldDecoder(self, descriptor, field: generate_proto_schemas.ProtoField) -> Converter:
+        """Return a function converting the value of a field to JSON."""
+        kind = field.shape[0]
+        fdesc, item = self.ItemShape(descriptor, field)
+        if item[0] == 'message':
+            decoders = self.decoders
+            subname = item[1]
+            convert = lambda value: decoders[subname](value)
+        elif item[0] == 'enum':
+            names = {value.number: value.name for value in fdesc.enum_type.values}
+            convert = names.__getitem__
+        elif item[0] == 'json':
+            convert = json.loads
+        else:
+            convert = None
+
+        if kind == 'list':
+            if convert is None:
+                return list
+            return lambda value: [convert(element) for element in value]
+        elif kind == 'map':
+            if convert is None:
+                return dict
+            return lambda value: {key: convert(element) for key, element in value.items()}
+        return convert
+
+
+def LoadTranscoder(dirname: str) -> Transcoder:
+    """Generate and compile the proto schema and build a transcoder for it."""
+    valid_types = generate_proto_schemas.ValidateSchemas(dirname)
+    generator = generate_proto_schemas.ProtoGenerator(valid_types)
+    classes = CompileProto(generator.Source())
+    return Transcoder(generator, classes)
+
+
+class ExchangeCodec:
+    """Convert the records of JSONL exchange logs to Exchange messages and back.
+
+    The bodies are encoded as the messages of their type, which is determined
+    like in validate_logs.py: from the 'type' of the record if present, or the
+    single type of the endpoint, or for quotes, from their asset type.
+    """
+
+    def __init__(self, schemas: Dict[str, JSON], transcoder: Transcoder):
+        self.schemas = schemas
+        self.transcoder = transcoder
+        self.router = validate_logs.Router(schemas, validate=False)
+        self.exchange_class = transcoder.classes['Exchange']
+
+    def TypeName(self, endpoint: str, type_name: str, item: JSON) -> str:
+        """Return the message name of an item of a body."""
+        top, _ = generate_validators.GetMessages(self.schemas[endpoint])
+        if type_name is None:
+            type_name = validate_logs.QuoteType(top, item)
+        if type_name is None:
+            raise ValueError("Unknown type of body for {}".format(endpoint))
+        return self.transcoder.generator.MessageName(type_name, endpoint)
+
+    def Encode(self, record: JSON) -> bytes:
+        """Encode a record as a serialized Exchange."""
+        endpoint = self.router.Endpoint(record)
+        if endpoint is None:
+            raise ValueError("Unknown endpoint for record")
+        exchange = self.exchange_class()
+        for key in 'endpoint', 'method', 'url', 'type':
+            if key in record:
+                setattr(exchange, key, record[key])
+
+        is_request = 'request' in record
+        body = record.get('request' if is_request else 'response')
+        if is_request:
+            exchange.is_request = True
+        if body is not None:
+            top, _ = generate_validators.GetMessages(self.schemas[endpoint])
+            type_name = record.get('type')
+            if type_name is None:
+                type_name = validate_stream.ROOT_TYPES.get(endpoint)
+            if type_name is None and len(top) == 1:
+                type_name, = top
+            if isinstance(body, list):
+                exchange.is_list = True
+                items = [(None, item) for item in body]
+            elif type_name is None and isinstance(body, dict):
+                items = list(body.items())
+            else:
+                items = [(None, body)]
+            for key, item in items:
+                message_name = self.TypeName(endpoint, type_name, item)
+                encoded = exchange.bodies.add()
+                encoded.type = message_name
+                if key is not None:
+                    encoded.key = key
+                encoded.message = self.transcoder.Encode(message_name, item)
+        return exchange.SerializeToString()
+
+    def Decode(self, data: bytes) -> JSON:
+        """Decode a serialized Exchange to a record."""
+        exchange = self.exchange_class.FromString(data)
+        record = {}
+        for key in 'endpoint', 'method', 'url', 'type':
+            if exchange.HasField(key):
+                record[key] = getattr(exchange, key)
+        items = [(encoded.key if encoded.HasField('key') else None,
+                  self.transcoder.Decode(encoded.type, encoded.message))
+                 for encoded in exchange.bodies]
+        if exchange.is_list:
+            body = [item for _, item in items]
+        elif items and items[0][0] is not None:
+            body = dict(items)
+        elif items:
+            body = items[0][1]
+        else:
+            return record
+        record['request' if exchange.is_request else 'response'] = body
+        return record
+
+
+def WriteDelimited(outfile: BinaryIO, data: bytes):
+    """Write a record prefixed by its length as a varint."""
+    size = len(data)
+    prefix = bytearray()
+    while True:
+        byte = size & 0x7f
+        size >>= 7
+        if size:
+            prefix.append(byte | 0x80)
+        else:
+            prefix.append(byte)
+            break
+    outfile.write(prefix)
+    outfile.write(data)
+
+
+def IterDelimited(infile: BinaryIO) -> Iterator[bytes]:
+    """Yield the length-delimited records of a file."""
+    while True:
+        size = 0
+        shift = 0
+        while True:
+            byte = infile.read(1)
+            if not byte:
+                if shift:
+                    raise ValueError("Truncated record length")
+                return
+            size |= (byte[0] & 0x7f) << shift
+            shift += 7
+            if not byte[0] & 0x80:
+                break
+        data = infile.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated record")
+        yield data
+
+
+def ConvertLog(codec: ExchangeCodec, input_filename: str, output_filename: str,
+               decode: bool) -> int:
+    """Convert a JSONL exchange log to a binary log, or back. Returns the count."""
+    count = 0
+    with open(input_filename, 'rb') as infile, open(output_filename, 'wb') as outfile:
+        if decode:
+            for data in IterDelimited(infile):
+                outfile.write(json.dumps(codec.Decode(data)).encode('utf8'))
+                outfile.write(b'\n')
+                count += 1
+        else:
+            for line in infile:
+                if line.strip():
+                    WriteDelimited(outfile, codec.Encode(json.loads(line)))
+                    count += 1
+    return count
+
+
+def IterExamples(schemas: Dict[str, JSON], raw_dir: str) -> Iterator[Tuple[str, str, JSON]]:
+    """Yield the (endpoint, type name, value) of the valid example payloads.
+
+    Some of the examples are inconsistent with their schemas, e.g., a
+    MarginAccount of type CASH; these are skipped.
+    """
+    for name, schema in sorted(schemas.items()):
+        filename = path.join(raw_dir, name, 'example.json')
+        top, _ = generate_validators.GetMessages(schema)
+        if not top or not path.exists(filename):
+            continue
+        for type_name, value in sorted(convert_ameritrade_schemas.ReadExample(filename).items()):
+            if type_name not in top:
+                continue
+            errors = generate_validators.ValidateGeneric(schema, type_name, value)
+            if errors:
+                logging.info("Skipping invalid example %s.%s: %s", name, type_name, errors[0])
+                continue
+            yield name, type_name, value
+
+
+def Benchmark(schemas_dir: str, raw_dir: str, count: int, num_records: int):
+    """Compare the sizes and conversion times of JSON and protos.
+
+    This converts the valid examples, synthetic GetPriceHistory and
+    GetOptionChain bodies of about a megabyte, and an exchange log replicating
+    the examples.
+    """
+    logging.getLogger().setLevel(logging.ERROR)
+    schemas = generate_validators.ReadSchemas(schemas_dir)
+    transcoder = LoadTranscoder(schemas_dir)
+    codec = ExchangeCodec(schemas, transcoder)
+    logging.getLogger().setLevel(logging.INFO)
+
+    examples = list(IterExamples(schemas, raw_dir))
+    large = [(name, type_name, json.loads(
+        validate_stream.SyntheticBody(schemas[name], raw_dir, 2**20)))
+             for name, type_name in [('GetPriceHistory', 'CandleList'),
+                                     ('GetOptionChain', 'OptionChain')]]
+
+    def Time(func, *args, repeat=count):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(*args)
+        return (time.perf_counter() - start) / repeat * 1e6
+
+    print("{:28} {:20} {:>8} {:>8} {:>6} {:>9} {:>9} {:>9} {:>9}".format(
+        "Endpoint", "Message", "JSON B", "proto B", "ratio",
+        "loads us", "dec us", "dumps us", "enc us"))
+    totals = [0, 0]
+    for endpoint, type_name, value in examples + large:
+        repeat = count if (endpoint, type_name, value) in examples else 1
+        name = transcoder.generator.MessageName(type_name, endpoint)
+        text = json.dumps(value)
+        data = transcoder.Encode(name, value)
+        assert transcoder.Decode(name, data) == value, (endpoint, type_name)
+        totals[0] += len(text)
+        totals[1] += len(data)
+        print("{:28} {:20} {:8d} {:8d} {:6.1f} {:9.1f} {:9.1f} {:9.1f} {:9.1f}".format(
+            endpoint, name, len(text), len(data), len(text) / len(data),
+            Time(json.loads, text, repeat=repeat),
+            Time(transcoder.Decode, name, data, repeat=repeat),
+            Time(json.dumps, value, repeat=repeat),
+            Time(transcoder.Encode, name, value, repeat=repeat)))
+    print("Total: {} JSON bytes, {} proto bytes, {:.1f}x smaller".format(
+        totals[0], totals[1], totals[0] / totals[1]))
+
+    # Convert an exchange log replicating the examples.
+    records = []
+    for endpoint, type_name, value in examples:
+        schema = schemas[endpoint]
+        direction = 'response' if 'response' in schema else 'request'
+        url = re.sub(r"\{.*?\}", "123", schema['url'])
+        records.append({'method': schema['method'], 'url': url,
+                        'type': type_name, direction: value})
+    records = [records[index % len(records)] for index in range(num_records)]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for label, encode, decode, write, read in [
+                ("JSONL", json.dumps, json.loads,
+                 lambda outfile, line: outfile.write(line.encode('utf8') + b'\n'),
+                 lambda infile: iter(infile)),
+                ("binary", codec.Encode, codec.Decode, WriteDelimited, IterDelimited)]:
+            filename = path.join(tmpdir, label)
+            start = time.perf_counter()
+            with open(filename, 'wb') as outfile:
+                for record in records:
+                    write(outfile, encode(record))
+            write_elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            with open(filename, 'rb') as infile:
+                decoded = [decode(data) for data in read(infile)]
+            read_elapsed = time.perf_counter() - start
+            assert decoded == records, label
+            results.append((label, path.getsize(filename), write_elapsed, read_elapsed))
+
+    print()
+    print("{} records".format(num_records))
+    print("{:10} {:>12} {:>14} {:>14}".format("Log", "MB", "write rec/s", "read rec/s"))
+    for label, size, write_elapsed, read_elapsed in results:
+        print("{:10} {:12.2f} {:14.0f} {:14.0f}".format(
+            label, size / 2**20, num_records / write_elapsed, num_records / read_elapsed))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('input', nargs='?',
+                        help="Input JSONL exchange log, or binary log with --decode.")
+    parser.add_argument('output', nargs='?',
+                        help="Output binary log, or JSONL exchange log with --decode.")
+    parser.add_argument('-d', '--decode', action='store_true',
+                        help="Convert a binary log back to a JSONL log.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Compare sizes and conversion times on the example payloads.")
+    parser.add_argument('--benchmark_count', action='store', type=int, default=200,
+                        help="Number of conversions of each example for the benchmark.")
+    parser.add_argument('--benchmark_records', action='store', type=int, default=20000,
+                        help="Number of records of the synthetic log for the benchmark.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples from, for the benchmark.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.raw_downloaded_data,
+                  args.benchmark_count, args.benchmark_records)
+        return
+    if not (args.input and args.output):
+        parser.error("Input and output filenames are required.")
+
+    logging.getLogger().setLevel(logging.ERROR)
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    codec = ExchangeCodec(schemas, LoadTranscoder(args.clean_schemas))
+    logging.getLogger().setLevel(logging.INFO)
+    count = ConvertLog(codec, args.input, args.output, args.decode)
+    logging.info("Converted %d records", count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""A graph of the unique types of the schemas, keyed by structural digests.
+
+Each type is assigned a digest computed bottom-up from the digests of its parts,
+like a Merkle tree, ignoring the descriptions. Two types have the same digest
+iff they have the same structure, regardless of their names or of the endpoints
+they appear in, so comparing and deduplicating them only compares digests. Each
+subtree is hashed once and its digest memoized.
+
+ValidateSchemas builds the graph of the named types, and the generators
+deduplicate the classes by the digests of their fields. Run this script to print
+a report of the types sharing the same definition under different names, and of
+the near-duplicates, e.g., enums with overlapping sets of values like
+'AssetType1' and 'AssetType2', or messages differing by a few fields.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Dict, Iterator, List, Tuple
+import argparse
+import collections
+import hashlib
+import logging
+import re
+
+import generate_messages
+import generate_proto_schemas
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+
+# A digest of the structure of a type: the MD5 of its canonical string in
+# hexadecimal, or that string itself if it is short.
+Digest = str
+
+# The maximum size of the canonical strings used as their own digests. These
+# can't be mistaken for MD5 digests, as they start with an uppercase letter.
+INLINE_SIZE = 64
+
+
+class TypeGraph:
+    """The unique types of the schemas, by digest.
+
+    The digests of the dicts and lists hashed are memoized by identity, so the
+    values hashed must not be modified afterwards. A reference to them is kept,
+    which guarantees the uniqueness of their ids.
+    """
+
+    def __init__(self):
+        # A mapping of the id of a hashed value and whether it was hashed as
+        # fields, to a (value, digest) pair.
+        self.memo: Dict[Tuple[int, bool], Tuple[Any, Digest]] = {}
+        # A mapping of digest to the fields of the unique object types, i.e.,
+        # the nodes of the graph. The nested types of their fields are the edges.
+        self.objects: Dict[Digest, Dict[str, JSON]] = {}
+        # A mapping of the names of the named types to their digests.
+        self.names: Dict[str, Digest] = {}
+
+    def TypeDigest(self, dtype: JSON) -> Digest:
+        """Return the digest of a type."""
+        return self._Hash(dtype, False)
+
+    def FieldsDigest(self, fields: Dict[str, JSON]) -> Digest:
+        """Return the digest of the fields of an object, a mapping of name to type."""
+        return self._Hash(fields, True)
+
+    def MapDigest(self, mapping: Dict[str, Dict[str, JSON]]) -> Digest:
+        """Return the digest of a mapping of names to fields, e.g. a one-of."""
+        string = 'M{{{}}}'.format(','.join(
+            '{!r}:{}'.format(name, None if fields is None else self.FieldsDigest(fields))
+            for name, fields in sorted(mapping.items())))
+        return hashlib.md5(string.encode('utf8')).hexdigest()
+
+    def AddName(self, name: str, fields: Dict[str, JSON]) -> Digest:
+        """Register the fields of a named type. Return their digest."""
+        digest = self.names[name] = self.FieldsDigest(fields)
+        return digest
+
+    def Aliases(self) -> Dict[Digest, List[str]]:
+        """Return the names of the named types sharing the same definition."""
+        names = collections.defaultdict(list)
+        for name, digest in sorted(self.names.items()):
+            names[digest].append(name)
+        return {digest: name_list for digest, name_list in names.items()
+                if len(name_list) > 1}
+
+    def _Hash(self, value: JSON, is_fields: bool) -> Digest:
+        """Hash a value, bottom up.
+
+        The digest of a dict or list is that of a string of the reprs of its keys
+        and scalars and the digests of its other values. The keys of the types
+        named 'description' are skipped, but not those of the mappings of fields,
+        where they are field names.
+        """
+        key = (id(value), is_fields)
+        entry = self.memo.get(key)
+        if entry is not None:
+            return entry[1]
+        Hash = self._Hash
+        if value.__class__ is dict:
+            if is_fields:
+                string = 'F{{{}}}'.format(','.join(
+                    '{!r}:{}'.format(name, Hash(item, False))
+                    for name, item in sorted(value.items())))
+            else:
+                string = 'T{{{}}}'.format(','.join(
+                    '{!r}:{}'.format(name, Hash(item, name == 'properties'))
+                    for name, item in sorted(value.items())
+                    if name != 'description'))
+        elif value.__class__ is list:
+            string = 'L[{}]'.format(','.join(Hash(item, False) for item in value))
+        else:
+            # Scalars are their own digests.
+            return repr(value)
+        if len(string) <= INLINE_SIZE:
+            # Small values are their own digests, e.g. most of the leaf types,
+            # and are not memoized.
+            digest = string
+        else:
+            digest = hashlib.md5(string.encode('utf8')).hexdigest()
+            self.memo[key] = (value, digest)
+        if is_fields:
+            self.objects.setdefault(digest, value)
+        return digest
+
+
+def NearDuplicateEnums(enums: Dict[str, List[str]],
+                       threshold: float) -> Iterator[Tuple[str, str, List[str], List[str]]]:
+    """Yield the pairs of enums of the same field with overlapping values.
+
+    The enums are those of ValidatedTypes, which numbers those of the same
+    field name with distinct sets of values, e.g. 'assetType1'. The pairs of
+    which at least `threshold` of the values of the smallest are shared are
+    yielded as (name, other name, values only in the first, values only in the
+    other), e.g. an enum with a value missing from the other.
+    """
+    groups = collections.defaultdict(list)
+    for name, values in sorted(enums.items()):
+        groups[re.sub(r"\d+$", "", name)].append((name, set(values)))
+    for _, group in sorted(groups.items()):
+        for index, (name1, values1) in enumerate(group):
+            for name2, values2 in group[index + 1:]:
+                shared = len(values1 & values2)
+                if shared >= threshold * min(len(values1), len(values2)):
+                    yield (name1, name2, sorted(values1 - values2), sorted(values2 - values1))
+
+
+def NearDuplicateTypes(graph: TypeGraph, classes: Dict[str, Dict[str, JSON]],
+                       threshold: float) -> List[Tuple[float, str, str]]:
+    """Return the pairs of distinct classes sharing most of their fields.
+
+    Two fields are the same if they have the same name and type digest. The
+    similarity is the Jaccard index of the sets of fields, and the pairs at or
+    above `threshold` are returned as (similarity, name, other name) triples.
+    Only the pairs sharing at least one field are compared, from an index of the
+    classes by field.
+    """
+    field_sets = {name: {(field_name, graph.TypeDigest(ftype))
+                         for field_name, ftype in fields.items()}
+                  for name, fields in classes.items()}
+    index = collections.defaultdict(list)
+    for name, field_set in sorted(field_sets.items()):
+        for field in field_set:
+            index[field].append(name)
+    shared = collections.Counter()
+    for names in index.values():
+        for i, name1 in enumerate(names):
+            for name2 in names[i + 1:]:
+                shared[(name1, name2)] += 1
+    pairs = []
+    for (name1, name2), count in shared.items():
+        similarity = count / (len(field_sets[name1]) + len(field_sets[name2]) - count)
+        if threshold <= similarity < 1:
+            pairs.append((similarity, name1, name2))
+    return sorted(pairs, key=lambda pair: (-pair[0], pair[1], pair[2]))
+
+
+def Report(valid_types: 'generate_proto_schemas.ValidatedTypes', threshold: float):
+    """Print the aliased names and near-duplicate types and enums."""
+    graph = valid_types.graph
+    generator = generate_messages.BuildGenerator(valid_types)
+    classes = {name: definition[0]
+               for name, definition in generator.definitions.items()}
+
+    print("{} named types, {} unique; {} unique object types in all".format(
+        len(graph.names), len(set(graph.names.values())), len(graph.objects)))
+    print()
+    print("Named types with the same definition:")
+    for _, names in sorted(graph.Aliases().items(), key=lambda item: item[1]):
+        print("  {}".format(", ".join(names)))
+
+    print()
+    print("Near-duplicate enums (overlap >= {}):".format(threshold))
+    for name1, name2, only1, only2 in NearDuplicateEnums(valid_types.enums, threshold):
+        print("  {} vs {}: +{} / +{}".format(name1, name2, only1, only2))
+
+    print()
+    print("Near-duplicate classes (similarity >= {}):".format(threshold))
+    for similarity, name1, name2 in NearDuplicateTypes(graph, classes, threshold):
+        fields1, fields2 = classes[name1], classes[name2]
+        differing = sorted(
+            field_name for field_name in set(fields1) & set(fields2)
+            if graph.TypeDigest(fields1[field_name]) != graph.TypeDigest(fields2[field_name]))
+        print("  {} vs {}: {:.2f}; only in {}: {}; only in {}: {}; differing: {}".format(
+            name1, name2, similarity,
+            name1, sorted(set(fields1) - set(fields2)),
+            name2, sorted(set(fields2) - set(fields1)), differing))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--threshold', action='store', type=float, default=0.75,
+                        help="Minimum similarity of the near-duplicate types and enums.")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    valid_types = generate_proto_schemas.ValidateSchemas(args.clean_schemas)
+    Report(valid_types, args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""Route requests to their endpoints with a trie of the URL templates.
+
+The router is compiled from the 'method' and 'url' of the schemas. Each node of
+the trie has its literal path segments and its parameters, e.g. '{accountId}'.
+There is a trie per method. A path is routed in a single pass over its
+segments, preferring the literal segments to the parameters, e.g.
+'/v1/accounts/watchlists' over '/v1/accounts/{accountId}', and backtracking only
+from the nodes with both, or with many parameters, e.g. for
+'/v1/marketdata/{symbol}/quotes' and '/v1/marketdata/{index}/movers'. The parameters are converted to their types from
+URL_PARAM_TYPES as they are matched; a segment which doesn't convert doesn't
+match, e.g. an 'accountId' has to be an integer.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import collections
+import logging
+import random
+import re
+import time
+import urllib.parse
+
+import generate_validators
+import parameters
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+
+def ConvertInteger(segment: str) -> int:
+    """Convert a path segment to an integer, strictly: digits only."""
+    if not (segment.isascii() and segment.isdigit()):
+        raise ValueError(segment)
+    return int(segment)
+
+
+def ConvertString(segment: str) -> str:
+    """Convert a path segment to a string, unquoting it."""
+    return urllib.parse.unquote(segment) if '%' in segment else segment
+
+
+# Converters of the path segments, by JSON schema type.
+CONVERTERS = {
+    'integer': ConvertInteger,
+    'string': ConvertString,
+}
+
+Converter = Callable[[str], Any]
+
+
+class Node:
+    """A node of the trie, for the path segments following its parent's."""
+    __slots__ = ('literals', 'params', 'endpoint')
+
+    def __init__(self):
+        # A mapping of literal segment to child node.
+        self.literals: Dict[str, Node] = {}
+        # A list of (parameter name, converter, child node) triples.
+        self.params: List[Tuple[str, Converter, Node]] = []
+        # The name of the endpoint of the paths ending here, if any.
+        self.endpoint: Optional[str] = None
+
+
+def Segments(url: str) -> Tuple[List[str], int, int]:
+    """Split the path of a URL template or of a request URL into segments.
+
+    Returns the segments and the range of those of the path. The URL may be
+    absolute or only a path, and the query string and a trailing slash are
+    ignored.
+    """
+    url_path = url.partition('?')[0]
+    segments = url_path.split('/')
+    if '://' in url_path:
+        # Skip the scheme and host of absolute URLs, e.g. ['https:', '', host, ...].
+        start = 3
+    else:
+        # Skip the empty segment before the leading slash, if any.
+        start = 0 if segments[0] else 1
+    end = len(segments) - 1 if segments[-1] == '' else len(segments)
+    return segments, start, end
+
+
+class UrlRouter:
+    """A router of request methods and URLs to endpoint names and parameters."""
+
+    def __init__(self, schemas: Dict[str, JSON],
+                 param_types: Dict[str, JSON] = parameters.URL_PARAM_TYPES):
+        self.roots: Dict[str, Node] = {}
+        for name, schema in sorted(schemas.items()):
+            self.Add(schema['method'], schema['url'], name, param_types)
+
+    def Add(self, method: str, url: str, name: str, param_types: Dict[str, JSON]):
+        """Add the template of an endpoint."""
+        node = self.roots.setdefault(method, Node())
+        segments, start, end = Segments(url)
+        for segment in segments[start:end]:
+            match = re.fullmatch(r"{(.*)}", segment)
+            if match:
+                param_name = match.group(1)
+                for other_name, _, child in node.params:
+                    if other_name == param_name:
+                        break
+                else:
+                    child = Node()
+                    converter = CONVERTERS[param_types[param_name]['type']]
+                    node.params.append((param_name, converter, child))
+                node = child
+            else:
+                node = node.literals.setdefault(segment, Node())
+        if node.endpoint is not None:
+            raise ValueError("Conflicting endpoints {} and {} for {} {}".format(
+                node.endpoint, name, method, url))
+        node.endpoint = name
+
+    def Match(self, method: str, url: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Return the endpoint name and converted parameters of a request, or None."""
+        root = self.roots.get(method)
+        if root is None:
+            return None
+        segments, start, end = Segments(url)
+        values = []
+        name = self._Match(root, segments, start, end, values)
+        return None if name is None else (name, dict(values))
+
+    def _Match(self, node: Node, segments: List[str], index: int, end: int,
+               values: List[Tuple[str, Any]]) -> Optional[str]:
+        """Match the segments from `index` on, accumulating the parameter values."""
+        while index < end:
+            segment = segments[index]
+            index += 1
+            child = node.literals.get(segment)
+            params = node.params
+            if not params:
+                # A literal segment only: no alternatives.
+                if child is None:
+                    return None
+                node = child
+                continue
+            if child is None and len(params) == 1:
+                # A single parameter: no alternatives.
+                param_name, converter, node = params[0]
+                try:
+                    values.append((param_name, converter(segment)))
+                except ValueError:
+                    return None
+                continue
+
+            # Try the alternatives in turn, literal first, backtracking the
+            # values of those which don't match.
+            mark = len(values)
+            if child is not None:
+                name = self._Match(child, segments, index, end, values)
+                if name is not None:
+                    return name
+                del values[mark:]
+            for param_name, converter, child in params:
+                try:
+                    values.append((param_name, converter(segment)))
+                except ValueError:
+                    continue
+                name = self._Match(child, segments, index, end, values)
+                if name is not None:
+                    return name
+                del values[mark:]
+            return None
+        return node.endpoint
+
+
+class RegexRouter:
+    """Match the requests against the regexps of all the templates in turn.
+
+    This is the approach of validate_logs before the trie, as a baseline for the
+    benchmark.
+    """
+
+    def __init__(self, schemas: Dict[str, JSON]):
+        self.templates = collections.defaultdict(list)
+        for name, schema in sorted(schemas.items()):
+            url_path = urllib.parse.urlparse(schema['url']).path
+            regexp = '/'.join('([^/]+)' if segment.startswith('{') else re.escape(segment)
+                              for segment in url_path.split('/'))
+            self.templates[schema['method']].append(
+                (url_path.count('{'), name, re.compile(regexp + '$')))
+        for templates in self.templates.values():
+            templates.sort()
+
+    def Match(self, method: str, url: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        url_path = urllib.parse.urlparse(url).path.rstrip('/')
+        for _, name, regexp in self.templates.get(method, []):
+            match = regexp.match(url_path)
+            if match:
+                return name, match.groups()
+        return None
+
+
+# The relative frequencies of the endpoints in the benchmark requests, modeled
+# on a trading application polling quotes, charts and its orders. The other
+# endpoints have a weight of 1.
+BENCHMARK_WEIGHTS = {
+    'GetQuotes': 40,
+    'GetQuote': 20,
+    'GetPriceHistory': 15,
+    'GetOrder': 8,
+    'GetOrdersByPath': 8,
+    'GetAccount': 6,
+    'GetSavedOrder': 3,
+    'PlaceOrder': 3,
+    'CancelOrder': 3,
+}
+
+# Sample values of the URL parameters, for the benchmark.
+BENCHMARK_VALUES = {
+    'accountId': lambda rnd: str(rnd.randrange(10**8, 10**9)),
+    'orderId': lambda rnd: str(rnd.randrange(10**9, 10**10)),
+    'savedOrderId': lambda rnd: str(rnd.randrange(10**6, 10**7)),
+    'transactionId': lambda rnd: str(rnd.randrange(10**9, 10**10)),
+    'symbol': lambda rnd: rnd.choice(['AAPL', 'MSFT', 'SPY', 'QQQ', 'TSLA', '%24SPX.X']),
+    'cusip': lambda rnd: '{:09d}'.format(rnd.randrange(10**9)),
+    'index': lambda rnd: rnd.choice(['$COMPX', '$DJI', '$SPX.X']),
+    'market': lambda rnd: rnd.choice(['EQUITY', 'OPTION', 'FUTURE']),
+    'watchlistId': lambda rnd: str(rnd.randrange(10**6)),
+}
+
+
+def BenchmarkRequests(schemas: Dict[str, JSON], count: int) -> List[Tuple[str, str, str]]:
+    """Generate a mix of requests, as (endpoint, method, URL) triples."""
+    rnd = random.Random(42)
+    names = sorted(schemas)
+    weights = [BENCHMARK_WEIGHTS.get(name, 1) for name in names]
+    requests = []
+    for name in rnd.choices(names, weights, k=count):
+        schema = schemas[name]
+        url = re.sub(r"{(.*?)}", lambda match: BENCHMARK_VALUES[match.group(1)](rnd),
+                     schema['url'])
+        if schema['query_params']:
+            url += '?apikey=KEY'
+        requests.append((name, schema['method'], url))
+    return requests
+
+
+def Benchmark(schemas: Dict[str, JSON], count: int):
+    """Compare the trie router to matching the regexps of the templates in turn."""
+    requests = BenchmarkRequests(schemas, count)
+    routers = {'regexps': RegexRouter(schemas), 'trie': UrlRouter(schemas)}
+    elapsed = {}
+    for name, router in routers.items():
+        match = router.Match
+        start = time.perf_counter()
+        results = [match(method, url) for _, method, url in requests]
+        elapsed[name] = time.perf_counter() - start
+        mismatches = sum(1 for (endpoint, _, _), result in zip(requests, results)
+                         if result is None or result[0] != endpoint)
+        print("{:10} {:8.3f}s {:10.0f} requests/s {:8.2f} us/request, {} misrouted".format(
+            name, elapsed[name], count / elapsed[name], elapsed[name] / count * 1e6,
+            mismatches))
+    print("Speedup: {:.1f}x".format(elapsed['regexps'] / elapsed['trie']))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('requests', nargs='*',
+                        help="Requests to route, as METHOD:URL, e.g. GET:/v1/accounts/123.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark the router on a mix of requests.")
+    parser.add_argument('--benchmark_count', action='store', type=int, default=200000,
+                        help="Number of requests of the benchmark.")
+    args = parser.parse_args()
+
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    if args.benchmark:
+        Benchmark(schemas, args.benchmark_count)
+        return
+
+    router = UrlRouter(schemas)
+    for request in args.requests:
+        method, _, url = request.partition(':')
+        print("{} {}: {}".format(method, url, router.Match(method, url)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""Validate archived logs of API exchanges against the schemas, in bulk.
+
+The archives are JSONL files with one request/response exchange per line. Each
+record is a JSON object with the following fields:
+
+  endpoint: The name of the endpoint (optional if 'method' and 'url' are present).
+  method: The HTTP method of the request, e.g. "GET".
+  url: The URL of the request, e.g. "https://api.tdameritrade.com/v1/accounts/123".
+  type: The name of the top-level type of the body (optional).
+  request: The body of the request, for endpoints with a request payload.
+  response: The body of the response, for endpoints with a response payload.
+
+The file is sharded by byte ranges across a pool of processes, each of which
+compiles the validators once and validates the records whose lines start within
+its range. The results are per-endpoint counts of failures and their locations.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+import convert_ameritrade_schemas
+import generate_validators
+import url_router
+import validate_stream
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples used in the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+# Number of shards per process, to balance the load across uneven records.
+SHARDS_PER_JOB = 4
+
+
+class EndpointStats:
+    """Per-endpoint validation results.
+
+    Holds the number of records, the number of failed records and a mapping of
+    (location, message) errors to their count and the offsets of a few of the
+    failing records. The array indices and map keys in the locations are
+    collapsed to '[*]' so they aggregate.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.failures = 0
+        self.errors = {}
+
+
+class Router:
+    """Route a record to its endpoint schema and its validator.
+
+    If `validate` is false, the validators aren't compiled, for routing only.
+    """
+
+    def __init__(self, schemas: Dict[str, JSON], validate: bool = True):
+        self.schemas = schemas
+        self.validators = generate_validators.CompileValidators(schemas) if validate else {}
+
+        self.router = url_router.UrlRouter(schemas)
+
+    def Endpoint(self, record: JSON) -> Optional[str]:
+        """Return the name of the endpoint of a record."""
+        name = record.get('endpoint')
+        if name is not None:
+            return name if name in self.schemas else None
+        route = self.router.Match(record.get('method', 'GET'), record.get('url', ''))
+        return route[0] if route else None
+
+    def Validate(self, name: str, record: JSON) -> List[generate_validators.Error]:
+        """Validate the body of a record against its endpoint's schema."""
+        schema = self.schemas[name]
+        direction = 'response' if 'response' in schema else 'request'
+        body = record.get(direction)
+        if body is None:
+            return []
+        validators = self.validators[name]
+        if not validators:
+            return [('', "unexpected body")]
+
+        type_name = record.get('type')
+        if type_name is None:
+            type_name = validate_stream.ROOT_TYPES.get(name)
+        if type_name is None and len(validators) == 1:
+            type_name, = validators
+
+        # Many endpoints return a list of their type, e.g. GetAccounts.
+        if isinstance(body, list):
+            items = [("[{}]".format(index), item) for index, item in enumerate(body)]
+        else:
+            items = [('', body)]
+
+        # The quotes are returned in a map by symbol, and typed by asset type.
+        if type_name is None and isinstance(body, dict):
+            items = [("[{!r}]".format(key), item) for key, item in body.items()]
+
+        errors = []
+        for prefix, item in items:
+            item_type = type_name or QuoteType(validators, item)
+            if item_type not in validators:
+                errors.append((prefix, "unknown type {!r}".format(item_type)))
+                continue
+            for loc, message in validators[item_type](item) or []:
+                errors.append((prefix + loc, message))
+        return errors
+
+
+def QuoteType(validators: Dict[str, generate_validators.Validator],
+              value: JSON) -> Optional[str]:
+    """Return the name of the type of a quote, from its asset type."""
+    if not isinstance(value, dict) or not isinstance(value.get('assetType'), str):
+        return None
+    camel = generate_validators.CamelCase(value['assetType']).lower()
+    names = {type_name.replace(' ', '').lower(): type_name for type_name in validators}
+    if camel in names:
+        return names[camel]
+    for key, type_name in sorted(names.items()):
+        if key.startswith(camel):
+            return type_name
+    return None
+
+
+def CollapseLocation(loc: str) -> str:
+    """Collapse the array indices and map keys of a location to aggregate it."""
+    return re.sub(r"\[(\d+|'[^']*'|\"[^\"]*\")\]", "[*]", loc)
+
+
+def IterShardLines(filename: str, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+    """Yield the (offset, line) pairs of the lines starting within [start, end)."""
+    with open(filename, 'rb') as infile:
+        if start > 0:
+            # Skip the line straddling the start; it belongs to the previous shard.
+            infile.seek(start - 1)
+            infile.readline()
+        offset = infile.tell()
+        while offset < end:
+            line = infile.readline()
+            if not line:
+                break
+            yield offset, line
+            offset += len(line)
+
+
+# The router of each worker process, created once by the pool initializer.
+_router = None
+
+
+def InitWorker(schemas_dir: str):
+    global _router
+    _router = Router(generate_validators.ReadSchemas(schemas_dir))
+
+
+def ValidateShard(filename: str, start: int, end: int,
+                  max_examples: int) -> Dict[str, EndpointStats]:
+    """Validate the records of a shard of a file. Runs in a worker process."""
+    stats = {}
+    for offset, line in IterShardLines(filename, start, end):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            name = _router.Endpoint(record)
+        except (ValueError, AttributeError):
+            record, name = None, None
+        if name is None:
+            name = '<unknown>'
+            errors = [('', "invalid record" if record is None else "unknown endpoint")]
+        else:
+            errors = _router.Validate(name, record)
+
+        estats = stats.get(name)
+        if estats is None:
+            estats = stats[name] = EndpointStats()
+        estats.records += 1
+        if errors:
+            estats.failures += 1
+            for loc, message in errors:
+                key = (CollapseLocation(loc), message)
+                offsets = estats.errors.setdefault(key, [0, []])
+                offsets[0] += 1
+                if len(offsets[1]) < max_examples:
+                    offsets[1].append(offset)
+    return stats
+
+
+def MergeStats(total: Dict[str, EndpointStats], stats: Dict[str, EndpointStats],
+               max_examples: int):
+    """Accumulate the stats of a shard into the totals."""
+    for name, estats in stats.items():
+        tstats = total.get(name)
+        if tstats is None:
+            total[name] = estats
+            continue
+        tstats.records += estats.records
+        tstats.failures += estats.failures
+        for key, (count, offsets) in estats.errors.items():
+            toffsets = tstats.errors.setdefault(key, [0, []])
+            toffsets[0] += count
+            toffsets[1][:] = (toffsets[1] + offsets)[:max_examples]
+
+
+def ValidateLogs(filename: str, schemas_dir: str, jobs: int,
+                 max_examples: int = 5) -> Dict[str, EndpointStats]:
+    """Validate a JSONL archive across a pool of `jobs` processes."""
+    size = path.getsize(filename)
+    num_shards = max(1, jobs * SHARDS_PER_JOB)
+    bounds = [size * index // num_shards for index in range(num_shards + 1)]
+    total = {}
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=InitWorker, initargs=(schemas_dir,)) as executor:
+        futures = [executor.submit(ValidateShard, filename, start, end, max_examples)
+                   for start, end in zip(bounds, bounds[1:])
+                   if start < end]
+        # Merge in submission order, so the sampled offsets are deterministic.
+        for future in futures:
+            MergeStats(total, future.result(), max_examples)
+    return total
+
+
+def PrintStats(stats: Dict[str, EndpointStats]):
+    """Print a report of the failures."""
+    print("{:40} {:>10} {:>10}".format("Endpoint", "records", "failures"))
+    for name, estats in sorted(stats.items()):
+        print("{:40} {:10d} {:10d}".format(name, estats.records, estats.failures))
+        for (loc, message), (count, offsets) in sorted(estats.errors.items()):
+            print("    {:8d}  {}: {}  (offsets: {})".format(
+                count, loc or '.', message, ', '.join(map(str, offsets))))
+
+
+def StatsToJson(stats: Dict[str, EndpointStats]) -> JSON:
+    """Convert the stats to a JSON-serializable form."""
+    return {name: {'records': estats.records,
+                   'failures': estats.failures,
+                   'errors': [{'location': loc, 'message': message,
+                               'count': count, 'offsets': offsets}
+                              for (loc, message), (count, offsets)
+                              in sorted(estats.errors.items())]}
+            for name, estats in sorted(stats.items())}
+
+
+def WriteSyntheticLog(filename: str, schemas: Dict[str, JSON], raw_dir: str,
+                      num_records: int):
+    """Write an archive of exchanges replicated from the examples."""
+    records = []
+    for name, schema in sorted(schemas.items()):
+        example_filename = path.join(raw_dir, name, 'example.json')
+        if not path.exists(example_filename):
+            continue
+        direction = 'response' if 'response' in schema else 'request'
+        url = re.sub(r"\{.*?\}", "123", schema['url'])
+        for type_name, value in sorted(
+                convert_ameritrade_schemas.ReadExample(example_filename).items()):
+            records.append(json.dumps({'method': schema['method'], 'url': url,
+                                       'type': type_name, direction: value}))
+    with open(filename, 'w') as outfile:
+        for index in range(num_records):
+            outfile.write(records[index % len(records)])
+            outfile.write('\n')
+
+
+def Benchmark(schemas_dir: str, raw_dir: str, num_records: int):
+    """Measure the throughput of validation by number of processes."""
+    schemas = generate_validators.ReadSchemas(schemas_dir)
+    with tempfile.NamedTemporaryFile(suffix='.jsonl') as tmpfile:
+        WriteSyntheticLog(tmpfile.name, schemas, raw_dir, num_records)
+        print("{} records, {:.1f} MB".format(
+            num_records, path.getsize(tmpfile.name) / 2**20))
+        print("{:>6} {:>12} {:>12} {:>8}".format("jobs", "seconds", "records/s", "speedup"))
+        jobs = 1
+        baseline = None
+        while jobs <= (os.cpu_count() or 1):
+            start = time.perf_counter()
+            ValidateLogs(tmpfile.name, schemas_dir, jobs)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print("{:6d} {:12.2f} {:12.0f} {:7.2f}x".format(
+                jobs, elapsed, num_records / elapsed, baseline / elapsed))
+            jobs *= 2
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filenames', nargs='*',
+                        help="JSONL archives of exchanges to validate.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('-j', '--jobs', action='store', type=int,
+                        default=os.cpu_count(),
+                        help="Number of processes to validate with.")
+    parser.add_argument('--max_examples', action='store', type=int, default=5,
+                        help="Maximum number of record offsets to report per error.")
+    parser.add_argument('--json', action='store_true',
+                        help="Output the results as JSON.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Measure the throughput on a synthetic archive by number of jobs.")
+    parser.add_argument('--benchmark_records', action='store', type=int, default=200000,
+                        help="Number of records in the synthetic archive.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples from, for the benchmark.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        Benchmark(args.clean_schemas, args.raw_downloaded_data, args.benchmark_records)
+        return
+
+    for filename in args.filenames:
+        logging.info("Validating %s", filename)
+        stats = ValidateLogs(filename, args.clean_schemas, args.jobs, args.max_examples)
+        if args.json:
+            print(json.dumps({filename: StatsToJson(stats)}, indent=4, sort_keys=True))
+        else:
+            PrintStats(stats)
+
+
+if __name__ == '__main__':
+    main()
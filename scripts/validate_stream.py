@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""Validate a large response body incrementally, as it arrives.
+
+Bodies like a full GetOptionChain or a multi-year GetPriceHistory run to many
+megabytes. Instead of decoding the entire body before checking it against its
+schema, this tokenizes the body in chunks and validates each token as it is
+seen. The first violation is reported as soon as it is found, and the memory
+used is bounded by the nesting depth of the document, not its size.
+"""
+__author__ = 'Martin Blais <blais@furius.ca>'
+__license__ = "GNU GPLv2"
+
+from os import path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import argparse
+import codecs
+import json
+import logging
+import re
+import sys
+import time
+import tracemalloc
+
+import convert_ameritrade_schemas
+import generate_validators
+from convert_ameritrade_schemas import JSON
+
+
+# Sanitized and cleaned up schemas.
+_ROOT = path.normpath(path.dirname(path.dirname(__file__)))
+DEFAULT_INPUT = path.join(_ROOT, 'schemas')
+
+# Raw downloads, for the examples used in the benchmark.
+DEFAULT_RAW = path.join(_ROOT, 'raw')
+
+# The type of the body of endpoints whose schema has more than one top-level
+# type (the others are the types of its nested fields).
+ROOT_TYPES = {
+    'GetOptionChain': 'OptionChain',
+}
+
+# Default size of the chunks read from files.
+CHUNK_SIZE = 64 * 1024
+
+# Documents the tokenizer must accept, and reject, for --check.
+VALID_DOCUMENTS = [
+    '{}', '[]', '[1, 2.5, -3e2]', '{"a": [true, false, null], "b": {"c": "\\u00e9"}}',
+    ' "text" ', '0',
+]
+INVALID_DOCUMENTS = [
+    '[1,]', '{"a":1,}', '[,1]', '{,}', '[1 2]', '{"a" 1}', '{"a":}', '{"a"}',
+    '[1]]', '{"a":1', '1 2', '', '[tx, 1]', '[1.2.3]', '[nul]', '"abc',
+]
+
+
+# Tokens produced by the tokenizer.
+START_OBJECT, END_OBJECT, START_ARRAY, END_ARRAY, KEY, VALUE = range(6)
+Token = Tuple[int, JSON]
+
+
+class ValidationError(ValueError):
+    """A violation of the schema, with its location in the document."""
+
+    def __init__(self, loc: str, message: str):
+        super().__init__("{}: {}".format(loc or '.', message))
+        self.loc = loc
+        self.message = message
+
+
+_TOKEN_RE = re.compile(r'''
+  [ \t\n\r]*
+  (?:
+    ([{}\[\],:])
+  |
+    "((?:[^"\\]|\\.)*)"
+  |
+    (-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?)
+  |
+    (true|false|null)
+  )
+''', re.VERBOSE)
+
+# The prefix of a token running to the end of a chunk, which may be completed by
+# the next one: a string, a literal or a number.
+_PARTIAL_RE = re.compile(r'''
+  [ \t\n\r]*
+  (?:
+    "(?:[^"\\]|\\.)*\\?
+  |
+    t(?:r(?:u)?)?|f(?:a(?:l(?:s)?)?)?|n(?:u(?:l)?)?
+  |
+    -?[0-9]*(?:\.[0-9]*)?(?:[eE][+-]?[0-9]*)?
+  )
+  \Z
+''', re.VERBOSE)
+
+_LITERALS = {'true': True, 'false': False, 'null': None}
+
+
+class Tokenizer:
+    """An incremental JSON tokenizer, fed with chunks of text.
+
+    Only the incomplete token at the end of a chunk is held over to the next
+    one. Keys are distinguished from string values; commas and colons are
+    checked for placement and not emitted.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        # A stack of the open containers, '{' or '['.
+        self.containers = []
+        # True if the next string in an object is a key.
+        self.expect_key = False
+        # True if a key was seen and a colon is expected next.
+        self.expect_colon = False
+        # True if a value was seen and a separator or end is expected next.
+        self.after_value = False
+        # True if a comma was seen and a key or value is expected next.
+        self.after_comma = False
+        self.done = False
+
+    def Feed(self, text: str, final: bool = False) -> Iterator[Token]:
+        """Tokenize a chunk of text, yielding tokens."""
+        buf = self.buffer + text if self.buffer else text
+        pos = 0
+        end = len(buf)
+        match_token = _TOKEN_RE.match
+        containers = self.containers
+        while True:
+            match = match_token(buf, pos)
+            if match is None:
+                rest = buf[pos:]
+                if not rest.strip():
+                    pos = end
+                    break
+                if not final and _PARTIAL_RE.match(buf, pos):
+                    break  # Incomplete string, number or literal.
+                raise ValueError("Invalid JSON at {!r}".format(rest[:20]))
+            pos = match.end()
+            if not final and match.group(3) is not None and (
+                    pos == end or buf[pos] in '.eE' and _PARTIAL_RE.match(buf, match.start())):
+                pos = match.start()
+                break  # The number may continue in the next chunk.
+
+            punct = match.group(1)
+            if punct is not None:
+                if punct == ',':
+                    if not self.after_value or not containers:
+                        raise ValueError("Unexpected ','")
+                    self.after_value = False
+                    self.after_comma = True
+                    self.expect_key = containers[-1] == '{'
+                elif punct == ':':
+                    if not self.expect_colon:
+                        raise ValueError("Unexpected ':'")
+                    self.expect_colon = False
+                elif punct in '{[':
+                    self.CheckValuePosition()
+                    containers.append(punct)
+                    self.expect_key = punct == '{'
+                    self.after_value = False
+                    self.after_comma = False
+                    yield (START_OBJECT if punct == '{' else START_ARRAY, None)
+                else:
+                    opener = '{' if punct == '}' else '['
+                    if containers[-1:] != [opener] or self.after_comma or (
+                            not self.after_value and not self.expect_key and opener == '{'):
+                        raise ValueError("Unexpected {!r}".format(punct))
+                    containers.pop()
+                    self.after_value = True
+                    self.expect_key = False
+                    if not containers:
+                        self.done = True
+                    yield (END_OBJECT if punct == '}' else END_ARRAY, None)
+                continue
+
+            literal = match.group(6)
+            string = match.group(2)
+            if string is not None:
+                if '\\' in string:
+                    string = json.loads('"{}"'.format(string))
+                if self.expect_key:
+                    self.expect_key = False
+                    self.expect_colon = True
+                    self.after_comma = False
+                    yield (KEY, string)
+                    continue
+                value = string
+            elif literal is not None:
+                value = _LITERALS[literal]
+            elif match.group(4) or match.group(5):
+                value = float(match.group(3))
+            else:
+                value = int(match.group(3))
+            self.CheckValuePosition()
+            self.after_value = True
+            self.after_comma = False
+            if not containers:
+                self.done = True
+            yield (VALUE, value)
+
+        self.buffer = buf[pos:]
+        if final and (self.buffer.strip() or containers or not self.done):
+            raise ValueError("Truncated JSON document")
+
+    def CheckValuePosition(self):
+        """Check that a value is allowed at the current position."""
+        if (self.after_value or self.expect_key or self.expect_colon or
+                (self.done and not self.containers)):
+            raise ValueError("Unexpected value")
+
+
+class StreamValidator:
+    """Validate a JSON document against a type, one chunk at a time.
+
+    Objects and arrays in the document push a frame holding their type on a
+    stack; scalars are checked against their expected type as they are seen.
+    Polymorphic objects are checked against the union of the fields of their
+    subclasses, since the discriminator may appear after the other fields.
+    """
+
+    def __init__(self, dtype: JSON, subtypes: Dict[str, JSON] = None):
+        self.dtype = dtype
+        self.subtypes = subtypes or {}
+        self.tokenizer = Tokenizer()
+        self.decoder = codecs.getincrementaldecoder('utf8')()
+        # A stack of frames for the open containers. Each is a list of
+        # [dtype, key or index, seen required field names].
+        self.stack = []
+        # A cache of the field types of each object type, by id.
+        self.fields_cache = {}
+
+    def Feed(self, chunk: Union[str, bytes]):
+        """Validate the next chunk of the document."""
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        self.Process(self.tokenizer.Feed(chunk))
+
+    def Close(self):
+        """Validate the end of the document."""
+        self.Process(self.tokenizer.Feed(self.decoder.decode(b'', final=True), final=True))
+
+    def Location(self) -> str:
+        """Return the location of the current value."""
+        parts = []
+        for dtype, key, _ in self.stack:
+            if key is None:
+                continue
+            if isinstance(key, int):
+                parts.append('[{}]'.format(key))
+            elif dtype is not None and dtype['type'] == 'object' and 'properties' not in dtype:
+                parts.append('[{!r}]'.format(key))
+            else:
+                parts.append('.{}'.format(key))
+        return ''.join(parts)
+
+    def Fields(self, dtype: JSON) -> Optional[Dict[str, JSON]]:
+        """Return the field types of an object type, or None if it's a map."""
+        fields = self.fields_cache.get(id(dtype))
+        if fields is None:
+            if dtype.get('properties'):
+                fields = dict(dtype['properties'])
+                if 'discriminator' in dtype:
+                    dispatch = generate_validators.DiscriminatorSubtypes(dtype, self.subtypes)
+                    for alt_fields in dispatch.values():
+                        for field_name, ftype in alt_fields.items():
+                            fields.setdefault(field_name, ftype)
+            else:
+                fields = {}
+            self.fields_cache[id(dtype)] = fields
+        return fields or None
+
+    def ExpectedType(self) -> Tuple[Optional[JSON], bool]:
+        """Return the type of the next value and whether it is a field."""
+        if not self.stack:
+            return self.dtype, False
+        frame = self.stack[-1]
+        dtype = frame[0]
+        if dtype is None:
+            return None, False
+        if dtype['type'] == 'array':
+            frame[1] += 1
+            return dtype.get('items') or None, False
+        fields = self.Fields(dtype)
+        if fields is None:
+            return dtype.get('additionalProperties') or None, False
+        ftype = fields.get(frame[1])
+        if ftype is None:
+            self.Fail("unknown field")
+        if frame[2] is not None:
+            frame[2].add(frame[1])
+        return ftype, True
+
+    def Fail(self, message: str):
+        raise ValidationError(self.Location(), message)
+
+    def Process(self, tokens: Iterator[Token]):
+        """Validate a sequence of tokens."""
+        stack = self.stack
+        for kind, value in tokens:
+            if kind == KEY:
+                stack[-1][1] = value
+                continue
+            if kind == END_OBJECT or kind == END_ARRAY:
+                dtype, _, seen = stack.pop()
+                if seen is not None:
+                    missing = sorted(field_name
+                                     for field_name, ftype in self.Fields(dtype).items()
+                                     if ftype.get('required') is True and field_name not in seen)
+                    if missing:
+                        stack.append([dtype, missing[0], None])
+                        self.Fail("missing required field")
+                continue
+
+            dtype, is_field = self.ExpectedType()
+            if kind == VALUE:
+                if dtype is None or (value is None and is_field):
+                    continue
+                errors = []
+                generate_validators.ValidateValue(dtype, value, '', self.subtypes, errors)
+                if errors:
+                    self.Fail(errors[0][1])
+                continue
+
+            expected = 'object' if kind == START_OBJECT else 'array'
+            if dtype is not None and dtype['type'] != expected:
+                self.Fail("expected {}, got {}".format(dtype['type'], expected))
+            seen = None
+            if dtype is not None and kind == START_OBJECT:
+                fields = self.Fields(dtype)
+                if fields and any(ftype.get('required') is True
+                                  for ftype in fields.values()):
+                    seen = set()
+            stack.append([dtype, None if kind == START_OBJECT else -1, seen])
+
+
+def ValidateFile(filename: str, dtype: JSON, subtypes: Dict[str, JSON],
+                 chunk_size: int = CHUNK_SIZE):
+    """Validate a file incrementally. Raises ValidationError on a violation."""
+    validator = StreamValidator(dtype, subtypes)
+    with open(filename, 'rb') as infile:
+        while True:
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                break
+            validator.Feed(chunk)
+    validator.Close()
+
+
+def GetRootType(schema: JSON, type_name: Optional[str] = None) -> Tuple[JSON, Dict[str, JSON]]:
+    """Return the type of the body of an endpoint and its subtypes."""
+    top, sub = generate_validators.GetMessages(schema)
+    if type_name is None:
+        type_name = ROOT_TYPES.get(schema['name'])
+    if type_name is None:
+        if len(top) != 1:
+            raise ValueError("Ambiguous root type for {}: {}".format(
+                schema['name'], sorted(top)))
+        type_name, = top
+    return {'type': 'object', 'properties': top[type_name]}, sub
+
+
+def SyntheticBody(schema: JSON, raw_dir: str, size: int) -> str:
+    """Scale up the example of an endpoint to a body of about `size` bytes.
+
+    The GetPriceHistory candles and the GetOptionChain expiration maps are
+    replicated until the desired size is reached.
+    """
+    examples = convert_ameritrade_schemas.ReadExample(
+        path.join(raw_dir, schema['name'], 'example.json'))
+    if schema['name'] == 'GetPriceHistory':
+        body = examples['CandleList']
+        candle = body['candles'][0]
+        count = size // len(json.dumps(candle)) + 1
+        body['candles'] = [dict(candle, datetime=index) for index in range(count)]
+    elif schema['name'] == 'GetOptionChain':
+        body = examples['OptionChain']
+        body['underlying']['exchangeName'] = 'NAS'
+        option = examples['Option']
+        count = size // len(json.dumps(option)) // 2 + 1
+        strikes = {"{:.1f}".format(strike): [option] for strike in range(count)}
+        body['callExpDateMap'] = {'2021-01-15:3': strikes}
+        body['putExpDateMap'] = {'2021-01-15:3': strikes}
+    else:
+        raise ValueError("No synthetic body for {}".format(schema['name']))
+    return json.dumps(body)
+
+
+def Tokenize(text: str, chunk_size: int) -> List[Token]:
+    """Tokenize a whole document, fed in chunks of a size."""
+    tokenizer = Tokenizer()
+    tokens = []
+    for index in range(0, len(text), chunk_size):
+        tokens.extend(tokenizer.Feed(text[index:index + chunk_size]))
+    tokens.extend(tokenizer.Feed('', final=True))
+    return tokens
+
+
+def Check() -> int:
+    """Tokenize the valid and invalid documents, whole and by character.
+
+    Return the number of documents accepted or rejected wrongly.
+    """
+    num_wrong = 0
+    for valid, documents in (True, VALID_DOCUMENTS), (False, INVALID_DOCUMENTS):
+        for text in documents:
+            for chunk_size in max(len(text), 1), 1:
+                try:
+                    Tokenize(text, chunk_size)
+                    accepted = True
+                except ValueError:
+                    accepted = False
+                if accepted != valid:
+                    logging.error("%s document %r, in chunks of %d",
+                                  "Rejected valid" if valid else "Accepted invalid",
+                                  text, chunk_size)
+                    num_wrong += 1
+
+    # An invalid token must be rejected as soon as it is complete, rather than
+    # held over as the prefix of a token until the end of the document.
+    text = '[tx, ' + '1, ' * 300 + '1]'
+    tokenizer = Tokenizer()
+    rejected_at = None
+    for index in range(0, len(text), 4):
+        try:
+            list(tokenizer.Feed(text[index:index + 4]))
+        except ValueError:
+            rejected_at = index
+            break
+    if rejected_at is None or rejected_at > 4:
+        logging.error("Invalid token of %r rejected at offset %s, in chunks of 4",
+                      text[:12], rejected_at)
+        num_wrong += 1
+    return num_wrong
+
+
+def Benchmark(schemas: Dict[str, JSON], raw_dir: str, size: int):
+    """Compare streaming validation to decoding and validating whole bodies."""
+    print("{:20} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+        "Endpoint", "MB", "load s", "stream s", "load MB", "stream MB"))
+    for name in 'GetPriceHistory', 'GetOptionChain':
+        dtype, sub = GetRootType(schemas[name])
+        data = SyntheticBody(schemas[name], raw_dir, size).encode('utf8')
+
+        def RunLoad():
+            errors = []
+            generate_validators.ValidateValue(dtype, json.loads(data), '', sub, errors)
+        def RunStream():
+            validator = StreamValidator(dtype, sub)
+            for index in range(0, len(data), CHUNK_SIZE):
+                validator.Feed(data[index:index + CHUNK_SIZE])
+            validator.Close()
+
+        # Time and trace the memory of each separately; tracing is slow.
+        results = []
+        for func in RunLoad, RunStream:
+            start = time.perf_counter()
+            func()
+            results.append(time.perf_counter() - start)
+        for func in RunLoad, RunStream:
+            tracemalloc.start()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append(peak / 2**20)
+
+        print("{:20} {:8.1f} {:12.2f} {:12.2f} {:12.2f} {:12.2f}".format(
+            name, len(data) / 2**20, *results))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('endpoint', nargs='?',
+                        help="Name of the endpoint whose response to validate.")
+    parser.add_argument('filenames', nargs='*',
+                        help="Response bodies to validate.")
+    parser.add_argument('--type', action='store',
+                        help="Name of the top-level type of the body, if ambiguous.")
+    parser.add_argument('--clean_schemas', action='store',
+                        default=DEFAULT_INPUT,
+                        help="Directory path to read the clean schemas from.")
+    parser.add_argument('--check', action='store_true',
+                        help="Check the tokenizer on valid and invalid documents.")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Benchmark against whole-body validation on synthetic bodies.")
+    parser.add_argument('--benchmark_size', action='store', type=int, default=20 * 2**20,
+                        help="Size of the synthetic bodies for the benchmark, in bytes.")
+    parser.add_argument('--raw_downloaded_data', action='store',
+                        default=DEFAULT_RAW,
+                        help="Directory path to read the examples from, for the benchmark.")
+    args = parser.parse_args()
+
+    if args.check:
+        if Check():
+            raise SystemExit(1)
+        logging.info("Tokenizer accepts the valid documents and rejects the invalid ones")
+        return
+
+    schemas = generate_validators.ReadSchemas(args.clean_schemas)
+    if args.benchmark:
+        Benchmark(schemas, args.raw_downloaded_data, args.benchmark_size)
+        return
+    if not args.endpoint:
+        parser.error("An endpoint name is required.")
+
+    dtype, sub = GetRootType(schemas[args.endpoint], args.type)
+    failed = False
+    for filename in args.filenames:
+        try:
+            ValidateFile(filename, dtype, sub)
+        except ValueError as exc:
+            print("{}: {}".format(filename, exc))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()